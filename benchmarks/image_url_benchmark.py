@@ -0,0 +1,85 @@
+"""
+Benchmark of serializing 1,000 timeline rows with image URLs
+
+Compares building every URL with storage.url() and parsing the renditions
+of every row, as the serializers used to, against the memoized URL prefix
+and renditions of sevchefs_api.images, for the local media storage and for
+S3BotoStorage. Nothing is sent to S3, unsigned boto URLs are built locally.
+
+    $ python benchmarks/image_url_benchmark.py
+"""
+import json
+import os
+import sys
+import timeit
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "the7chefs.settings")
+
+import django
+django.setup()
+
+from django.core.files.storage import FileSystemStorage
+from storages.backends.s3boto import S3BotoStorage
+
+from sevchefs_api import images
+from sevchefs_api.models import ActivityTimeline
+from sevchefs_api.serializers import ActivityTimelineSerializer
+
+
+ROWS = 1000
+IMAGE_FIELDS = ('main_object_image', 'target_object_image')
+
+
+def renditions_of(key):
+    stem = os.path.splitext(key)[0]
+    return json.dumps({
+        'source': key,
+        'jpeg': {str(width): '%s.w%d.jpeg' % (stem, width) for width in (160, 320, 640, 1280)},
+        'webp': {str(width): '%s.w%d.webp' % (stem, width) for width in (160, 320, 640, 1280)},
+    })
+
+
+def make_rows():
+    rows = []
+    for i in range(ROWS):
+        avatar = 'user/%d/avatar-%d.jpg' % (i % 50, i)
+        image = 'recipe/%d/image-%d.jpg' % (i, i)
+        rows.append(ActivityTimeline(id=i, user_id=i % 50, event_type=ActivityTimeline.FAVOURITE,
+                                     main_object_image=avatar, main_object_image_renditions=renditions_of(avatar),
+                                     target_object_image=image, target_object_image_renditions=renditions_of(image)))
+    return rows
+
+
+def serialize(rows):
+    return ActivityTimelineSerializer(rows, many=True).data
+
+
+def use_storage(storage):
+    for field in IMAGE_FIELDS:
+        ActivityTimeline._meta.get_field(field).storage = storage
+    images.clear_url_prefixes()
+
+
+def main():
+    number = 10
+    rows = make_rows()
+    storages = (
+        ('local media', FileSystemStorage(location='/tmp', base_url='/media/')),
+        ('s3boto', S3BotoStorage(access_key='benchmark', secret_key='benchmark', bucket='benchmark-bucket')),
+    )
+    print('%d timeline rows, 4 image URLs each' % ROWS)
+    for storage_label, storage in storages:
+        use_storage(storage)
+        before = mock.patch.multiple(images, get_storage_url=lambda storage, key: storage.url(key),
+                                     load_renditions=images.load_renditions.__wrapped__)
+        with before:
+            seconds_before = timeit.timeit(lambda: serialize(rows), number=number)
+        seconds_after = timeit.timeit(lambda: serialize(rows), number=number)
+        print('%-12s storage.url %8.1f ms   memoized prefix %8.1f ms' % (
+            storage_label, seconds_before * 1000 / number, seconds_after * 1000 / number))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark of password hashing for signup and login
+
+Reports hashes/sec of Django's PBKDF2 against the configured argon2id, then
+p50/p99 latency of checking passwords from concurrent threads, hashing inline
+against hashing in the PASSWORD_HASH_WORKERS process pool.
+
+    $ PASSWORD_HASH_WORKERS=2 python benchmarks/password_hashing_benchmark.py
+"""
+import os
+import sys
+import threading
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "the7chefs.settings")
+
+import django
+django.setup()
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+
+from sevchefs_api.hashing import check_user_password, get_password_hash_pool
+
+
+PASSWORD = 'correct horse battery staple'
+THREADS = 8
+LOGINS_PER_THREAD = 25
+
+
+def hashes_per_second(hasher, number=20):
+    seconds = timeit.timeit(lambda: make_password(PASSWORD, hasher=hasher), number=number)
+    return number / seconds
+
+
+def login_latencies(workers):
+    # an unsaved user, so the benchmark measures hashing and not the database
+    user = User(username='benchmark', password=make_password(PASSWORD))
+    latencies = []
+    lock = threading.Lock()
+
+    def log_in():
+        for i in range(LOGINS_PER_THREAD):
+            start = time.perf_counter()
+            check_user_password(user, PASSWORD)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    settings.PASSWORD_HASH_WORKERS = workers
+    threads = [threading.Thread(target=log_in) for i in range(THREADS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    get_password_hash_pool().shutdown()
+    return sorted(latencies), elapsed
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    print('argon2id t=%d m=%dKiB p=%d' % (settings.ARGON2_TIME_COST, settings.ARGON2_MEMORY_COST,
+                                           settings.ARGON2_PARALLELISM))
+    for hasher in ('pbkdf2_sha256', 'argon2'):
+        print('%-15s %8.1f hashes/sec' % (hasher, hashes_per_second(hasher)))
+
+    pool_workers = settings.PASSWORD_HASH_WORKERS or os.cpu_count()
+    print('%d threads x %d logins' % (THREADS, LOGINS_PER_THREAD))
+    for label, workers in (('inline', 0), ('pool of %d' % pool_workers, pool_workers)):
+        latencies, elapsed = login_latencies(workers)
+        print('%-15s p50 %7.1f ms  p99 %7.1f ms  %7.1f logins/sec' % (
+            label, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+            len(latencies) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Micro-benchmark of get_request_body_param on a large instruction body
+
+Compares decoding and json.loads-ing the whole body on every call, as the
+helper used to, against parsing it once through DRF's cached request.data.
+
+    $ python benchmarks/request_body_benchmark.py
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "the7chefs.settings")
+
+import django
+django.setup()
+
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from sevchefs_api.utils import get_request_body_param
+
+
+PARAMS = ('recipe_id', 'step_num', 'instruction', 'duration_minute', 'duration_hour')
+BODY = json.dumps({
+    'recipe_id': 1,
+    'step_num': 1,
+    'instruction': 'Stir the pot gently. ' * 2000,
+    'duration_minute': 10,
+    'duration_hour': 0,
+    'tag_ids': list(range(5000)),
+})
+
+
+def get_request_body_param_reparse(request, param, return_on_error):
+    try:
+        body = json.loads(request.body.decode('utf-8'))
+    except json.decoder.JSONDecodeError:
+        return return_on_error
+    return body.get(param, return_on_error)
+
+
+def make_request():
+    http_request = APIRequestFactory().post('/', BODY, content_type='application/json')
+    return Request(http_request, parsers=[JSONParser()])
+
+
+def read_params(get_param):
+    request = make_request()
+    for param in PARAMS:
+        get_param(request, param, None)
+
+
+def main():
+    number = 200
+    print('body size: %d bytes, %d params read per request' % (len(BODY), len(PARAMS)))
+    for label, get_param in (('parse per call', get_request_body_param_reparse),
+                             ('parse once', get_request_body_param)):
+        seconds = timeit.timeit(lambda: read_params(get_param), number=number)
+        print('%-15s %8.3f ms/request' % (label, seconds * 1000 / number))
+
+
+if __name__ == '__main__':
+    main()
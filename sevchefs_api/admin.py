@@ -19,7 +19,7 @@ class UserProfileAdmin(admin.ModelAdmin):
 
 class ActivityTimelineAdmin(admin.ModelAdmin):
     model = ActivityTimeline
-    list_display = ('user', 'summary_text', 'target_user', 'main_object_image', 'target_object_image', 'datetime')
+    list_display = ('user', 'event_type', 'target_user', 'main_object_image', 'target_object_image', 'datetime')
 
 
 class RecipeCommentAdmin(admin.ModelAdmin):
@@ -0,0 +1,105 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from rest_framework.authentication import TokenAuthentication
+
+
+class TokenCache:
+    """
+    Process local LRU of token key to (user, token), so authenticating a
+    request does not query the database
+
+    Entries live for at most ttl seconds, which bounds how long another
+    process may keep accepting a token after a logout or deactivation there.
+    In this process the Token and User signals drop entries right away.
+    """
+
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.keys_by_user = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self.remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            user, token = entry[1], entry[2]
+        # views may cache relations such as userprofile on request.user,
+        # which must not leak into later requests
+        return copy.copy(user), token
+
+    def set(self, key, user, token):
+        with self.lock:
+            self.remove(key)
+            self.entries[key] = (time.monotonic() + self.ttl, user, token)
+            self.keys_by_user.setdefault(user.pk, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            keys = self.keys_by_user.get(entry[1].pk, set())
+            keys.discard(key)
+            if not keys:
+                self.keys_by_user.pop(entry[1].pk, None)
+
+    def invalidate_key(self, key):
+        with self.lock:
+            self.remove(key)
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            for key in list(self.keys_by_user.get(user_id, ())):
+                self.remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys_by_user.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self.entries),
+            }
+
+
+_token_cache = TokenCache()
+
+
+def get_token_cache():
+    return _token_cache
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that looks tokens up in the process local TokenCache
+    before falling back to the database
+    """
+
+    def authenticate_credentials(self, key):
+        cached = get_token_cache().get(key)
+        if cached is not None:
+            return cached
+
+        user, token = super(CachedTokenAuthentication, self).authenticate_credentials(key)
+        get_token_cache().set(key, copy.copy(user), token)
+        return user, token
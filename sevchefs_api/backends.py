@@ -0,0 +1,32 @@
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+
+from sevchefs_api.hashing import check_user_password, hash_password
+
+
+class EmailOrUsernameBackend(ModelBackend):
+    """
+    Authenticate with either an email, matched case-insensitively, or a
+    username, loading the user together with their auth token in one query
+    """
+
+    def authenticate(self, username=None, password=None, **kwargs):
+        if not username or password is None:
+            return None
+
+        users = User.objects.select_related('auth_token')
+        if '@' in username:
+            # backed by the upper(email) index of migration 0023 on Postgres
+            candidates = users.filter(email__iexact=username).order_by('id')
+        else:
+            candidates = users.filter(username=username)
+
+        candidates = list(candidates)
+        for user in candidates:
+            if check_user_password(user, password) and user.is_active:
+                return user
+
+        if not candidates:
+            # hash anyway so unknown accounts take as long as wrong passwords
+            hash_password(password)
+        return None
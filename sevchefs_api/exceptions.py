@@ -6,3 +6,15 @@ class NotAuthorized(APIException):
     status_code = status.HTTP_401_UNAUTHORIZED
     default_detail = 'Not found.'
     default_code = 'not_found'
+
+
+class SignupConflict(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = 'The username entered already exists'
+    default_code = 'signup_conflict'
+
+
+class PasswordHashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many logins and signups right now, try again in a moment'
+    default_code = 'password_hashing_busy'
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.hashers import BasePasswordHasher, mask_hash
+from django.utils.encoding import force_bytes, force_text
+from django.utils.translation import ugettext_noop as _
+
+
+class Argon2PasswordHasher(BasePasswordHasher):
+    """
+    Password hashing with argon2id, backported from the hasher Django 1.10
+    ships, with its cost read from the ARGON2_* settings
+
+    Argon2 is memory hard, so the same login latency buys far more resistance
+    to offline cracking than PBKDF2. Passwords hashed with another hasher or
+    other costs are rehashed the next time their user logs in.
+
+    The encoded value is "argon2" followed by the usual PHC string, e.g.
+    argon2$argon2id$v=19$m=19456,t=2,p=1$<salt>$<hash>
+    """
+    algorithm = 'argon2'
+    library = 'argon2'
+    hash_len = 16
+
+    @property
+    def time_cost(self):
+        return settings.ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.ARGON2_PARALLELISM
+
+    def encode(self, password, salt):
+        argon2 = self._load_library()
+        data = argon2.low_level.hash_secret(
+            force_bytes(password),
+            force_bytes(salt),
+            time_cost=self.time_cost,
+            memory_cost=self.memory_cost,
+            parallelism=self.parallelism,
+            hash_len=self.hash_len,
+            type=argon2.low_level.Type.ID,
+        )
+        return self.algorithm + force_text(data)
+
+    def verify(self, password, encoded):
+        argon2 = self._load_library()
+        algorithm, data = encoded.split('$', 1)
+        assert algorithm == self.algorithm
+        try:
+            return argon2.low_level.verify_secret(
+                force_bytes('$' + data),
+                force_bytes(password),
+                type=self.get_type(argon2, data),
+            )
+        except argon2.exceptions.VerificationError:
+            return False
+
+    def safe_summary(self, encoded):
+        variety, version, time_cost, memory_cost, parallelism, salt, data = self.decode(encoded)
+        return OrderedDict([
+            (_('algorithm'), self.algorithm),
+            (_('variety'), variety),
+            (_('version'), version),
+            (_('memory cost'), memory_cost),
+            (_('time cost'), time_cost),
+            (_('parallelism'), parallelism),
+            (_('salt'), mask_hash(salt)),
+            (_('hash'), mask_hash(data)),
+        ])
+
+    def must_update(self, encoded):
+        variety, version, time_cost, memory_cost, parallelism, salt, data = self.decode(encoded)
+        return (variety, time_cost, memory_cost, parallelism) != \
+            ('argon2id', self.time_cost, self.memory_cost, self.parallelism)
+
+    def harden_runtime(self, password, encoded):
+        # a wrong password already costs a full hash with the stored parameters
+        pass
+
+    def get_type(self, argon2, data):
+        variety = data.split('$', 1)[0]
+        return {
+            'argon2d': argon2.low_level.Type.D,
+            'argon2i': argon2.low_level.Type.I,
+            'argon2id': argon2.low_level.Type.ID,
+        }[variety]
+
+    def decode(self, encoded):
+        """
+        @return: (variety, version, time cost, memory cost, parallelism, salt, hash)
+        """
+        algorithm, variety, version, options, salt, data = encoded.split('$', 5)
+        assert algorithm == self.algorithm
+        options = dict(option.split('=', 1) for option in options.split(','))
+        return (variety, int(version.split('=', 1)[1]), int(options['t']), int(options['m']),
+                int(options['p']), salt, data)
@@ -0,0 +1,66 @@
+from concurrent.futures import TimeoutError
+
+from django.contrib.auth.hashers import get_hasher, identify_hasher, make_password
+
+from sevchefs_api.exceptions import PasswordHashingBusy
+from sevchefs_api.pools import BoundedProcessPool
+
+
+def hash_password_inline(password):
+    return make_password(password)
+
+
+def verify_password_inline(password, encoded):
+    """
+    @return: (whether password matches encoded, whether encoded should be rehashed)
+    """
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False, False
+    preferred = get_hasher()
+    if not hasher.verify(password, encoded):
+        return False, False
+    return True, hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+
+# hashing is the most expensive CPU work of a signup or login
+_password_hash_pool = BoundedProcessPool('PASSWORD_HASH_WORKERS', timeout=10)
+
+
+def get_password_hash_pool():
+    return _password_hash_pool
+
+
+def run_hash(fn, *args):
+    """
+    Run fn in the password hash pool
+
+    @raise PasswordHashingBusy: the pool could not take or finish the work in
+                                time, answered with 503 Service Unavailable
+    """
+    try:
+        return get_password_hash_pool().run(fn, *args)
+    except TimeoutError:
+        raise PasswordHashingBusy()
+
+
+def hash_password(password):
+    """
+    @return: password encoded with the preferred hasher, for User.password
+    """
+    return run_hash(hash_password_inline, password)
+
+
+def check_user_password(user, password):
+    """
+    Check password against user, rehashing it with the preferred hasher and
+    cost when the stored hash uses another one
+    """
+    if password is None or not user.has_usable_password():
+        return False
+    valid, must_update = run_hash(verify_password_inline, password, user.password)
+    if valid and must_update:
+        user.password = hash_password(password)
+        user.save(update_fields=['password'])
+    return valid
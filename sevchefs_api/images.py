@@ -0,0 +1,576 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import uuid
+from functools import lru_cache
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.signals import setting_changed
+from django.db import IntegrityError, close_old_connections, transaction
+from django.dispatch import receiver
+from django.utils.encoding import filepath_to_uri
+from django.utils import timezone
+from PIL import Image
+
+from sevchefs_api.models import content_image_path
+from sevchefs_api.pools import BoundedProcessPool
+
+
+logger = logging.getLogger(__name__)
+
+# (extension in the rendition keys, Pillow format, save options) of every rendition
+RENDITION_FORMATS = (
+    ('webp', 'WEBP', {'quality': 75, 'method': 4}),
+    ('jpeg', 'JPEG', {'quality': 75, 'optimize': True, 'progressive': True}),
+)
+
+# image field of each model uploads are resized for, next to its <field>_renditions column
+IMAGE_FIELDS = {
+    'sevchefs_api.Recipe': 'image',
+    'sevchefs_api.RecipeInstruction': 'image',
+    'sevchefs_api.UserProfile': 'avatar',
+}
+
+# width in pixels the serializers ask for, the closest rendition at least as wide is served
+LIST_IMAGE_WIDTH = 640
+DETAIL_IMAGE_WIDTH = 1280
+INSTRUCTION_IMAGE_WIDTH = 640
+AVATAR_IMAGE_WIDTH = 160
+TIMELINE_IMAGE_WIDTH = 320
+
+
+def rendition_key(key, token, width, extension):
+    """
+    Key of a rendition of the image at key; token is made for each set of
+    renditions, so a set never overwrites the files of another
+    """
+    return '%s.%s.w%d.%s' % (os.path.splitext(key.rstrip('/'))[0], token, width, extension)
+
+
+def flatten(image):
+    """
+    @return: image in RGB, transparent areas on a white background
+    """
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[3])
+        return background
+    return image.convert('RGB') if image.mode != 'RGB' else image
+
+
+# EXIF Orientation tag
+ORIENTATION_TAG = 0x0112
+
+# transpositions turning an image stored in each EXIF orientation upright
+ORIENTATION_TRANSPOSES = {
+    2: (Image.FLIP_LEFT_RIGHT,),
+    3: (Image.ROTATE_180,),
+    4: (Image.FLIP_TOP_BOTTOM,),
+    5: (Image.TRANSPOSE,),
+    6: (Image.ROTATE_270,),
+    7: (Image.ROTATE_90, Image.FLIP_LEFT_RIGHT),
+    8: (Image.ROTATE_90,),
+}
+
+# orientations of images stored on their side, whose width is their height as shown
+SIDEWAYS_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def get_orientation(image):
+    """
+    @return: EXIF orientation of image, 1 (upright) if it has none
+    """
+    try:
+        exif = image._getexif() if hasattr(image, '_getexif') else None
+    except Exception:
+        exif = None
+    return (exif or {}).get(ORIENTATION_TAG, 1)
+
+
+def make_renditions(path, widths):
+    """
+    Resize the image at path to each of widths, never enlarging it, in every
+    rendition format; runs in the image resize process pool
+
+    The renditions carry no EXIF, so images are turned upright first.
+
+    @return: [(width, extension, encoded image)]
+    """
+    image = Image.open(path)
+    orientation = get_orientation(image)
+    # width and height as shown, once turned upright
+    shown_width, shown_height = image.size[::-1] if orientation in SIDEWAYS_ORIENTATIONS else image.size
+    largest = min(max(widths), shown_width)
+    draft_size = (largest, shown_height * largest // shown_width)
+    # let the JPEG decoder scale down by up to 8 while decoding
+    image.draft('RGB', draft_size[::-1] if orientation in SIDEWAYS_ORIENTATIONS else draft_size)
+    image = flatten(image)
+    for transpose in ORIENTATION_TRANSPOSES.get(orientation, ()):
+        image = image.transpose(transpose)
+
+    renditions = []
+    for width in sorted(set(min(width, image.size[0]) for width in widths), reverse=True):
+        # each rendition is resized from the next larger one, which is much
+        # cheaper than resizing the original every time
+        if width != image.size[0]:
+            image = image.resize((width, max(1, round(image.size[1] * width / image.size[0]))), Image.LANCZOS)
+        for extension, image_format, options in RENDITION_FORMATS:
+            content = BytesIO()
+            image.save(content, image_format, **options)
+            renditions.append((width, extension, content.getvalue()))
+    return renditions
+
+
+_image_resize_pool = BoundedProcessPool('IMAGE_RESIZE_WORKERS', timeout=120)
+
+
+def get_image_resize_pool():
+    return _image_resize_pool
+
+
+@lru_cache(maxsize=10000)
+def load_renditions(renditions):
+    """
+    Parse a <image field>_renditions value, once per distinct value
+
+    @return: (key of the image the renditions were made from,
+              {extension: ((width, key), ...) narrowest first})
+    """
+    renditions = json.loads(renditions) if renditions else {}
+    source = renditions.pop('source', None)
+    return source, {extension: tuple(sorted((int(width), key) for width, key in keys.items()))
+                    for extension, keys in renditions.items()}
+
+
+def parse_renditions(image, renditions):
+    """
+    @return: {extension: {width: key}} of the renditions made from image,
+             empty if they are missing or were made from an older image
+    """
+    source, keys = load_renditions(renditions)
+    if not image or source != image.name:
+        return {}
+    return {extension: dict(widths) for extension, widths in keys.items()}
+
+
+# {id(storage): URL prefix}, see get_url_prefix
+_url_prefixes = {}
+
+URL_PREFIX_PROBE = 'url-prefix-probe'
+
+
+@receiver(setting_changed)
+def clear_url_prefixes(**kwargs):
+    _url_prefixes.clear()
+
+
+def get_url_prefix(storage):
+    """
+    What storage puts before the key of a file in its URLs, worked out once
+    per storage: IMAGE_URL_PREFIX if set, else the URL storage gives a probe
+    key without that key; None when its URLs are signed
+    """
+    prefix = _url_prefixes.get(id(storage), False)
+    if prefix is False:
+        if settings.IMAGE_URL_PREFIX:
+            prefix = settings.IMAGE_URL_PREFIX.rstrip('/') + '/'
+        else:
+            url = storage.url(URL_PREFIX_PROBE)
+            prefix = url[:-len(URL_PREFIX_PROBE)] if url.endswith(URL_PREFIX_PROBE) else None
+        _url_prefixes[id(storage)] = prefix
+    return prefix
+
+
+def get_storage_url(storage, key):
+    """
+    storage.url(key) by string formatting, as S3BotoStorage builds a boto
+    connection and URL for each call
+    """
+    prefix = get_url_prefix(storage)
+    if prefix is None:
+        return storage.url(key)
+    return prefix + filepath_to_uri(key)
+
+
+def get_image_url(image, renditions, width, extension='jpeg'):
+    """
+    URL of the narrowest rendition of image at least width pixels wide, the
+    widest one if none is, or of image itself until its renditions are made
+
+    @param renditions: the <image field>_renditions column next to image
+    """
+    if not image:
+        return None
+    source, keys = load_renditions(renditions)
+    if source != image.name or extension not in keys:
+        return get_storage_url(image.storage, image.name) if extension == 'jpeg' else None
+    widths = keys[extension]
+    key = next((key for rendition_width, key in widths if rendition_width >= width), widths[-1][1])
+    return get_storage_url(image.storage, key)
+
+
+def journal_image_deletion(name, renditions, original=True):
+    """
+    Record the file name and its renditions in default storage for deletion
+    by the purge_image_deletions command, in the transaction of the caller;
+    only the renditions unless original
+    """
+    source, keys = load_renditions(renditions)
+    deleted_keys = [name] if original else []
+    if source == name:
+        deleted_keys += [key for widths in keys.values() for width, key in widths]
+    image_deletion = apps.get_model('sevchefs_api', 'ImageDeletion')
+    image_deletion.objects.bulk_create([image_deletion(key=key, source=name) for key in deleted_keys])
+
+
+def cancel_image_deletion(name):
+    """
+    Drop the deletion journaled for the file name before storing it again
+    under the same key, waiting for a purge deleting it to finish
+    """
+    apps.get_model('sevchefs_api', 'ImageDeletion').objects.filter(source=name, key=name).delete()
+
+
+# image columns of the rows that can refer to an uploaded image
+IMAGE_REFERENCES = (
+    ('sevchefs_api.Recipe', 'image'),
+    ('sevchefs_api.RecipeInstruction', 'image'),
+    ('sevchefs_api.UserProfile', 'avatar'),
+    ('sevchefs_api.ActivityTimeline', 'main_object_image'),
+    ('sevchefs_api.ActivityTimeline', 'target_object_image'),
+)
+
+
+def is_image_referenced(key):
+    return any(apps.get_model(label).objects.filter(**{field: key}).exists() for label, field in IMAGE_REFERENCES)
+
+
+def release_image(name, renditions):
+    """
+    Journal the image name and its renditions for deletion unless a row
+    still refers to it, call once a row stops referring to it
+
+    References are counted from the indexed image columns rather than kept
+    in a counter, so the copies the timeline makes count without every place
+    creating an event having to keep one. The ImageBlob row is locked while
+    counting, which makes an upload of the same content wait to refer to it.
+
+    @return: True if the files are to be deleted
+    """
+    if not name:
+        return False
+    with transaction.atomic():
+        blob = apps.get_model('sevchefs_api', 'ImageBlob').objects.select_for_update().filter(key=name).first()
+        if is_image_referenced(name):
+            return False
+        if blob is not None:
+            renditions = blob.renditions
+            blob.delete()
+        journal_image_deletion(name, renditions)
+    return True
+
+
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(64 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class StagedFile(File):
+    """
+    A staged upload storage may move into place rather than copy
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+class ImageIngestJob:
+    """
+    Store an uploaded image and its renditions, then point rows at them
+
+    targets are (model label, pk, image field name) of the rows to update,
+    each model having a <image field>_renditions column; the images they had
+    before are released. staged_path is the upload waiting on local disk, or
+    None when the image is already in storage and only needs its renditions.
+    An upload with the sha256 of its content is stored once: when the same
+    content already is, the rows are pointed at it and nothing is stored.
+    """
+
+    def __init__(self, key, targets, staged_path=None, touch_recipe_ids=(), sha256=None):
+        self.key = key
+        self.targets = targets
+        self.staged_path = staged_path
+        self.touch_recipe_ids = list(touch_recipe_ids)
+        self.sha256 = sha256
+
+    def run(self):
+        try:
+            self.ingest()
+        finally:
+            if self.staged_path is not None and os.path.exists(self.staged_path):
+                os.remove(self.staged_path)
+
+    def ingest(self):
+        # the same content may have been stored, or the renditions made by
+        # the job of another save, while this job was queued
+        if self.apply_stored() or not self.needs_renditions():
+            return
+
+        downloaded_path = None
+        if self.staged_path is not None:
+            source_path = self.staged_path
+        else:
+            try:
+                source_path = default_storage.path(self.key)
+            except NotImplementedError:
+                source_path = downloaded_path = self.download(self.key)
+
+        try:
+            made = get_image_resize_pool().run(make_renditions, source_path, settings.IMAGE_RENDITION_WIDTHS)
+        finally:
+            if downloaded_path is not None:
+                os.remove(downloaded_path)
+
+        if self.staged_path is not None:
+            if default_storage.get_available_name(self.key) == self.key:
+                # storage writes this key rather than next to it, a pending
+                # deletion of the image stored there before must not delete it
+                cancel_image_deletion(self.key)
+            # saved once resized, as FileSystemStorage moves the staged file
+            # into MEDIA_ROOT instead of copying it
+            with open(self.staged_path, 'rb') as staged:
+                name = default_storage.save(self.key, StagedFile(staged))
+        else:
+            name = self.key
+        renditions = {'source': name}
+        token = uuid.uuid4().hex[:8]
+        for width, extension, content in made:
+            renditions.setdefault(extension, {})[str(width)] = \
+                default_storage.save(rendition_key(name, token, width, extension), ContentFile(content))
+        self.apply(name, json.dumps(renditions))
+
+    def needs_renditions(self):
+        """
+        @return: False if the job only makes renditions and no target still
+                 shows the image without them
+        """
+        if self.staged_path is not None:
+            return True
+        for label, pk, field in self.targets:
+            rows = apps.get_model(label).objects.filter(pk=pk, **{field: self.key})
+            for renditions in rows.values_list(field + '_renditions', flat=True):
+                if load_renditions(renditions)[0] != self.key:
+                    return True
+        return False
+
+    def download(self, name):
+        # the resize processes read the original from local disk
+        with default_storage.open(name) as original, \
+                tempfile.NamedTemporaryFile(dir=get_ingest_dir(), delete=False) as copy:
+            shutil.copyfileobj(original, copy)
+        return copy.name
+
+    def apply_stored(self):
+        """
+        Point the targets at the stored image with the same content, if any
+
+        @return: True if there was one
+        """
+        if self.sha256 is None:
+            return False
+        with transaction.atomic():
+            blob = apps.get_model('sevchefs_api', 'ImageBlob').objects.select_for_update() \
+                                                            .filter(sha256=self.sha256).first()
+            if blob is None:
+                return False
+            replaced, updated_count = self.update_targets(blob.key, blob.renditions)
+        self.release(replaced)
+        return True
+
+    def apply(self, name, renditions):
+        with transaction.atomic():
+            if self.sha256 is not None:
+                blobs = apps.get_model('sevchefs_api', 'ImageBlob').objects
+                try:
+                    with transaction.atomic():
+                        blobs.create(sha256=self.sha256, key=name, renditions=renditions)
+                except IntegrityError:
+                    # the same content was stored by another job in the meantime
+                    blob = blobs.select_for_update().get(sha256=self.sha256)
+                    journal_image_deletion(name, renditions, original=blob.key != name)
+                    name, renditions = blob.key, blob.renditions
+            replaced, updated_count = self.update_targets(name, renditions)
+            if not updated_count:
+                # the rows were deleted, or given another image, meanwhile
+                if self.staged_path is not None:
+                    replaced.append((name, renditions))
+                else:
+                    journal_image_deletion(name, renditions, original=False)
+        self.release(replaced)
+
+    def update_targets(self, name, renditions):
+        """
+        Point the targets at name, in the transaction of the caller
+
+        A job only making renditions leaves the targets that show another
+        image, or already have renditions of this one, as they are.
+
+        @return: ([(image name, renditions)] the targets had before,
+                  number of targets updated)
+        """
+        now = timezone.now()
+        replaced = []
+        updated_count = 0
+        for label, pk, field in self.targets:
+            model = apps.get_model(label)
+            rows = model.objects.select_for_update().filter(pk=pk)
+            if self.staged_path is None:
+                rows = rows.filter(**{field: name})
+            for row in rows:
+                old_name, old_renditions = getattr(row, field).name, getattr(row, field + '_renditions')
+                if self.staged_path is None and load_renditions(old_renditions)[0] == name:
+                    continue
+                if old_name != name:
+                    replaced.append((old_name, old_renditions))
+                values = {field: name, field + '_renditions': renditions}
+                if any(model_field.name == 'updated_at' for model_field in model._meta.fields):
+                    values['updated_at'] = now
+                updated_count += model.objects.filter(pk=row.pk).update(**values)
+        if self.touch_recipe_ids and updated_count:
+            apps.get_model('sevchefs_api', 'Recipe').objects.filter(pk__in=self.touch_recipe_ids) \
+                                                    .update(updated_at=now)
+        return replaced, updated_count
+
+    def release(self, replaced):
+        for name, renditions in dict(replaced).items():
+            release_image(name, renditions)
+
+
+class ImageIngestQueue:
+    """
+    Local queue of image ingest jobs, worked through by IMAGE_INGEST_WORKERS
+    background threads started on first use
+
+    Jobs are queued once the transaction of the request commits, so the
+    threads see the rows they update. With IMAGE_INGEST_WORKERS = 0 jobs run
+    in the request instead. Jobs queued when the process exits are lost,
+    their uploads are left in the ingest directory.
+
+    A job only making the renditions of an image is dropped while another
+    one for the same image is queued or running.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = queue.Queue()
+        self.threads = []
+        # keys of the images renditions-only jobs are queued for
+        self.pending = set()
+
+    def submit(self, job):
+        if not settings.IMAGE_INGEST_WORKERS:
+            job.run()
+        else:
+            transaction.on_commit(lambda: self.put(job))
+
+    def put(self, job):
+        with self.lock:
+            if job.staged_path is None:
+                if job.key in self.pending:
+                    return
+                self.pending.add(job.key)
+            while len(self.threads) < settings.IMAGE_INGEST_WORKERS:
+                thread = threading.Thread(target=self.work, name='image-ingest', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+        self.jobs.put(job)
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                job.run()
+            except Exception:
+                logger.exception('Ingest of image %s failed', job.key)
+            finally:
+                if job.staged_path is None:
+                    with self.lock:
+                        self.pending.discard(job.key)
+                close_old_connections()
+                self.jobs.task_done()
+
+    def join(self):
+        self.jobs.join()
+
+
+_image_ingest_queue = ImageIngestQueue()
+
+
+def get_image_ingest_queue():
+    return _image_ingest_queue
+
+
+def get_ingest_dir():
+    os.makedirs(settings.IMAGE_INGEST_DIR, exist_ok=True)
+    return settings.IMAGE_INGEST_DIR
+
+
+def stage_upload(upload):
+    """
+    Move an uploaded file to the ingest directory, copying it if it was kept
+    in memory or is on another file system
+
+    @return: (path of the staged file, sha256 of its content)
+    """
+    path = os.path.join(get_ingest_dir(), uuid.uuid4().hex)
+    if hasattr(upload, 'temporary_file_path'):
+        upload.flush()
+        try:
+            os.rename(upload.temporary_file_path(), path)
+        except OSError:
+            pass
+        else:
+            upload.close()
+            return path, getattr(upload, 'sha256', None) or hash_file(path)
+    sha256 = hashlib.sha256()
+    with open(path, 'wb') as staged:
+        for chunk in upload.chunks():
+            sha256.update(chunk)
+            staged.write(chunk)
+    return path, sha256.hexdigest()
+
+
+# extension of the content keys of each Pillow format uploads are accepted in
+IMAGE_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+
+def ingest_image(instance, field, upload, targets=(), touch_recipe_ids=()):
+    """
+    Make upload the image in field of instance, and of targets
+
+    An image already stored with the same content is used right away, only
+    the rows change. Otherwise the upload is queued to be stored with its
+    renditions under its content key; this returns without waiting for storage.
+    """
+    staged_path, sha256 = stage_upload(upload)
+    ext = IMAGE_EXTENSIONS.get(getattr(upload, 'image_format', None)) or upload.name.split('.')[-1].lower()
+    job = ImageIngestJob(content_image_path(sha256, ext), [(instance._meta.label, instance.pk, field)] + list(targets),
+                         staged_path=staged_path, touch_recipe_ids=touch_recipe_ids, sha256=sha256)
+    if job.apply_stored():
+        os.remove(staged_path)
+    else:
+        get_image_ingest_queue().submit(job)
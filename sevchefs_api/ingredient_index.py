@@ -0,0 +1,189 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from django.db.models import Count
+
+from sevchefs_api.models import Ingredient, RecipeIngredient, normalize_ingredient_name
+
+
+# most suggestions returned for a prefix
+MAX_SUGGESTIONS = 20
+
+# prefixes this short match many names, their suggestions are kept until the index changes
+CACHED_PREFIX_LENGTH = 2
+
+# rebuild from the database this often to pick up changes made by other processes
+REBUILD_SECONDS = 600
+
+
+class IngredientNameIndex:
+    """
+    Process local map of lower cased ingredient names to ids
+
+    The ingredient table rarely changes, so names are resolved from memory
+    instead of a case-insensitive query per name, and autocomplete is a bisect
+    over the sorted names. The index is built from the database on first use,
+    updated in place by the Ingredient and RecipeIngredient signals, and
+    rebuilt every REBUILD_SECONDS. Names missing from the map, or mapped to a
+    row that no longer exists because another process changed the table, are
+    looked up in the database again.
+
+    Suggestions are ranked outside the lock, and those of prefixes up to
+    CACHED_PREFIX_LENGTH long are kept in a map that any change replaces.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = None
+        self.names = []
+        self.display_names = {}
+        self.usage = Counter()
+        self.suggestions = {}
+        self.built_at = None
+
+    def build(self):
+        self.ids = {}
+        self.names = []
+        self.display_names = {}
+        self.add(Ingredient.objects.all().only('id', 'name', 'name_lower'))
+        self.usage = Counter(dict(RecipeIngredient.objects.values_list('ingredient_id')
+                                                          .annotate(uses=Count('id')).order_by()))
+        self.suggestions = {}
+        self.built_at = time.monotonic()
+
+    def ensure_built(self):
+        if self.ids is None or time.monotonic() - self.built_at > REBUILD_SECONDS:
+            self.build()
+
+    def invalidate(self):
+        with self.lock:
+            self.ids = None
+
+    def add(self, ingredients):
+        self.suggestions = {}
+        for ingredient in ingredients:
+            self.remove_id(ingredient.id)
+            replaced_id = self.ids.get(ingredient.name_lower)
+            if replaced_id is None:
+                self.names.insert(bisect_left(self.names, ingredient.name_lower), ingredient.name_lower)
+            else:
+                self.display_names.pop(replaced_id, None)
+            self.ids[ingredient.name_lower] = ingredient.id
+            self.display_names[ingredient.id] = ingredient.name
+
+    def discard(self, names):
+        self.suggestions = {}
+        for name in names:
+            ingredient_id = self.ids.pop(name, None)
+            if ingredient_id is not None:
+                del self.names[bisect_left(self.names, name)]
+                self.display_names.pop(ingredient_id, None)
+
+    def remove_id(self, ingredient_id):
+        name = self.display_names.get(ingredient_id)
+        if name is not None and self.ids.get(normalize_ingredient_name(name)) == ingredient_id:
+            self.discard([normalize_ingredient_name(name)])
+
+    def ingredient_saved(self, ingredient):
+        with self.lock:
+            if self.ids is not None:
+                self.add([ingredient])
+
+    def ingredient_deleted(self, ingredient):
+        with self.lock:
+            if self.ids is not None:
+                self.remove_id(ingredient.id)
+                self.usage.pop(ingredient.id, None)
+                self.suggestions = {}
+
+    def add_usage(self, ingredient_ids, uses=1):
+        with self.lock:
+            if self.ids is not None:
+                for ingredient_id in ingredient_ids:
+                    self.usage[ingredient_id] += uses
+                self.suggestions = {}
+
+    def resolve_many(self, names):
+        """
+        @return: {lower cased name: ingredient id} of the names found in memory
+        """
+        with self.lock:
+            self.ensure_built()
+            normalized = set(normalize_ingredient_name(name) for name in names)
+            return {name: self.ids[name] for name in normalized if name in self.ids}
+
+    def get_ingredients(self, names):
+        """
+        Resolve a list of names to ingredients, usually with a single query
+
+        @return: {lower cased name: Ingredient} of the names that exist
+        """
+        names = set(normalize_ingredient_name(name) for name in names)
+        ids = self.resolve_many(names)
+        by_id = Ingredient.objects.in_bulk(list(ids.values())) if ids else {}
+        ingredients = {name: by_id[ingredient_id] for name, ingredient_id in ids.items()
+                       if ingredient_id in by_id and by_id[ingredient_id].name_lower == name}
+
+        stale = [name for name in ids if name not in ingredients]
+        missing = names - set(ingredients)
+        if missing:
+            found = list(Ingredient.objects.filter(name_lower__in=missing))
+            with self.lock:
+                if self.ids is not None:
+                    self.discard(stale)
+                    self.add(found)
+            ingredients.update((ingredient.name_lower, ingredient) for ingredient in found)
+        return ingredients
+
+    def get_ingredient(self, name):
+        return self.get_ingredients([name]).get(normalize_ingredient_name(name))
+
+    def names_with_prefix(self, prefix, limit=None):
+        """
+        @return: lower cased ingredient names starting with prefix, in alphabetical order
+        """
+        prefix = normalize_ingredient_name(prefix)
+        with self.lock:
+            self.ensure_built()
+            return self.prefix_range(prefix, limit)
+
+    def prefix_range(self, prefix, limit=None):
+        matches = []
+        for i in range(bisect_left(self.names, prefix), len(self.names)):
+            if not self.names[i].startswith(prefix) or len(matches) == limit:
+                break
+            matches.append(self.names[i])
+        return matches
+
+    def suggest(self, prefix, limit=MAX_SUGGESTIONS):
+        """
+        @return: [(ingredient id, name)] of the ingredients starting with prefix
+                 that recipes use the most, at most limit of them
+        """
+        prefix = normalize_ingredient_name(prefix)
+        limit = max(0, min(limit, MAX_SUGGESTIONS))
+        with self.lock:
+            self.ensure_built()
+            suggestions = self.suggestions
+            if prefix in suggestions:
+                return suggestions[prefix][:limit]
+            candidates = [(self.usage[self.ids[name]], self.ids[name], self.display_names[self.ids[name]])
+                          for name in self.prefix_range(prefix)]
+
+        # nlargest keeps the alphabetical order of names used as often
+        best = [(ingredient_id, name) for uses, ingredient_id, name
+                in heapq.nlargest(MAX_SUGGESTIONS, candidates, key=lambda candidate: candidate[0])]
+        if len(prefix) <= CACHED_PREFIX_LENGTH:
+            # a change made meanwhile replaced the map, so this is never stale
+            suggestions[prefix] = best
+        return best[:limit]
+
+
+_ingredient_index = IngredientNameIndex()
+
+
+def get_ingredient_index():
+    return _ingredient_index
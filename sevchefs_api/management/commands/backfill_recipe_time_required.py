@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from sevchefs_api.models import Recipe
+from sevchefs_api.utils import RecipeUtils
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored total_time_required of recipes from their instructions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('recipe_ids', nargs='*', type=int,
+                            help='only backfill these recipes, defaults to every recipe')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.all()
+        if options['recipe_ids']:
+            recipes = recipes.filter(pk__in=options['recipe_ids'])
+
+        recipe_count = RecipeUtils.recount_recipe_time_required(recipes)
+        self.stdout.write('Backfilled total_time_required of %s recipe(s)' % recipe_count)
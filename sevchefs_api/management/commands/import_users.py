@@ -0,0 +1,80 @@
+import csv
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from sevchefs_api.hashing import hash_password
+from sevchefs_api.models import UserProfile
+
+
+def import_users(rows, batch_size=500):
+    """
+    Create users with their tokens and profiles from (username, email,
+    password) rows, batch_size users per three bulk INSERTs, skipping
+    usernames that already exist
+
+    Each distinct password is hashed once, so seeding load-test accounts
+    that share a password does not pay for a hash per user.
+
+    @return: number of users created
+    """
+    hashed = {}
+    created_count = 0
+    for start in range(0, len(rows), batch_size):
+        batch = {username: (email, password) for username, email, password in rows[start:start + batch_size]}
+        for username in User.objects.filter(username__in=list(batch)).values_list('username', flat=True):
+            del batch[username]
+        if not batch:
+            continue
+        for email, password in batch.values():
+            if password not in hashed:
+                hashed[password] = hash_password(password)
+
+        now = timezone.now()
+        with transaction.atomic():
+            # bulk_create skips the create_userprofile signal, so the tokens
+            # and profiles are bulk created here as well
+            User.objects.bulk_create([
+                User(username=username, email=User.objects.normalize_email(email), password=hashed[password],
+                     date_joined=now)
+                for username, (email, password) in batch.items()
+            ])
+            user_ids = list(User.objects.filter(username__in=list(batch)).values_list('id', flat=True))
+            Token.objects.bulk_create([Token(key=Token().generate_key(), user_id=user_id) for user_id in user_ids])
+            UserProfile.objects.bulk_create([UserProfile(user_id=user_id) for user_id in user_ids])
+        created_count += len(user_ids)
+    return created_count
+
+
+class Command(BaseCommand):
+    help = 'Bulk create users, with their tokens and profiles, from a CSV file or generated for load tests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', nargs='?',
+                            help='CSV file of username,email,password rows')
+        parser.add_argument('--count', type=int, default=0,
+                            help='generate this many users instead of reading a file')
+        parser.add_argument('--prefix', default='loadtest',
+                            help='username prefix of generated users')
+        parser.add_argument('--password', default='loadtest-password',
+                            help='password of every generated user')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options['csv_file']:
+            with open(options['csv_file'], newline='') as csv_file:
+                rows = [tuple(row) for row in csv.reader(csv_file) if row]
+            if any(len(row) != 3 for row in rows):
+                raise CommandError('every row must be username,email,password')
+        elif options['count'] > 0:
+            prefix = options['prefix']
+            rows = [('%s%d' % (prefix, i), '%s%d@example.com' % (prefix, i), options['password'])
+                    for i in range(options['count'])]
+        else:
+            raise CommandError('give a CSV file or a --count of users to generate')
+
+        created_count = import_users(rows, options['batch_size'])
+        self.stdout.write('Created %s user(s), skipped %s existing' % (created_count, len(rows) - created_count))
@@ -0,0 +1,19 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from sevchefs_api.images import IMAGE_FIELDS, ImageIngestJob, parse_renditions
+
+
+class Command(BaseCommand):
+    help = 'Make the resized renditions of recipe, instruction and avatar images that have none'
+
+    def handle(self, *args, **options):
+        image_count = 0
+        for label, field in IMAGE_FIELDS.items():
+            rows = apps.get_model(label).objects.exclude(**{field: ''}).exclude(**{field + '__isnull': True})
+            for row in rows.only('pk', field, field + '_renditions').iterator():
+                image = getattr(row, field)
+                if not parse_renditions(image, getattr(row, field + '_renditions')):
+                    ImageIngestJob(image.name, [(label, row.pk, field)]).run()
+                    image_count += 1
+        self.stdout.write('Made the renditions of %s image(s)' % image_count)
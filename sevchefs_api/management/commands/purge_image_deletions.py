@@ -0,0 +1,102 @@
+import logging
+import os
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from storages.backends.s3boto import S3BotoStorage
+
+from sevchefs_api.images import IMAGE_REFERENCES
+from sevchefs_api.models import ImageBlob, ImageDeletion
+
+
+logger = logging.getLogger(__name__)
+
+# most keys one S3 multi-object delete request takes
+S3_DELETE_BATCH_SIZE = 1000
+
+
+def delete_keys(storage, keys):
+    """
+    Delete keys from storage, in one multi-object delete request per 1,000
+    keys on S3 and by unlinking them on local storage
+
+    @return: set of the keys that could not be deleted
+    """
+    failed = set()
+    if isinstance(storage, S3BotoStorage):
+        names = {storage._encode_name(storage._normalize_name(storage._clean_name(key))): key for key in keys}
+        batch = list(names)
+        for start in range(0, len(batch), S3_DELETE_BATCH_SIZE):
+            result = storage.bucket.delete_keys(batch[start:start + S3_DELETE_BATCH_SIZE], quiet=True)
+            for error in result.errors:
+                logger.error('Could not delete %s from S3: %s %s', error.key, error.code, error.message)
+                failed.add(names[error.key])
+    elif isinstance(storage, FileSystemStorage):
+        for key in keys:
+            try:
+                os.unlink(storage.path(key))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logger.exception('Could not delete %s', key)
+                failed.add(key)
+    else:
+        for key in keys:
+            try:
+                storage.delete(key)
+            except Exception:
+                logger.exception('Could not delete %s', key)
+                failed.add(key)
+    return failed
+
+
+def find_used_images(keys):
+    """
+    @return: set of keys that rows refer to, or that are stored images again
+    """
+    used = set(ImageBlob.objects.filter(key__in=keys).values_list('key', flat=True))
+    for label, field in IMAGE_REFERENCES:
+        used.update(apps.get_model(label).objects.filter(**{field + '__in': keys}).values_list(field, flat=True))
+    return used
+
+
+def purge_image_deletions(batch_size=S3_DELETE_BATCH_SIZE):
+    """
+    Delete the journaled image files from default storage, batch_size at a
+    time, skipping images used again since they were journaled
+
+    The journal rows of a batch stay locked until its files are deleted, so
+    an upload storing the same key again waits for the purge to finish.
+    Files that could not be deleted keep their rows for the next purge.
+
+    @return: (number of files deleted, number that could not be)
+    """
+    deleted_count = failed_count = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            rows = list(ImageDeletion.objects.select_for_update().filter(pk__gt=last_id).order_by('pk')[:batch_size])
+            if not rows:
+                break
+            last_id = rows[-1].pk
+            # renditions are never stored twice under the same key, originals are
+            used = find_used_images({row.key for row in rows if row.key == row.source})
+            keys = {row.key for row in rows if row.key not in used}
+            failed = delete_keys(default_storage, keys)
+            ImageDeletion.objects.filter(pk__in=[row.pk for row in rows if row.key not in failed]).delete()
+        deleted_count += len(keys) - len(failed)
+        failed_count += len(failed)
+    return deleted_count, failed_count
+
+
+class Command(BaseCommand):
+    help = 'Delete the image files journaled for deletion from storage, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=S3_DELETE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        deleted_count, failed_count = purge_image_deletions(options['batch_size'])
+        self.stdout.write('Deleted %s image file(s), %s could not be deleted' % (deleted_count, failed_count))
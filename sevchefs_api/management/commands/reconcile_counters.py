@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+
+from sevchefs_api.models import Recipe, UserProfile
+
+
+def reconcile(model, counters, touch_field=None):
+    """
+    Recount the counter cache columns of model, where counters maps each
+    column to the relation it counts, and fix the rows that drifted
+
+    touch_field, if given, is set to the current time on the repaired rows
+    """
+    annotations = {'actual_' + column: Count(relation, distinct=True) for column, relation in counters.items()}
+    repaired_count = 0
+    for row in model.objects.annotate(**annotations).values('pk', *(list(counters) + list(annotations))):
+        drifted = {column: row['actual_' + column] for column in counters
+                   if row[column] != row['actual_' + column]}
+        if drifted:
+            if touch_field is not None:
+                drifted[touch_field] = timezone.now()
+            model.objects.filter(pk=row['pk']).update(**drifted)
+            repaired_count += 1
+    return repaired_count
+
+
+class Command(BaseCommand):
+    help = 'Repair the favourite, comment, following and follower counter caches'
+
+    def handle(self, *args, **options):
+        recipe_count = reconcile(Recipe, {'favourited_count': 'userrecipefavourites',
+                                          'comment_count': 'comments'}, touch_field='updated_at')
+        userprofile_count = reconcile(UserProfile, {'following_count': 'follows',
+                                                    'followers_count': 'followed_by'}, touch_field='updated_at')
+        self.stdout.write('Repaired counters of %s recipe(s) and %s user profile(s)' % (recipe_count, userprofile_count))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from sevchefs_api.recommend import TOP_K, refresh_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Recompute the recipe recommendations served by RecommendRecipeView'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=TOP_K,
+                            help='number of recipes to keep per user')
+
+    def handle(self, *args, **options):
+        user_count = refresh_recommendations(options['top_k'])
+        self.stdout.write('Refreshed recommendations of %s user(s)' % user_count)
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 15:32
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sevchefs_api', '0012_auto_20171101_2008'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recipeinstruction',
+            options={'ordering': ['step_num']},
+        ),
+        migrations.AlterIndexTogether(
+            name='recipe',
+            index_together=set([('upload_datetime', 'id')]),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# The search vector only exists on Postgres, other databases search through
+# the in-process index in sevchefs_api.search
+ADD_SEARCH_VECTOR_SQL = [
+    "ALTER TABLE sevchefs_api_recipe ADD COLUMN search_vector tsvector",
+    "CREATE INDEX sevchefs_api_recipe_search_vector_gin ON sevchefs_api_recipe USING GIN (search_vector)",
+    """
+    UPDATE sevchefs_api_recipe SET search_vector =
+        setweight(to_tsvector('english', coalesce(sevchefs_api_recipe.name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce((
+            SELECT string_agg(sevchefs_api_recipetag.text, ' ') FROM sevchefs_api_recipetagtable
+            INNER JOIN sevchefs_api_recipetag ON sevchefs_api_recipetag.id = sevchefs_api_recipetagtable.tag_id
+            WHERE sevchefs_api_recipetagtable.recipe_id = sevchefs_api_recipe.id), '')), 'B') ||
+        setweight(to_tsvector('english', coalesce((
+            SELECT string_agg(sevchefs_api_ingredient.name, ' ') FROM sevchefs_api_recipeingredient
+            INNER JOIN sevchefs_api_ingredient ON sevchefs_api_ingredient.id = sevchefs_api_recipeingredient.ingredient_id
+            WHERE sevchefs_api_recipeingredient.recipe_id = sevchefs_api_recipe.id), '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(sevchefs_api_recipe.description, '')), 'C')
+    """,
+]
+
+DROP_SEARCH_VECTOR_SQL = [
+    "DROP INDEX IF EXISTS sevchefs_api_recipe_search_vector_gin",
+    "ALTER TABLE sevchefs_api_recipe DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def run_on_postgres(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sevchefs_api', '0014_recipe_total_time_required'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_postgres(ADD_SEARCH_VECTOR_SQL), run_on_postgres(DROP_SEARCH_VECTOR_SQL)),
+    ]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 15:38
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_timeline_inbox(apps, schema_editor):
+    # existing events were only shown to the user and the target user
+    ActivityTimeline = apps.get_model('sevchefs_api', 'ActivityTimeline')
+    ActivityTimelineInbox = apps.get_model('sevchefs_api', 'ActivityTimelineInbox')
+
+    entries = []
+    for activity_id, user_id, target_user_id, datetime in \
+            ActivityTimeline.objects.values_list('id', 'user_id', 'target_user_id', 'datetime').iterator():
+        for owner_id in {user_id, target_user_id} - {None}:
+            entries.append(ActivityTimelineInbox(owner_id=owner_id, activity_id=activity_id, datetime=datetime))
+    ActivityTimelineInbox.objects.bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('sevchefs_api', '0015_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityTimelineInbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datetime', models.DateTimeField()),
+                ('activity', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to='sevchefs_api.ActivityTimeline')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_inbox', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='activitytimelineinbox',
+            unique_together=set([('owner', 'activity')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='activitytimelineinbox',
+            index_together=set([('owner', 'datetime', 'id')]),
+        ),
+        migrations.RunPython(fill_timeline_inbox, migrations.RunPython.noop),
+    ]
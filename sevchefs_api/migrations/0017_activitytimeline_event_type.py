@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+UPLOAD, FOLLOW, FAVOURITE, COMMENT = 1, 2, 3, 4
+
+SUMMARY_TEXT_EVENT_TYPES = (
+    ('followed', FOLLOW),
+    ('favourited', FAVOURITE),
+    ('commented', COMMENT),
+    ('uploaded', UPLOAD),
+)
+
+
+def summary_text_to_event_type(apps, schema_editor):
+    ActivityTimeline = apps.get_model('sevchefs_api', 'ActivityTimeline')
+    for keyword, event_type in SUMMARY_TEXT_EVENT_TYPES:
+        ActivityTimeline.objects.filter(summary_text__contains=keyword).update(event_type=event_type)
+
+
+def event_type_to_summary_text(apps, schema_editor):
+    ActivityTimeline = apps.get_model('sevchefs_api', 'ActivityTimeline')
+    summary_texts = {
+        UPLOAD: "{0} uploaded a new recipe",
+        FOLLOW: "{0} followed {1} on CookTasty",
+        FAVOURITE: "{0} favourited {1} recipe",
+        COMMENT: "{0} commented on {1} recipe",
+    }
+    for event_type, summary_text in summary_texts.items():
+        ActivityTimeline.objects.filter(event_type=event_type).update(summary_text=summary_text)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sevchefs_api', '0016_auto_20261018_1538'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activitytimeline',
+            name='event_type',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'upload'), (2, 'follow'), (3, 'favourite'), (4, 'comment')], default=UPLOAD),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='activitytimeline',
+            name='summary_text',
+            field=models.TextField(blank=True, max_length=200, null=True),
+        ),
+        migrations.RunPython(summary_text_to_event_type, event_type_to_summary_text),
+        migrations.RemoveField(
+            model_name='activitytimeline',
+            name='summary_text',
+        ),
+    ]
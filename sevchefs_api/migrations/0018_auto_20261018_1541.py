@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 15:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_relations(model, counters):
+    annotations = {'actual_' + column: Count(relation, distinct=True) for column, relation in counters.items()}
+    for row in model.objects.annotate(**annotations).values('pk', *annotations):
+        counts = {column: row['actual_' + column] for column in counters}
+        if any(counts.values()):
+            model.objects.filter(pk=row['pk']).update(**counts)
+
+
+def fill_counters(apps, schema_editor):
+    count_relations(apps.get_model('sevchefs_api', 'Recipe'), {'favourited_count': 'userrecipefavourites',
+                                                               'comment_count': 'comments'})
+    count_relations(apps.get_model('sevchefs_api', 'UserProfile'), {'following_count': 'follows',
+                                                                    'followers_count': 'followed_by'})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sevchefs_api', '0017_activitytimeline_event_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favourited_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
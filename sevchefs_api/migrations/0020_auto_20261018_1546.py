@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 15:46
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def remove_duplicate_tags(apps, schema_editor):
+    RecipeTagTable = apps.get_model('sevchefs_api', 'RecipeTagTable')
+    duplicates = RecipeTagTable.objects.values('recipe_id', 'tag_id') \
+                                       .annotate(keep_id=Min('id'), rows=Count('id')).filter(rows__gt=1)
+    for duplicate in duplicates:
+        RecipeTagTable.objects.filter(recipe_id=duplicate['recipe_id'], tag_id=duplicate['tag_id']) \
+                              .exclude(id=duplicate['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sevchefs_api', '0019_auto_20261018_1543'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_tags, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='recipetagtable',
+            unique_together=set([('recipe', 'tag')]),
+        ),
+    ]
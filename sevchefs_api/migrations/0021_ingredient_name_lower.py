@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def normalize_ingredient_name(name):
+    # sevchefs_api.models.normalize_ingredient_name as of this migration
+    return name.strip().lower()
+
+
+def fill_name_lower(apps, schema_editor):
+    """
+    Fill name_lower and merge ingredients whose names only differ by case
+    or surrounding spaces into the oldest one, so the column can be made unique
+    """
+    Ingredient = apps.get_model('sevchefs_api', 'Ingredient')
+    RecipeIngredient = apps.get_model('sevchefs_api', 'RecipeIngredient')
+
+    kept = {}
+    for ingredient in Ingredient.objects.order_by('id'):
+        name_lower = normalize_ingredient_name(ingredient.name)
+        if name_lower in kept:
+            RecipeIngredient.objects.filter(ingredient_id=ingredient.id).update(ingredient_id=kept[name_lower])
+            ingredient.delete()
+        else:
+            kept[name_lower] = ingredient.id
+            Ingredient.objects.filter(id=ingredient.id).update(name_lower=name_lower)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sevchefs_api', '0020_auto_20261018_1546'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='name_lower',
+            field=models.TextField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_name_lower, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='ingredient',
+            name='name_lower',
+            field=models.TextField(editable=False, unique=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# email__iexact compiles to UPPER(email) = UPPER(%s) on Postgres, which this
+# expression index serves; auth_user belongs to django.contrib.auth, so the
+# index is added here with raw SQL
+ADD_EMAIL_INDEX_SQL = [
+    "CREATE INDEX auth_user_email_upper ON auth_user (UPPER(email))",
+]
+
+DROP_EMAIL_INDEX_SQL = [
+    "DROP INDEX IF EXISTS auth_user_email_upper",
+]
+
+
+def run_on_postgres(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0007_alter_validators_add_error_messages'),
+        ('sevchefs_api', '0022_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_postgres(ADD_EMAIL_INDEX_SQL), run_on_postgres(DROP_EMAIL_INDEX_SQL)),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 16:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sevchefs_api', '0023_user_email_upper_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activitytimeline',
+            name='main_object_image_renditions',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='activitytimeline',
+            name='target_object_image_renditions',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_renditions',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipeinstruction',
+            name='image_renditions',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='avatar_renditions',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 16:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import sevchefs_api.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sevchefs_api', '0024_image_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('renditions', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='activitytimeline',
+            name='main_object_image',
+            field=models.ImageField(blank=True, db_index=True, null=True, upload_to=''),
+        ),
+        migrations.AlterField(
+            model_name='activitytimeline',
+            name='target_object_image',
+            field=models.ImageField(blank=True, db_index=True, null=True, upload_to=''),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, null=True, upload_to=sevchefs_api.models.recipe_image_directory_path),
+        ),
+        migrations.AlterField(
+            model_name='recipeinstruction',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, null=True, upload_to=sevchefs_api.models.recipe_instruction_image_directory_path),
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='avatar',
+            field=models.ImageField(blank=True, db_index=True, null=True, upload_to=sevchefs_api.models.user_avatar_directory_path),
+        ),
+    ]
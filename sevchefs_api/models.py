@@ -1,4 +1,5 @@
 import uuid
+from datetime import timedelta
 from django.db import models
 from django.contrib.auth.models import User
 
@@ -27,62 +28,98 @@ def recipe_instruction_image_directory_path(instance, filename):
     return 'recipe/{0}/{1}/{2}/'.format(instance.recipe.id, instance.id, filename)
 
 
+def content_image_path(sha256, ext):
+    """
+    Key of an uploaded image named after its content, shared by every row using the same image
+    """
+    return 'image/{0}/{1}.{2}'.format(sha256[:2], sha256, ext)
+
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, related_name="userprofile")
     description = models.TextField(max_length=500, null=True)
-    avatar = models.ImageField(upload_to=user_avatar_directory_path, blank=True, null=True)
+    avatar = models.ImageField(upload_to=user_avatar_directory_path, blank=True, null=True, db_index=True)
+    # JSON map of the resized copies of avatar, see sevchefs_api.images
+    avatar_renditions = models.TextField(blank=True, default='', editable=False)
     follows = models.ManyToManyField('UserProfile', related_name='followed_by', blank=True)
     favourited_recipes = models.ManyToManyField(
         'Recipe',
         through='UserRecipeFavourites',
         through_fields=('userprofile', 'recipe'),
     )
+    # counter caches kept by FollowUserView, repaired by reconcile_counters
+    following_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    # last change to anything UserProfileSerializer shows, for conditional GET
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.user.username
 
-    def following_count(self):
-        return self.follows.all().count()
 
-    def followers_count(self):
-        return self.followed_by.all().count()
+class ActivityTimeline(models.Model):
+    UPLOAD = 1
+    FOLLOW = 2
+    FAVOURITE = 3
+    COMMENT = 4
+    EVENT_TYPE_CHOICES = (
+        (UPLOAD, 'upload'),
+        (FOLLOW, 'follow'),
+        (FAVOURITE, 'favourite'),
+        (COMMENT, 'comment'),
+    )
 
+    # {actor} is the user, {target} and {target_owner} refer to the target user
+    SUMMARY_TEMPLATES = {
+        UPLOAD: "{actor} uploaded a new recipe",
+        FOLLOW: "{actor} followed {target} on CookTasty",
+        FAVOURITE: "{actor} favourited {target_owner} recipe",
+        COMMENT: "{actor} commented on {target_owner} recipe",
+    }
 
-class ActivityTimeline(models.Model):
     user = models.ForeignKey(User, related_name="timeline")
-    summary_text = models.TextField(max_length=200, null=False, blank=False)
+    event_type = models.PositiveSmallIntegerField(choices=EVENT_TYPE_CHOICES)
     target_user = models.ForeignKey(User, related_name="mentioned_timeline", null=True)
-    main_object_image = models.ImageField(blank=True, null=True)
-    target_object_image = models.ImageField(blank=True, null=True)
+    main_object_image = models.ImageField(blank=True, null=True, db_index=True)
+    target_object_image = models.ImageField(blank=True, null=True, db_index=True)
+    # copied from the renditions of the avatar or recipe image referenced above
+    main_object_image_renditions = models.TextField(blank=True, default='', editable=False)
+    target_object_image_renditions = models.TextField(blank=True, default='', editable=False)
     datetime = models.DateTimeField(auto_now_add=True)
 
     def get_formatted_summary_text(self, user):
-        # summary text is about following
-        aboutfollow = True if "follow" in self.summary_text else False
-        if self.target_user is None:
-            if self.user.id == user.id:
-                return self.summary_text.format("you")
-            return self.summary_text.format(self.target_user.username)
-
-        # you followed yourself, you favourited your recipe, you commented on your recipe
-        if (user.id == self.user.id) and (user.id == self.target_user.id):
-            if aboutfollow:
-                return self.summary_text.format("you", "yourself")
-            return self.summary_text.format("you", "your")
-
-        # you followed someone, you favourited someone recipe, you commented on someone recipe
-        elif user.id == self.user.id:
-            if aboutfollow:
-                return self.summary_text.format("you", self.target_user.username)
-            return self.summary_text.format("you", self.target_user.username + "'s")
-
-        # someone followed you, someone favourited your recipe, someone commented on your recipe
-        elif self.target_user.id == user.id:
-            if aboutfollow:
-                return self.summary_text.format(self.target_user.username, "you")
-            return self.summary_text.format(self.target_user.username, "your")
-
-        return self.summary_text.format(self.user.username, self.target_user.username)
+        """
+        Render the summary of this event as seen by user, ie. you followed
+        someone, someone favourited your recipe, you commented on your recipe
+        """
+        actor = "you" if self.user_id == user.id else self.user.username
+
+        target = target_owner = ""
+        if self.target_user_id is not None:
+            if self.target_user_id == user.id:
+                target = "yourself" if self.user_id == user.id else "you"
+                target_owner = "your"
+            else:
+                target = self.target_user.username
+                target_owner = target + "'s"
+
+        return self.SUMMARY_TEMPLATES[self.event_type].format(actor=actor, target=target, target_owner=target_owner)
+
+
+class ActivityTimelineInbox(models.Model):
+    """
+    One row per recipient of an ActivityTimeline event, written when the
+    event is created so a user's feed is a range scan over their own rows
+    """
+    owner = models.ForeignKey(User, related_name="timeline_inbox")
+    activity = models.ForeignKey(ActivityTimeline, related_name="inbox_entries")
+    datetime = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('owner', 'activity')
+        index_together = [
+            ['owner', 'datetime', 'id'],
+        ]
 
 
 class Recipe(models.Model):
@@ -90,8 +127,16 @@ class Recipe(models.Model):
     description = models.TextField(max_length=500, null=False, blank=False)
     upload_datetime = models.DateTimeField(auto_now_add=True)
     upload_by_user = models.ForeignKey(User, related_name='recipes')
-    image = models.ImageField(upload_to=recipe_image_directory_path, blank=True, null=True)
+    image = models.ImageField(upload_to=recipe_image_directory_path, blank=True, null=True, db_index=True)
+    # JSON map of the resized copies of image, see sevchefs_api.images
+    image_renditions = models.TextField(blank=True, default='', editable=False)
     difficulty_level = models.IntegerField(default=0)
+    total_time_required = models.DurationField(default=timedelta(0), db_index=True)
+    # counter caches kept by FavouriteRecipeView and CommentRecipeView, repaired by reconcile_counters
+    favourited_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    # last change to anything RecipeSerializer shows, including instructions and ingredients
+    updated_at = models.DateTimeField(auto_now=True)
     ingredients_list = models.ManyToManyField(
         'Ingredient',
         through='RecipeIngredient',
@@ -108,6 +153,11 @@ class Recipe(models.Model):
         through_fields=('recipe', 'tag'),
     )
 
+    class Meta:
+        index_together = [
+            ['upload_datetime', 'id'],
+        ]
+
     def __str__(self):
         return self.name
 
@@ -118,7 +168,7 @@ class Recipe(models.Model):
         return self.ingredients.all()
 
     def get_favourited_count(self):
-        return self.favourited_by.all().count()
+        return self.favourited_count
 
     def get_image_url(self):
         return str(self.image)
@@ -142,16 +192,60 @@ class RecipeInstruction(models.Model):
     step_num = models.IntegerField(default=1)
     instruction = models.TextField(max_length=140, null=False, blank=False)
     time_required = models.DurationField(null=True)
-    image = models.ImageField(upload_to=recipe_instruction_image_directory_path, blank=True, null=True)
+    image = models.ImageField(upload_to=recipe_instruction_image_directory_path, blank=True, null=True,
+                              db_index=True)
+    # JSON map of the resized copies of image, see sevchefs_api.images
+    image_renditions = models.TextField(blank=True, default='', editable=False)
 
     class Meta:
         ordering = ['step_num']
 
 
+class ImageBlob(models.Model):
+    """
+    An uploaded image stored once under its content key, however many
+    recipes, instructions, avatars and timeline events show it
+
+    Rows refer to it by key in their image columns; it is deleted with its
+    renditions once none do, see sevchefs_api.images.release_image.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    key = models.CharField(max_length=100, unique=True)
+    # JSON map of the resized copies, copied into the rows using the image
+    renditions = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class ImageDeletion(models.Model):
+    """
+    Journal of stored image files no row refers to any more, deleted in
+    batches by the purge_image_deletions command so requests never wait on
+    storage to delete them
+    """
+    key = models.CharField(max_length=255)
+    # key of the original image the file was stored for, equal to key when the file is the original itself
+    source = models.CharField(max_length=100, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+def normalize_ingredient_name(name):
+    """
+    Return the form ingredient names are unique and looked up in
+    """
+    return name.strip().lower()
+
+
 class Ingredient(models.Model):
     name = models.TextField(max_length=100, blank=False, null=False)
     description = models.TextField(max_length=200)
     image = models.ImageField(upload_to=ingredient_image_directory_path, null=True, blank=True)
+    # lower cased name so that case-insensitive lookups can use an index
+    name_lower = models.TextField(unique=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        self.name_lower = normalize_ingredient_name(self.name)
+        super(Ingredient, self).save(*args, **kwargs)
 
 
 class RecipeIngredient(models.Model):
@@ -167,3 +261,23 @@ class RecipeTag(models.Model):
 class RecipeTagTable(models.Model):
     recipe = models.ForeignKey(Recipe)
     tag = models.ForeignKey(RecipeTag)
+
+    class Meta:
+        unique_together = ('recipe', 'tag')
+
+
+class RecipeRecommendation(models.Model):
+    """
+    Top recipes for a user, or for everyone when user is null, precomputed
+    by the refresh_recommendations command
+    """
+    user = models.ForeignKey(User, related_name='recipe_recommendations', null=True)
+    recipe = models.ForeignKey(Recipe, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['rank']
+        index_together = [
+            ['user', 'rank'],
+        ]
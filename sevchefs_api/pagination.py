@@ -0,0 +1,163 @@
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+from django.utils.six.moves.urllib import parse as urlparse
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    Opaque cursor pagination keyed on a unique tuple of columns
+
+    The cursor stores the ordering values of the last (or first) row of
+    the current page, and the next page is fetched with a keyset filter
+    such as ``(upload_datetime, id) < (x, y)`` instead of an OFFSET, so
+    every page costs the same index range scan as the first one.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = 'Invalid cursor'
+
+    # must end with a unique column and use a single sort direction
+    ordering = ('-id', )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(view)
+        self.fields = [order.lstrip('-') for order in self.ordering]
+        self.descending = self.ordering[0].startswith('-')
+
+        self.cursor = self.decode_cursor(request, queryset)
+        reverse, position = self.cursor if self.cursor else (False, None)
+
+        if reverse:
+            queryset = queryset.order_by(*self.reverse_ordering())
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if position is not None:
+            queryset = queryset.filter(self.keyset_filter(position, reverse))
+
+        # fetch one extra row to know whether there is a page after this one
+        results = list(queryset[:self.page_size + 1])
+        page = results[:self.page_size]
+        has_more = len(results) > len(page)
+
+        if reverse:
+            page.reverse()
+            self.has_previous = has_more
+            self.has_next = True
+        else:
+            self.has_previous = position is not None
+            self.has_next = has_more
+
+        self.page = page
+        return self.page
+
+    def get_ordering(self, view):
+        """
+        Views may order a page by something other than the default, such as a
+        search rank annotation, through get_pagination_ordering
+        """
+        get_pagination_ordering = getattr(view, 'get_pagination_ordering', None)
+        if get_pagination_ordering is not None:
+            return get_pagination_ordering() or self.ordering
+        return self.ordering
+
+    def reverse_ordering(self):
+        return tuple(order[1:] if order.startswith('-') else '-' + order
+                     for order in self.ordering)
+
+    def keyset_filter(self, position, reverse):
+        """
+        Build ``(f0, f1, ...) < (v0, v1, ...)`` as an OR of prefix-equal
+        comparisons, which the composite index behind the ordering can serve
+        """
+        lookup = 'lt' if self.descending != reverse else 'gt'
+        clauses = []
+        for i, field in enumerate(self.fields):
+            kwargs = dict(zip(self.fields[:i], position[:i]))
+            kwargs['%s__%s' % (field, lookup)] = position[i]
+            clauses.append(Q(**kwargs))
+        return reduce(or_, clauses)
+
+    def get_position(self, instance):
+        position = []
+        for field in self.fields:
+            value = getattr(instance, field)
+            position.append(value.isoformat() if hasattr(value, 'isoformat') else str(value))
+        return position
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+            tokens = urlparse.parse_qs(querystring, keep_blank_values=True)
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+            raw_position = tokens['p']
+            if len(raw_position) != len(self.fields):
+                raise ValueError
+            position = [self.get_output_field(queryset, field).to_python(value)
+                        for field, value in zip(self.fields, raw_position)]
+            if any(value is None for value in position):
+                raise ValueError
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+        return reverse, position
+
+    def get_output_field(self, queryset, field):
+        if field in queryset.query.annotations:
+            return queryset.query.annotations[field].output_field
+        return queryset.model._meta.get_field(field)
+
+    def encode_cursor(self, reverse, position):
+        tokens = {'p': position}
+        if reverse:
+            tokens['r'] = '1'
+        querystring = urlparse.urlencode(tokens, doseq=True)
+        encoded = b64encode(querystring.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(False, self.get_position(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(True, self.get_position(self.page[0]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+
+class RecipeCursorPagination(KeysetCursorPagination):
+    """
+    Newest recipes first, backed by the (upload_datetime, id) index
+    """
+    ordering = ('-upload_datetime', '-id')
+
+
+class TimelineCursorPagination(KeysetCursorPagination):
+    """
+    Newest timeline inbox entries first, backed by the (owner, datetime, id) index
+    """
+    ordering = ('-datetime', '-id')
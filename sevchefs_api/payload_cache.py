@@ -0,0 +1,92 @@
+import threading
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+from sevchefs_api.serializers import RecipeSerializer, get_favourited_recipe_ids
+from sevchefs_api.utils import RecipeUtils
+
+
+class RecipePayloadCache:
+    """
+    Two level cache of the serialized recipe details, keyed by recipe id and
+    version (Recipe.updated_at)
+
+    Only the part shared by every user is cached, is_favourited is merged in
+    per request. Every change shown in the details moves updated_at, so a
+    stale payload is never served; the signals on recipes, instructions and
+    ingredients also drop the in-process copy right away to free its slot.
+    Misses in the in-process LRU fall back to the shared Django cache so
+    other processes can reuse a payload one of them has built.
+    """
+
+    max_entries = 500
+    timeout = 60 * 60 * 24
+
+    def __init__(self, cache_alias='default'):
+        self.cache_alias = cache_alias
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias]
+
+    def key(self, recipe_id, version):
+        return 'recipe-payload:%s:%s' % (recipe_id, version)
+
+    def get(self, recipe_id, version):
+        with self.lock:
+            entry = self.entries.get(recipe_id)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(recipe_id)
+                return entry[1]
+
+        payload = self.shared.get(self.key(recipe_id, version))
+        if payload is not None:
+            self.remember(recipe_id, version, payload)
+        return payload
+
+    def set(self, recipe_id, version, payload):
+        self.shared.set(self.key(recipe_id, version), payload, self.timeout)
+        self.remember(recipe_id, version, payload)
+
+    def remember(self, recipe_id, version, payload):
+        with self.lock:
+            self.entries[recipe_id] = (version, payload)
+            self.entries.move_to_end(recipe_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, recipe_ids):
+        with self.lock:
+            for recipe_id in recipe_ids:
+                self.entries.pop(recipe_id, None)
+
+    def get_payload(self, recipe_id, version):
+        """
+        Return the user independent details of a recipe, serializing them on a miss
+        """
+        payload = self.get(recipe_id, version)
+        if payload is None:
+            recipe = RecipeUtils.get_recipe_detail_or_404(recipe_id)
+            payload = OrderedDict(RecipeSerializer(recipe, context={'favourited_recipe_ids': set()}).data)
+            self.set(recipe_id, version, payload)
+        return payload
+
+
+_recipe_payload_cache = RecipePayloadCache()
+
+
+def get_recipe_payload_cache():
+    return _recipe_payload_cache
+
+
+def get_recipe_data(recipe_id, updated_at, user):
+    """
+    Return the details of a recipe as seen by user, from the payload cache
+    """
+    recipe_id = int(recipe_id)
+    data = OrderedDict(get_recipe_payload_cache().get_payload(recipe_id, updated_at.isoformat()))
+    data['is_favourited'] = recipe_id in get_favourited_recipe_ids(user, [recipe_id])
+    return data
@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedProcessPool:
+    """
+    Lazily started process pool that CPU heavy work is offloaded to, sized by
+    the setting named workers_setting
+
+    Running the work in worker processes keeps it off the GIL of a threaded
+    server, and the pool only ever holds two tasks per worker, so a spike
+    waits for a slot instead of piling up in the pool. Slots are handed out
+    first come first served; a semaphore lets a thread that just finished
+    barge ahead of the ones already waiting, which starves some callers for
+    seconds. With the setting at 0 everything runs inline.
+
+    A slot is held until its work is done, even when the caller gave up on
+    it. A pool broken by a worker dying, e.g. killed for its memory, is
+    replaced and the work tried once more. Waiting longer than timeout
+    seconds for a slot and the result raises concurrent.futures.TimeoutError.
+    """
+
+    def __init__(self, workers_setting, timeout=30):
+        self.workers_setting = workers_setting
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.executor = None
+        self.free_slots = 0
+        self.waiters = deque()
+
+    @property
+    def workers(self):
+        return getattr(settings, self.workers_setting)
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+                self.free_slots = self.workers * 2
+            return self.executor
+
+    def replace_executor(self, broken):
+        with self.lock:
+            # another thread may have replaced it already
+            if self.executor is broken:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            executor = self.executor
+        broken.shutdown(wait=False)
+        return executor
+
+    def acquire(self, timeout):
+        with self.lock:
+            if self.free_slots and not self.waiters:
+                self.free_slots -= 1
+                return
+            turn = threading.Event()
+            self.waiters.append(turn)
+        if not turn.wait(timeout):
+            with self.lock:
+                # unless release handed this thread the slot as the wait ran out
+                if turn in self.waiters:
+                    self.waiters.remove(turn)
+                    raise TimeoutError('no free %s slot' % self.workers_setting)
+
+    def release(self):
+        with self.lock:
+            if self.waiters:
+                # hand the slot straight to the longest waiting thread
+                self.waiters.popleft().set()
+            else:
+                self.free_slots += 1
+
+    def submit(self, executor, fn, args, deadline):
+        self.acquire(max(0, deadline - time.monotonic()))
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            self.release()
+            raise
+        future.add_done_callback(lambda future: self.release())
+        return future
+
+    def run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        deadline = time.monotonic() + self.timeout
+        executor = self.get_executor()
+        try:
+            future = self.submit(executor, fn, args, deadline)
+            return future.result(max(0, deadline - time.monotonic()))
+        except BrokenProcessPool:
+            logger.warning('A worker process of the %s pool died, starting a new pool', self.workers_setting)
+            future = self.submit(self.replace_executor(executor), fn, args, deadline)
+            return future.result(max(0, deadline - time.monotonic()))
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        # outside the lock, as the work still running releases its slot
+        if executor is not None:
+            executor.shutdown()
+        with self.lock:
+            if self.executor is None:
+                self.free_slots = 0
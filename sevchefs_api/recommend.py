@@ -0,0 +1,183 @@
+from random import randint
+
+import numpy as np
+from scipy import sparse
+
+from django.db import transaction
+from django.db.models import Max, Min
+
+from sevchefs_api.models import Recipe, RecipeIngredient, RecipeRecommendation, RecipeTagTable, \
+    UserProfile, UserRecipeFavourites
+
+
+TOP_K = 20
+
+# how much each signal contributes to the similarity between two recipes
+FAVOURITE_WEIGHT = 1.0
+TAG_WEIGHT = 0.5
+INGREDIENT_WEIGHT = 0.5
+
+# tags and ingredients on more than this share of the recipes are ignored
+COMMON_FEATURE_SHARE = 0.8
+
+# most similar recipes kept for each recipe, and recipes compared at a time
+NEIGHBOURS = 50
+BLOCK_SIZE = 1000
+
+# how much a recipe uploaded or favourited by someone you follow counts
+FOLLOW_WEIGHT = 0.5
+
+
+def incidence_matrix(pairs, row_index, col_index):
+    """
+    Build a 0/1 sparse matrix with a 1 at (row, col) for every (row id, col id) pair
+    """
+    rows, cols = [], []
+    for row_id, col_id in pairs:
+        if row_id in row_index and col_id in col_index:
+            rows.append(row_index[row_id])
+            cols.append(col_index[col_id])
+    matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(row_index), len(col_index)))
+    matrix.data[:] = 1
+    return matrix
+
+
+def normalize_rows(features):
+    """
+    Scale every row of a sparse matrix to unit length, so the product of two
+    rows is their cosine similarity
+    """
+    norms = np.sqrt(np.asarray(features.multiply(features).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms).dot(features).tocsr()
+
+
+def idf_weighted(features):
+    """
+    Weight the columns of a recipes x features matrix by their inverse
+    document frequency, dropping features more than COMMON_FEATURE_SHARE of
+    the recipes have, which say little about how alike two recipes are
+    """
+    recipe_count = features.shape[0]
+    counts = np.bincount(features.indices, minlength=features.shape[1])
+    idf = np.log(recipe_count / np.maximum(counts, 1))
+    idf[counts > COMMON_FEATURE_SHARE * recipe_count] = 0
+    weighted = features.dot(sparse.diags(idf)).tocsr()
+    weighted.eliminate_zeros()
+    return weighted
+
+
+def nearest_neighbours(signals, n, block_size=BLOCK_SIZE):
+    """
+    Return the recipes x recipes similarity of the weighted sum of the cosine
+    similarities of (weight, recipes x features) signals, keeping only the n
+    most similar other recipes of each recipe
+
+    The products are taken block_size rows at a time, so at most a block of
+    the full similarity matrix is ever held.
+    """
+    signals = [(weight, normalize_rows(features)) for weight, features in signals]
+    recipe_count = signals[0][1].shape[0]
+    rows, cols, values = [], [], []
+    for start in range(0, recipe_count, block_size):
+        stop = min(start + block_size, recipe_count)
+        block = sum(weight * features[start:stop].dot(features.T) for weight, features in signals).tocsr()
+        for i in range(stop - start):
+            row = slice(block.indptr[i], block.indptr[i + 1])
+            indices = block.indices[row]
+            best, best_scores = top_k(np.where(indices == start + i, 0, block.data[row]), n)
+            rows.extend([start + i] * len(best))
+            cols.extend(indices[best].tolist())
+            values.extend(best_scores.tolist())
+    return sparse.csr_matrix((values, (rows, cols)), shape=(recipe_count, recipe_count))
+
+
+def top_k(scores, k):
+    """
+    Return the indices and scores of the k highest positive scores, best first
+    """
+    positive = np.flatnonzero(scores > 0)
+    if len(positive) > k:
+        positive = positive[np.argpartition(-scores[positive], k - 1)[:k]]
+    best = positive[np.argsort(-scores[positive], kind='mergesort')]
+    return best, scores[best]
+
+
+def compute_recommendations(k=TOP_K):
+    """
+    Score every recipe for every user from the favourites of similar users,
+    the tag and ingredient overlap of recipes, and the follow graph
+
+    Return {user_id: [(recipe_id, score)]} where user_id None holds the
+    overall most favourited recipes for users without any signal.
+    """
+    recipe_ids = list(Recipe.objects.order_by('id').values_list('id', flat=True))
+    if not recipe_ids:
+        return {None: []}
+    user_ids = list(UserProfile.objects.order_by('user_id').values_list('user_id', flat=True))
+    recipe_index = {recipe_id: i for i, recipe_id in enumerate(recipe_ids)}
+    user_index = {user_id: i for i, user_id in enumerate(user_ids)}
+
+    favourites = incidence_matrix(
+        UserRecipeFavourites.objects.values_list('userprofile__user_id', 'recipe_id'), user_index, recipe_index)
+    authored = incidence_matrix(
+        Recipe.objects.values_list('upload_by_user_id', 'id'), user_index, recipe_index)
+    follows = incidence_matrix(
+        UserProfile.follows.through.objects.values_list('from_userprofile__user_id', 'to_userprofile__user_id'),
+        user_index, user_index)
+
+    tag_pairs = list(RecipeTagTable.objects.values_list('recipe_id', 'tag_id'))
+    tag_index = {tag_id: i for i, tag_id in enumerate(sorted({tag_id for _, tag_id in tag_pairs}))}
+    ingredient_pairs = list(RecipeIngredient.objects.values_list('recipe_id', 'ingredient_id'))
+    ingredient_index = {ingredient_id: i for i, ingredient_id in enumerate(sorted({i for _, i in ingredient_pairs}))}
+
+    similarity = nearest_neighbours([
+        (FAVOURITE_WEIGHT, favourites.T.tocsr()),
+        (TAG_WEIGHT, idf_weighted(incidence_matrix(tag_pairs, recipe_index, tag_index))),
+        (INGREDIENT_WEIGHT, idf_weighted(incidence_matrix(ingredient_pairs, recipe_index, ingredient_index))),
+    ], NEIGHBOURS)
+
+    # recipes like the ones you favourited, plus what the people you follow upload and favourite
+    seen = favourites + authored
+    scores = favourites.dot(similarity) + FOLLOW_WEIGHT * follows.dot(seen)
+    scores = (scores - scores.multiply(seen > 0)).tocsr()
+
+    recommendations = {}
+    recipe_ids = np.array(recipe_ids)
+    for i, user_id in enumerate(user_ids):
+        row = slice(scores.indptr[i], scores.indptr[i + 1])
+        best, best_scores = top_k(scores.data[row], k)
+        if len(best):
+            recommendations[user_id] = list(zip(recipe_ids[scores.indices[row][best]].tolist(), best_scores.tolist()))
+
+    popularity = np.asarray(favourites.sum(axis=0)).ravel() + 1
+    best, best_scores = top_k(popularity, k)
+    recommendations[None] = list(zip(recipe_ids[best].tolist(), best_scores.tolist()))
+    return recommendations
+
+
+def refresh_recommendations(k=TOP_K):
+    """
+    Replace the precomputed RecipeRecommendation rows and return the number
+    of users with personal recommendations
+    """
+    recommendations = compute_recommendations(k)
+    rows = [RecipeRecommendation(user_id=user_id, recipe_id=recipe_id, rank=rank, score=score)
+            for user_id, recipes in recommendations.items()
+            for rank, (recipe_id, score) in enumerate(recipes)]
+    with transaction.atomic():
+        RecipeRecommendation.objects.all().delete()
+        RecipeRecommendation.objects.bulk_create(rows, batch_size=1000)
+    return len(recommendations) - 1
+
+
+def get_random_recipe(recipes):
+    """
+    Pick a random recipe by seeking from a random id instead of an OFFSET
+    """
+    bounds = recipes.aggregate(Min('id'), Max('id'))
+    if bounds['id__min'] is None:
+        return None
+    pivot = randint(bounds['id__min'], bounds['id__max'])
+    return recipes.filter(id__gte=pivot).order_by('id').first() or \
+        recipes.filter(id__lt=pivot).order_by('-id').first()
@@ -0,0 +1,187 @@
+import heapq
+import re
+import threading
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Case, FloatField, Value, When
+from django.db.models.expressions import RawSQL
+
+from sevchefs_api.models import Ingredient, Recipe, RecipeIngredient, RecipeTag, RecipeTagTable
+
+
+# weight given to a match in each part of a recipe, highest first
+NAME_WEIGHT = 1.0
+TAG_WEIGHT = INGREDIENT_WEIGHT = 0.4
+DESCRIPTION_WEIGHT = 0.2
+
+# most matches the in-memory search pages through, best first; each costs three
+# query parameters and SQLite allows 999
+MAX_IN_MEMORY_MATCHES = 250
+
+
+class PostgresRecipeSearch:
+    """
+    Recipe search backed by the search_vector tsvector column and its GIN index
+
+    The column is rebuilt for a recipe with a single UPDATE whenever the
+    recipe, its tags or its ingredients change, so a search is one index scan
+    ranked with ts_rank.
+    """
+
+    config = 'english'
+
+    def index_recipes(self, recipe_ids):
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return
+        sql = """
+            UPDATE {recipe} SET search_vector =
+                setweight(to_tsvector(%s, coalesce({recipe}.name, '')), 'A') ||
+                setweight(to_tsvector(%s, coalesce((
+                    SELECT string_agg({tag}.text, ' ') FROM {tag_table}
+                    INNER JOIN {tag} ON {tag}.id = {tag_table}.tag_id
+                    WHERE {tag_table}.recipe_id = {recipe}.id), '')), 'B') ||
+                setweight(to_tsvector(%s, coalesce((
+                    SELECT string_agg({ingredient}.name, ' ') FROM {recipe_ingredient}
+                    INNER JOIN {ingredient} ON {ingredient}.id = {recipe_ingredient}.ingredient_id
+                    WHERE {recipe_ingredient}.recipe_id = {recipe}.id), '')), 'B') ||
+                setweight(to_tsvector(%s, coalesce({recipe}.description, '')), 'C')
+            WHERE {recipe}.id IN ({ids})
+        """.format(recipe=Recipe._meta.db_table,
+                   tag=RecipeTag._meta.db_table,
+                   tag_table=RecipeTagTable._meta.db_table,
+                   ingredient=Ingredient._meta.db_table,
+                   recipe_ingredient=RecipeIngredient._meta.db_table,
+                   ids=', '.join(['%s'] * len(recipe_ids)))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [self.config] * 4 + recipe_ids)
+
+    def remove_recipe(self, recipe_id):
+        # the search vector is deleted along with the recipe row
+        pass
+
+    def search(self, recipes, query):
+        column = '%s.search_vector' % Recipe._meta.db_table
+        rank_sql = "ts_rank(%s, plainto_tsquery(%%s, %%s))::float8" % column
+        return recipes.annotate(search_rank=RawSQL(rank_sql, (self.config, query), output_field=FloatField())) \
+                      .extra(where=["%s @@ plainto_tsquery(%%s, %%s)" % column], params=[self.config, query])
+
+
+class InMemoryRecipeSearch:
+    """
+    Process local inverted index of recipe words for databases without full
+    text search, such as the SQLite database used when testing
+
+    The index is built from the database on the first search and then kept up
+    to date by the same signals that maintain the Postgres search vector. Only
+    the MAX_IN_MEMORY_MATCHES best matches of a search are returned.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = None
+        self.recipe_words = {}
+
+    def tokenize(self, text):
+        return re.findall(r'\w+', (text or '').lower())
+
+    def recipe_documents(self, recipe_ids=None):
+        recipes = Recipe.objects.all()
+        tags = RecipeTagTable.objects.all()
+        ingredients = RecipeIngredient.objects.all()
+        if recipe_ids is not None:
+            recipes = recipes.filter(id__in=recipe_ids)
+            tags = tags.filter(recipe_id__in=recipe_ids)
+            ingredients = ingredients.filter(recipe_id__in=recipe_ids)
+
+        documents = {}
+        for recipe_id, name, description in recipes.values_list('id', 'name', 'description'):
+            documents[recipe_id] = [(name, NAME_WEIGHT), (description, DESCRIPTION_WEIGHT)]
+        for recipe_id, text in tags.values_list('recipe_id', 'tag__text'):
+            if recipe_id in documents:
+                documents[recipe_id].append((text, TAG_WEIGHT))
+        for recipe_id, name in ingredients.values_list('recipe_id', 'ingredient__name'):
+            if recipe_id in documents:
+                documents[recipe_id].append((name, INGREDIENT_WEIGHT))
+        return documents
+
+    def add_document(self, recipe_id, fields):
+        words = defaultdict(float)
+        for text, weight in fields:
+            for word in self.tokenize(text):
+                words[word] += weight
+        for word, score in words.items():
+            self.postings[word][recipe_id] = score
+        self.recipe_words[recipe_id] = list(words)
+
+    def remove_document(self, recipe_id):
+        for word in self.recipe_words.pop(recipe_id, []):
+            self.postings[word].pop(recipe_id, None)
+            if not self.postings[word]:
+                del self.postings[word]
+
+    def build(self):
+        self.postings = defaultdict(dict)
+        self.recipe_words = {}
+        for recipe_id, fields in self.recipe_documents().items():
+            self.add_document(recipe_id, fields)
+
+    def index_recipes(self, recipe_ids):
+        recipe_ids = list(recipe_ids)
+        with self.lock:
+            if self.postings is None:
+                return
+            documents = self.recipe_documents(recipe_ids)
+            for recipe_id in recipe_ids:
+                self.remove_document(recipe_id)
+                if recipe_id in documents:
+                    self.add_document(recipe_id, documents[recipe_id])
+
+    def remove_recipe(self, recipe_id):
+        with self.lock:
+            if self.postings is not None:
+                self.remove_document(recipe_id)
+
+    def rank(self, query):
+        """
+        Return {recipe_id: score} of recipes containing every word of query
+        """
+        with self.lock:
+            if self.postings is None:
+                self.build()
+            matches = None
+            for word in set(self.tokenize(query)):
+                word_postings = self.postings.get(word, {})
+                if matches is None:
+                    matches = dict(word_postings)
+                else:
+                    matches = {recipe_id: score + word_postings[recipe_id]
+                               for recipe_id, score in matches.items() if recipe_id in word_postings}
+                if not matches:
+                    break
+            return matches or {}
+
+    def search(self, recipes, query):
+        scores = self.rank(query)
+        if len(scores) > MAX_IN_MEMORY_MATCHES:
+            # in the (search_rank, id) order the results are paged in
+            scores = dict(heapq.nlargest(MAX_IN_MEMORY_MATCHES, scores.items(), key=lambda item: (item[1], item[0])))
+        if not scores:
+            return recipes.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+        search_rank = Case(*[When(id=recipe_id, then=Value(score)) for recipe_id, score in scores.items()],
+                           default=Value(0.0), output_field=FloatField())
+        return recipes.filter(id__in=list(scores)).annotate(search_rank=search_rank)
+
+
+_recipe_search = {}
+
+
+def get_recipe_search():
+    """
+    Return the recipe search index suited to the database in use
+    """
+    vendor = connection.vendor
+    if vendor not in _recipe_search:
+        _recipe_search[vendor] = PostgresRecipeSearch() if vendor == 'postgresql' else InMemoryRecipeSearch()
+    return _recipe_search[vendor]
@@ -1,23 +1,25 @@
 from django.contrib.auth.models import User
+from django.db import models
 from rest_framework import serializers
+from sevchefs_api.images import AVATAR_IMAGE_WIDTH, DETAIL_IMAGE_WIDTH, INSTRUCTION_IMAGE_WIDTH, LIST_IMAGE_WIDTH, \
+    TIMELINE_IMAGE_WIDTH, get_image_url, get_storage_url
 from sevchefs_api.models import *
 
-from datetime import timedelta
-
 
 class RecipeInstructionSerializer(serializers.ModelSerializer):
 
     image_url = serializers.SerializerMethodField()
+    image_webp_url = serializers.SerializerMethodField()
 
     class Meta:
         model = RecipeInstruction
-        fields = ('step_num', 'instruction', 'time_required', 'image_url')
+        fields = ('step_num', 'instruction', 'time_required', 'image_url', 'image_webp_url')
 
     def get_image_url(self, instr):
-        if not instr.image:
-            return None
-        image_url = instr.image.url
-        return image_url
+        return get_image_url(instr.image, instr.image_renditions, INSTRUCTION_IMAGE_WIDTH)
+
+    def get_image_webp_url(self, instr):
+        return get_image_url(instr.image, instr.image_renditions, INSTRUCTION_IMAGE_WIDTH, 'webp')
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -38,8 +40,7 @@ class IngredientSerializer(serializers.ModelSerializer):
         if not ingredient.image:
             return None
 
-        image_url = ingredient.image.url
-        return image_url
+        return get_storage_url(ingredient.image.storage, ingredient.image.name)
 
 
 class RecipeIngredientSerializer(serializers.ModelSerializer):
@@ -51,26 +52,59 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ('ingredient', 'serving_size')
 
 
+def get_favourited_recipe_ids(user, recipe_ids):
+    """
+    Return the subset of recipe_ids favourited by user in a single query
+    """
+    if user is None or user.is_anonymous() or not recipe_ids:
+        return set()
+    return set(UserRecipeFavourites.objects.filter(userprofile__user_id=user.id, recipe_id__in=recipe_ids)
+                                           .values_list('recipe_id', flat=True))
+
+
+class RecipeListListSerializer(serializers.ListSerializer):
+    """
+    Resolve is_favourited for every recipe in the page with one query and
+    share the result with the child serializer through the context
+    """
+
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, models.Manager) else data)
+
+        user = None
+        request = self.context.get("request")
+        if request and hasattr(request, "user"):
+            user = request.user
+
+        self.context['favourited_recipe_ids'] = get_favourited_recipe_ids(user, [recipe.id for recipe in recipes])
+        return super(RecipeListListSerializer, self).to_representation(recipes)
+
+
 class RecipeListSerializer(serializers.ModelSerializer):
 
     image_url = serializers.SerializerMethodField()
+    image_webp_url = serializers.SerializerMethodField()
     is_favourited = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'upload_by_user', 'difficulty_level',
-                  'upload_datetime', 'image_url', 'is_favourited')
+                  'upload_datetime', 'image_url', 'image_webp_url', 'is_favourited',
+                  'favourited_count', 'comment_count')
+        list_serializer_class = RecipeListListSerializer
 
     def get_image_url(self, recipe):
+        return get_image_url(recipe.image, recipe.image_renditions, LIST_IMAGE_WIDTH)
 
-        if not recipe.image:
-            return None
-
-        image_url = recipe.image.url
-        return image_url
+    def get_image_webp_url(self, recipe):
+        return get_image_url(recipe.image, recipe.image_renditions, LIST_IMAGE_WIDTH, 'webp')
 
     def get_is_favourited(self, recipe):
 
+        favourited_recipe_ids = self.context.get('favourited_recipe_ids')
+        if favourited_recipe_ids is not None:
+            return recipe.id in favourited_recipe_ids
+
         user = None
         request = self.context.get("request")
         if request and hasattr(request, "user"):
@@ -88,6 +122,7 @@ class RecipeListSerializer(serializers.ModelSerializer):
 class RecipeSerializer(serializers.ModelSerializer):
 
     image_url = serializers.SerializerMethodField()
+    image_webp_url = serializers.SerializerMethodField()
     ingredients = RecipeIngredientSerializer(many=True)
     is_favourited = serializers.SerializerMethodField()
     time_required = serializers.SerializerMethodField()
@@ -96,64 +131,72 @@ class RecipeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'description', 'upload_by_user', 'difficulty_level',
-                  'time_required', 'upload_datetime', 'image_url', 'ingredients',
-                  'is_favourited', 'instructions')
+                  'time_required', 'upload_datetime', 'image_url', 'image_webp_url', 'ingredients',
+                  'is_favourited', 'favourited_count', 'comment_count', 'instructions')
 
     def get_time_required(self, recipe):
-        return_time_required = timedelta(0)
-        for instr in recipe.instructions.all():
-            return_time_required += instr.time_required
-        return str(return_time_required)
+        return str(recipe.total_time_required)
 
     def get_image_url(self, recipe):
+        return get_image_url(recipe.image, recipe.image_renditions, DETAIL_IMAGE_WIDTH)
 
-        if not recipe.image:
-            return None
-
-        image_url = recipe.image.url
-        return image_url
+    def get_image_webp_url(self, recipe):
+        return get_image_url(recipe.image, recipe.image_renditions, DETAIL_IMAGE_WIDTH, 'webp')
 
     def get_is_favourited(self, recipe):
 
+        favourited_recipe_ids = self.context.get('favourited_recipe_ids')
+        if favourited_recipe_ids is not None:
+            return recipe.id in favourited_recipe_ids
+
         user = None
         request = self.context.get("request")
         if request and hasattr(request, "user"):
             user = request.user
 
-        if user is None or user.is_anonymous():
-            return False
-
-        if not user.userprofile.favourited_recipes.filter(id=recipe.id).exists():
-            return False
-
-        return True
+        return recipe.id in get_favourited_recipe_ids(user, [recipe.id])
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
 
     avatar_url = serializers.SerializerMethodField()
+    avatar_webp_url = serializers.SerializerMethodField()
     user = UserSerializer(many=False)
 
     class Meta:
         model = UserProfile
-        fields = ('user', 'description', 'avatar_url')
+        fields = ('user', 'description', 'avatar_url', 'avatar_webp_url', 'following_count', 'followers_count')
 
     def get_avatar_url(self, user_profile):
+        return get_image_url(user_profile.avatar, user_profile.avatar_renditions, AVATAR_IMAGE_WIDTH)
 
-        if not user_profile.avatar:
-            return None
+    def get_avatar_webp_url(self, user_profile):
+        return get_image_url(user_profile.avatar, user_profile.avatar_renditions, AVATAR_IMAGE_WIDTH, 'webp')
+
+
+class StreamedImageField(serializers.ImageField):
+    """
+    ImageField that trusts the check ImageUploadHandler made while the
+    upload streamed in, instead of reading the whole image again with Pillow
+    """
 
-        avatar_url = user_profile.avatar.url
-        return avatar_url
+    def to_internal_value(self, data):
+        if getattr(data, 'image_size', None) is None:
+            return super(StreamedImageField, self).to_internal_value(data)
+        return serializers.FileField.to_internal_value(self, data)
 
 
 class RecipeImageSerializer(serializers.ModelSerializer):
+    image = StreamedImageField()
+
     class Meta:
         model = Recipe
         fields = ('image', )
 
 
 class RecipeInstructionImageSerializer(serializers.ModelSerializer):
+    image = StreamedImageField()
+
     class Meta:
         model = RecipeInstruction
         fields = ('image', )
@@ -162,28 +205,31 @@ class RecipeInstructionImageSerializer(serializers.ModelSerializer):
 class ActivityTimelineSerializer(serializers.ModelSerializer):
 
     main_object_image_url = serializers.SerializerMethodField()
+    main_object_image_webp_url = serializers.SerializerMethodField()
     target_object_image_url = serializers.SerializerMethodField()
+    target_object_image_webp_url = serializers.SerializerMethodField()
     formatted_summary_text = serializers.SerializerMethodField()
 
     class Meta:
         model = ActivityTimeline
-        fields = ('user', 'target_user', 'main_object_image_url', 'target_object_image_url', 'datetime', 'formatted_summary_text')
+        fields = ('user', 'target_user', 'main_object_image_url', 'main_object_image_webp_url',
+                  'target_object_image_url', 'target_object_image_webp_url', 'datetime', 'formatted_summary_text')
 
     def get_main_object_image_url(self, activity_timeline):
+        return get_image_url(activity_timeline.main_object_image, activity_timeline.main_object_image_renditions,
+                             AVATAR_IMAGE_WIDTH)
 
-        if not activity_timeline.main_object_image:
-            return None
-
-        image_url = activity_timeline.main_object_image.url
-        return image_url
+    def get_main_object_image_webp_url(self, activity_timeline):
+        return get_image_url(activity_timeline.main_object_image, activity_timeline.main_object_image_renditions,
+                             AVATAR_IMAGE_WIDTH, 'webp')
 
     def get_target_object_image_url(self, activity_timeline):
+        return get_image_url(activity_timeline.target_object_image, activity_timeline.target_object_image_renditions,
+                             TIMELINE_IMAGE_WIDTH)
 
-        if not activity_timeline.target_object_image:
-            return None
-
-        image_url = activity_timeline.target_object_image.url
-        return image_url
+    def get_target_object_image_webp_url(self, activity_timeline):
+        return get_image_url(activity_timeline.target_object_image, activity_timeline.target_object_image_renditions,
+                             TIMELINE_IMAGE_WIDTH, 'webp')
 
     def get_formatted_summary_text(self, activity_timeline):
 
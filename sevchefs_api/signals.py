@@ -1,7 +1,15 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.conf import settings
-from sevchefs_api.models import UserProfile
+from django.utils import timezone
+from sevchefs_api.models import ActivityTimeline, ActivityTimelineInbox, Ingredient, Recipe, \
+    RecipeIngredient, RecipeInstruction, RecipeTag, RecipeTagTable, UserProfile
+from sevchefs_api.authentication import get_token_cache
+from sevchefs_api.images import IMAGE_FIELDS, ImageIngestJob, get_image_ingest_queue, ingest_image, parse_renditions
+from sevchefs_api.ingredient_index import get_ingredient_index
+from sevchefs_api.payload_cache import get_recipe_payload_cache
+from sevchefs_api.search import get_recipe_search
+from sevchefs_api.utils import RecipeUtils
 from rest_framework.authtoken.models import Token
 
 
@@ -11,3 +19,208 @@ def create_userprofile(sender, instance=None, created=False, **kwargs):
     if created:
         Token.objects.create(user=instance)
         UserProfile.objects.create(user=instance)
+
+
+# Keep Recipe.total_time_required in step with the recipe instructions
+@receiver(post_save, sender=RecipeInstruction)
+def add_instruction_time_required(sender, instance=None, created=False, **kwargs):
+    if created:
+        RecipeUtils.add_recipe_time_required(instance.recipe_id, instance.time_required)
+    else:
+        RecipeUtils.recount_recipe_time_required(Recipe.objects.filter(pk=instance.recipe_id))
+
+
+@receiver(post_delete, sender=RecipeInstruction)
+def remove_instruction_time_required(sender, instance=None, **kwargs):
+    if instance.time_required:
+        RecipeUtils.add_recipe_time_required(instance.recipe_id, -instance.time_required)
+
+
+# Keep Recipe.updated_at, UserProfile.updated_at and so the ETags of their
+# details in step with the rows shown in them
+@receiver(post_save, sender=RecipeInstruction)
+@receiver(post_delete, sender=RecipeInstruction)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def touch_recipe_of_detail(sender, instance=None, **kwargs):
+    RecipeUtils.touch_recipes([instance.recipe_id])
+
+
+@receiver(post_save, sender=Ingredient)
+def touch_recipes_with_ingredient(sender, instance=None, created=False, **kwargs):
+    if not created:
+        RecipeUtils.touch_recipes(RecipeIngredient.objects.filter(ingredient=instance).values_list('recipe_id', flat=True))
+
+
+# Drop the cached details of a recipe as soon as a row shown in them changes
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def uncache_recipe(sender, instance=None, **kwargs):
+    get_recipe_payload_cache().invalidate([instance.id])
+
+
+@receiver(post_save, sender=RecipeInstruction)
+@receiver(post_delete, sender=RecipeInstruction)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def uncache_recipe_of_detail(sender, instance=None, **kwargs):
+    get_recipe_payload_cache().invalidate([instance.recipe_id])
+
+
+@receiver(post_save, sender=Ingredient)
+def uncache_recipes_with_ingredient(sender, instance=None, created=False, **kwargs):
+    if not created:
+        recipe_ids = RecipeIngredient.objects.filter(ingredient=instance).values_list('recipe_id', flat=True)
+        get_recipe_payload_cache().invalidate(recipe_ids)
+
+
+# Stop accepting a cached token as soon as it is deleted, or its user changes
+# password, is deactivated or is deleted
+@receiver(post_save, sender=Token)
+def uncache_user_tokens_of_token(sender, instance=None, created=False, **kwargs):
+    if not created:
+        get_token_cache().invalidate_user(instance.user_id)
+
+
+@receiver(post_delete, sender=Token)
+def uncache_token(sender, instance=None, **kwargs):
+    get_token_cache().invalidate_key(instance.key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def uncache_user_tokens(sender, instance=None, created=False, update_fields=None, **kwargs):
+    if not created and set(update_fields or ()) != {'last_login'}:
+        get_token_cache().invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def uncache_deleted_user_tokens(sender, instance=None, **kwargs):
+    get_token_cache().invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def touch_userprofile(sender, instance=None, created=False, update_fields=None, **kwargs):
+    # logging in only updates last_login, which no profile shows
+    if not created and set(update_fields or ()) != {'last_login'}:
+        UserProfile.objects.filter(user=instance).update(updated_at=timezone.now())
+
+
+# Keep the recipe search index in step with recipe text, tags and ingredients
+@receiver(post_save, sender=Recipe)
+def index_recipe(sender, instance=None, **kwargs):
+    get_recipe_search().index_recipes([instance.id])
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_recipe(sender, instance=None, **kwargs):
+    get_recipe_search().remove_recipe(instance.id)
+
+
+@receiver(post_save, sender=RecipeTagTable)
+@receiver(post_delete, sender=RecipeTagTable)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def index_recipe_of_tag_or_ingredient(sender, instance=None, **kwargs):
+    get_recipe_search().index_recipes([instance.recipe_id])
+
+
+@receiver(post_save, sender=RecipeTag)
+def index_recipes_with_tag(sender, instance=None, created=False, **kwargs):
+    if not created:
+        recipe_ids = RecipeTagTable.objects.filter(tag=instance).values_list('recipe_id', flat=True)
+        get_recipe_search().index_recipes(set(recipe_ids))
+
+
+@receiver(post_save, sender=Ingredient)
+def index_recipes_with_ingredient(sender, instance=None, created=False, **kwargs):
+    if not created:
+        recipe_ids = RecipeIngredient.objects.filter(ingredient=instance).values_list('recipe_id', flat=True)
+        get_recipe_search().index_recipes(set(recipe_ids))
+
+
+# Keep the in-memory ingredient names and their usage in step with the database
+@receiver(post_save, sender=Ingredient)
+def index_ingredient(sender, instance=None, **kwargs):
+    get_ingredient_index().ingredient_saved(instance)
+
+
+@receiver(post_delete, sender=Ingredient)
+def unindex_ingredient(sender, instance=None, **kwargs):
+    get_ingredient_index().ingredient_deleted(instance)
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def count_ingredient_use(sender, instance=None, created=False, **kwargs):
+    if created:
+        get_ingredient_index().add_usage([instance.ingredient_id])
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def uncount_ingredient_use(sender, instance=None, **kwargs):
+    get_ingredient_index().add_usage([instance.ingredient_id], -1)
+
+
+# Fan a new timeline event out to the inbox of the user, the target user and
+# everyone following the user
+@receiver(post_save, sender=ActivityTimeline)
+def fan_out_activity_timeline(sender, instance=None, created=False, **kwargs):
+    if created:
+        follower_ids = UserProfile.objects.filter(follows__user_id=instance.user_id).values_list('user_id', flat=True)
+        owner_ids = set(follower_ids) | {instance.user_id, instance.target_user_id}
+        owner_ids.discard(None)
+        ActivityTimelineInbox.objects.bulk_create([
+            ActivityTimelineInbox(owner_id=owner_id, activity=instance, datetime=instance.datetime)
+            for owner_id in owner_ids
+        ])
+
+
+# Hold back an image assigned to the model directly, as the admin does, so
+# it is stored under its content hash like the uploads of the views instead
+# of under the name of the field's upload_to; the row keeps its current image
+# until the upload is ingested
+@receiver(pre_save, sender=Recipe)
+@receiver(pre_save, sender=RecipeInstruction)
+@receiver(pre_save, sender=UserProfile)
+def hold_image_upload(sender, instance=None, **kwargs):
+    field = IMAGE_FIELDS[sender._meta.label]
+    image = getattr(instance, field)
+    # _committed is False until the field's file is written to storage
+    if not image or image._committed:
+        return
+    instance._held_image_upload = image.file
+    stored = sender.objects.filter(pk=instance.pk).values_list(field, field + '_renditions').first() \
+        if instance.pk is not None else None
+    setattr(instance, field, stored[0] if stored else None)
+    setattr(instance, field + '_renditions', stored[1] if stored else '')
+
+
+# Keep the renditions made since the instance was loaded, which saving it
+# would otherwise blank and have made again
+@receiver(pre_save, sender=Recipe)
+@receiver(pre_save, sender=RecipeInstruction)
+@receiver(pre_save, sender=UserProfile)
+def keep_image_renditions(sender, instance=None, **kwargs):
+    field = IMAGE_FIELDS[sender._meta.label]
+    image = getattr(instance, field)
+    if instance.pk is None or not image or parse_renditions(image, getattr(instance, field + '_renditions')):
+        return
+    stored = sender.objects.filter(pk=instance.pk, **{field: image.name}) \
+                           .values_list(field + '_renditions', flat=True).first()
+    if stored is not None and parse_renditions(image, stored):
+        setattr(instance, field + '_renditions', stored)
+
+
+# Ingest the images held back above, and make the renditions of images
+# saved on the model directly without them; the upload views queue theirs
+# with the upload
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=RecipeInstruction)
+@receiver(post_save, sender=UserProfile)
+def make_image_renditions(sender, instance=None, **kwargs):
+    field = IMAGE_FIELDS[sender._meta.label]
+    image = getattr(instance, field)
+    upload = vars(instance).pop('_held_image_upload', None)
+    if upload is not None:
+        ingest_image(instance, field, upload)
+    elif image and not parse_renditions(image, getattr(instance, field + '_renditions')):
+        get_image_ingest_queue().submit(ImageIngestJob(image.name, [(sender._meta.label, instance.pk, field)]))
@@ -0,0 +1,53 @@
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from sevchefs_api.exceptions import SignupConflict
+from sevchefs_api.hashing import hash_password
+
+
+def check_available(username, email):
+    """
+    Raise SignupConflict if username, or email in any case, is already taken
+
+    A single query on the username unique index and, on Postgres, the
+    upper(email) index of migration 0023
+    """
+    taken = User.objects.filter(Q(username=username) | Q(email__iexact=email)).values_list('username', flat=True)[:1]
+    for taken_username in taken:
+        if taken_username == username:
+            raise SignupConflict('The username entered already exists')
+        raise SignupConflict('The email entered is already in use')
+
+
+def insert_user_rows(username, email, password):
+    """
+    Insert a user with their token and profile in one transaction
+
+    @return: id of the new user
+    """
+    with transaction.atomic():
+        # the create_userprofile signal adds the token and profile
+        return User.objects.create(username=username, email=email, password=password,
+                                   date_joined=timezone.now()).id
+
+
+def sign_up(username, email, password):
+    """
+    Create an account with its token and profile
+
+    Uniqueness is checked before hashing the password so taken names fail
+    fast; a concurrent signup taking the username in between still fails
+    on the unique index.
+
+    @return: id of the new user
+    @raise SignupConflict: the username or email is already taken
+    """
+    email = User.objects.normalize_email(email)
+    check_available(username, email)
+    encoded = hash_password(password)
+    try:
+        return insert_user_rows(username, email, encoded)
+    except IntegrityError:
+        raise SignupConflict('The username entered already exists')
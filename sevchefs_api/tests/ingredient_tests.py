@@ -0,0 +1,157 @@
+from importlib import import_module
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from unittest import mock
+
+from rest_framework import status
+
+from sevchefs_api.ingredient_index import get_ingredient_index
+from sevchefs_api.models import Ingredient, Recipe, RecipeIngredient
+from sevchefs_api.tests import base_tests
+
+
+class IngredientNameIndexTests(base_tests.BaseApiTest):
+
+    def setUp(self):
+        super(IngredientNameIndexTests, self).setUp()
+        # rows of earlier tests are rolled back without signals
+        get_ingredient_index().invalidate()
+        self.rice = Ingredient.objects.create(name='Rice', description='Rice')
+        self.chicken = Ingredient.objects.create(name='Chicken Breast', description='Chicken')
+        self.index = get_ingredient_index()
+
+    def test_name_lower_is_unique(self):
+        self.assertEqual(self.rice.name_lower, 'rice')
+        with transaction.atomic():
+            self.assertRaises(IntegrityError, Ingredient.objects.create, name='RICE', description='Rice')
+
+    def test_name_with_spaces_is_found_by_its_trimmed_name(self):
+        garlic = Ingredient.objects.create(name=' Garlic ', description='Garlic')
+        self.assertEqual(garlic.name_lower, 'garlic')
+        self.assertEqual(self.index.get_ingredient('GARLIC'), garlic)
+
+        get_ingredient_index().invalidate()
+        self.assertEqual(self.index.get_ingredient('garlic '), garlic)
+
+    def test_migration_merges_names_differing_by_case_or_spaces(self):
+        fill_name_lower = import_module('sevchefs_api.migrations.0021_ingredient_name_lower').fill_name_lower
+        padded = Ingredient.objects.create(name='Padded', description='Salt')
+        shouted = Ingredient.objects.create(name='Shouted', description='Salt')
+        Ingredient.objects.filter(pk=padded.pk).update(name='salt ', name_lower='unfilled 1')
+        Ingredient.objects.filter(pk=shouted.pk).update(name=' SALT', name_lower='unfilled 2')
+        Ingredient.objects.filter(pk=self.rice.pk).update(name='Rice  ', name_lower='unfilled 3')
+        recipe = Recipe.objects.create(name='Recipe', description='Recipe', upload_by_user=self.user)
+        RecipeIngredient.objects.create(recipe=recipe, ingredient=shouted, serving_size='1')
+
+        fill_name_lower(apps, None)
+
+        self.assertEqual(Ingredient.objects.get(pk=padded.pk).name_lower, 'salt')
+        self.assertFalse(Ingredient.objects.filter(pk=shouted.pk).exists())
+        self.assertEqual(recipe.ingredients.get().ingredient_id, padded.pk)
+        self.assertEqual(Ingredient.objects.get(pk=self.rice.pk).name_lower, 'rice')
+
+    def test_get_ingredients_in_one_query(self):
+        self.index.resolve_many([])
+
+        with CaptureQueriesContext(connection) as queries:
+            ingredients = self.index.get_ingredients(['rice', ' CHICKEN breast '])
+        self.assertEqual(ingredients, {'rice': self.rice, 'chicken breast': self.chicken})
+        self.assertEqual(len(queries), 1)
+
+    def test_index_follows_ingredient_changes(self):
+        self.assertIsNone(self.index.get_ingredient('durian'))
+
+        durian = Ingredient.objects.create(name='Durian', description='Durian')
+        self.assertEqual(self.index.get_ingredient('durian'), durian)
+
+        self.rice.name = 'Brown Rice'
+        self.rice.save()
+        self.assertIsNone(self.index.get_ingredient('rice'))
+        self.assertEqual(self.index.get_ingredient('brown rice'), self.rice)
+
+    def test_index_recovers_from_changes_made_elsewhere(self):
+        self.index.resolve_many([])
+        # changes made by another process do not reach this process's signals
+        Ingredient.objects.filter(pk=self.rice.pk).update(name='Brown Rice', name_lower='brown rice')
+
+        self.assertIsNone(self.index.get_ingredient('rice'))
+        self.assertEqual(self.index.get_ingredient('brown rice').pk, self.rice.pk)
+
+    def test_names_with_prefix(self):
+        Ingredient.objects.create(name='Chicken Thigh', description='Chicken')
+        Ingredient.objects.create(name='Chickpea', description='Chickpea')
+
+        self.assertEqual(self.index.names_with_prefix('Chicken'), ['chicken breast', 'chicken thigh'])
+        self.assertEqual(self.index.names_with_prefix('chick', limit=2), ['chicken breast', 'chicken thigh'])
+        self.assertEqual(self.index.names_with_prefix('z'), [])
+
+
+class IngredientSuggestTests(base_tests.BaseGuestUser):
+
+    def setUp(self):
+        super(IngredientSuggestTests, self).setUp()
+        get_ingredient_index().invalidate()
+        user = User.objects.create_user('chef', 'chef@api.com', 'testpassword')
+        self.recipe = Recipe.objects.create(name='Recipe', description='Recipe', upload_by_user=user)
+        self.basil = Ingredient.objects.create(name='Basil', description='Basil')
+        self.bay_leaf = Ingredient.objects.create(name='Bay Leaf', description='Bay Leaf')
+        self.bacon = Ingredient.objects.create(name='Bacon', description='Bacon')
+        Ingredient.objects.create(name='Rice', description='Rice')
+
+    def suggest(self, **params):
+        response = self.client.get(reverse('ingredient-suggest-view'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [ingredient['name'] for ingredient in response.data['data']]
+
+    def test_suggest_most_used_ingredients_first(self):
+        RecipeIngredient.objects.create(recipe=self.recipe, ingredient=self.bay_leaf, serving_size='1')
+        self.assertEqual(self.suggest(prefix='ba'), ['Bay Leaf', 'Bacon', 'Basil'])
+
+        RecipeIngredient.objects.create(recipe=self.recipe, ingredient=self.bacon, serving_size='1')
+        RecipeIngredient.objects.create(recipe=self.recipe, ingredient=self.bacon, serving_size='2')
+        self.assertEqual(self.suggest(prefix='BA'), ['Bacon', 'Bay Leaf', 'Basil'])
+
+    def test_suggest_is_bounded(self):
+        self.assertEqual(self.suggest(prefix='ba', limit=2), ['Bacon', 'Basil'])
+        self.assertEqual(len(self.suggest(prefix='ba', limit=1000)), 3)
+        self.assertEqual(self.suggest(prefix=''), [])
+
+    def test_suggestions_of_short_prefixes_are_kept_until_a_change(self):
+        index = get_ingredient_index()
+        self.assertEqual(self.suggest(prefix='ba'), ['Bacon', 'Basil', 'Bay Leaf'])
+
+        with mock.patch.object(index, 'prefix_range') as prefix_range:
+            self.assertEqual(self.suggest(prefix='ba', limit=1), ['Bacon'])
+        self.assertFalse(prefix_range.called)
+
+        RecipeIngredient.objects.create(recipe=self.recipe, ingredient=self.basil, serving_size='1')
+        self.assertEqual(self.suggest(prefix='ba'), ['Basil', 'Bacon', 'Bay Leaf'])
+
+    def test_suggest_follows_ingredient_changes(self):
+        self.suggest(prefix='ba')
+
+        self.basil.name = 'Thai Basil'
+        self.basil.save()
+        self.bacon.delete()
+        Ingredient.objects.create(name='Banana', description='Banana')
+
+        self.assertEqual(self.suggest(prefix='ba'), ['Banana', 'Bay Leaf'])
+        self.assertEqual(self.suggest(prefix='thai'), ['Thai Basil'])
+
+    def test_list_ingredients_not_modified(self):
+        response = self.client.get(reverse('ingredient-list-view'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('ingredient-list-view'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.bacon.delete()
+        response = self.client.get(reverse('ingredient-list-view'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
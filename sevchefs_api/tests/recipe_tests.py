@@ -3,16 +3,28 @@ from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 
 import json
+import os
+from PIL import Image
 
 from rest_framework import status
-from sevchefs_api.models import Recipe, RecipeTag, UserRecipeFavourites, \
-    Ingredient, RecipeIngredient, RecipeInstruction, ActivityTimeline
+from sevchefs_api.models import Recipe, RecipeTag, RecipeTagTable, UserRecipeFavourites, \
+    Ingredient, RecipeIngredient, RecipeInstruction, ActivityTimeline, ImageBlob, ImageDeletion, UserProfile
+from sevchefs_api.images import ImageIngestJob, parse_renditions, stage_upload
 from sevchefs_api.tests import base_tests
+from sevchefs_api.search import get_recipe_search
+from sevchefs_api.utils import RecipeUtils
 
 from tempfile import mkdtemp
 from shutil import rmtree
-from django.test.utils import override_settings
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.utils.six import StringIO
+from unittest import mock
 
 
 class AnonymousUserRecipeTests(base_tests.BaseGuestUser):
@@ -53,6 +65,127 @@ class AnonymousUserRecipeTests(base_tests.BaseGuestUser):
         self.assertContains(response, 'Recipe1')
         self.assertContains(response, 'Recipe2')
 
+    def test_recipe_list_cursor_pages_through_all_recipes(self):
+        """
+        Ensure recipe list is paginated by cursor without skipping or repeating
+        recipes sharing the same upload datetime
+        """
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        for i in range(25):
+            Recipe.objects.create(name='Recipe%s' % i, description='Recipe', upload_by_user=other_user)
+        Recipe.objects.update(upload_datetime=Recipe.objects.first().upload_datetime)
+
+        seen_ids = []
+        url = reverse('recipe-list-view')
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 10)
+            seen_ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+
+        expected_ids = list(Recipe.objects.order_by('-upload_datetime', '-id').values_list('id', flat=True))
+        self.assertEqual(seen_ids, expected_ids)
+
+    def test_recipe_list_previous_cursor_returns_prior_page(self):
+        """
+        Ensure the previous link of a page returns the page before it
+        """
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        for i in range(15):
+            Recipe.objects.create(name='Recipe%s' % i, description='Recipe', upload_by_user=other_user)
+
+        first_page = self.client.get(reverse('recipe-list-view')).data
+        self.assertIsNone(first_page['previous'])
+        second_page = self.client.get(first_page['next']).data
+        self.assertEqual(len(second_page['results']), 5)
+        self.assertIsNone(second_page['next'])
+
+        previous_page = self.client.get(second_page['previous']).data
+        self.assertEqual(previous_page['results'], first_page['results'])
+
+    def test_recipe_list_invalid_cursor_404(self):
+        """
+        Ensure a tampered cursor is rejected
+        """
+        response = self.client.get(reverse('recipe-list-view'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_search_recipe_list_ranks_name_match_first(self):
+        """
+        Ensure searching recipes matches name, description, tags and ingredients
+        and returns the most relevant recipe first
+        """
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        by_name = Recipe.objects.create(name='Chicken Rice', description='Rice dish', upload_by_user=other_user)
+        by_desc = Recipe.objects.create(name='Hainanese', description='Poached chicken', upload_by_user=other_user)
+        by_tag = Recipe.objects.create(name='Satay', description='Skewers', upload_by_user=other_user)
+        by_ingredient = Recipe.objects.create(name='Curry', description='Spicy', upload_by_user=other_user)
+        Recipe.objects.create(name='Fish Cakes', description='Fried fish', upload_by_user=other_user)
+
+        RecipeTagTable.objects.create(recipe=by_tag, tag=RecipeTag.objects.create(text="chicken"))
+        chicken = Ingredient.objects.create(name="Chicken thigh", description="chicken")
+        RecipeIngredient.objects.create(recipe=by_ingredient, ingredient=chicken, serving_size="200g")
+
+        response = self.client.get(reverse('recipe-list-view'), {'q': 'chicken'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        result_ids = [r['id'] for r in response.data['results']]
+        self.assertEqual(result_ids[0], by_name.id)
+        self.assertEqual(set(result_ids), {by_name.id, by_desc.id, by_tag.id, by_ingredient.id})
+
+    def test_search_recipe_list_requires_every_word(self):
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        chicken_rice = Recipe.objects.create(name='Chicken Rice', description='Rice', upload_by_user=other_user)
+        Recipe.objects.create(name='Chicken Curry', description='Curry', upload_by_user=other_user)
+
+        response = self.client.get(reverse('recipe-list-view'), {'q': 'rice chicken'})
+        self.assertEqual([r['id'] for r in response.data['results']], [chicken_rice.id])
+
+        response = self.client.get(reverse('recipe-list-view'), {'q': 'durian'})
+        self.assertEqual(response.data['results'], [])
+
+    def test_search_recipe_list_follows_recipe_edits(self):
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        recipe = Recipe.objects.create(name='Laksa', description='Noodles', upload_by_user=other_user)
+        self.client.get(reverse('recipe-list-view'), {'q': 'laksa'})
+
+        recipe.name = 'Mee Siam'
+        recipe.save()
+        self.assertEqual(self.client.get(reverse('recipe-list-view'), {'q': 'laksa'}).data['results'], [])
+        self.assertEqual(len(self.client.get(reverse('recipe-list-view'), {'q': 'siam'}).data['results']), 1)
+
+    def test_search_recipe_list_cursor_pages_through_results(self):
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        for i in range(12):
+            Recipe.objects.create(name='Soup %s' % i, description='Soup', upload_by_user=other_user)
+        Recipe.objects.create(name='Salad', description='Greens', upload_by_user=other_user)
+
+        first_page = self.client.get(reverse('recipe-list-view'), {'q': 'soup'}).data
+        second_page = self.client.get(first_page['next']).data
+        result_ids = [r['id'] for r in first_page['results'] + second_page['results']]
+        self.assertEqual(len(result_ids), 12)
+        self.assertEqual(len(set(result_ids)), 12)
+        self.assertIsNone(second_page['next'])
+
+    def test_search_matching_more_recipes_than_query_parameters(self):
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        Recipe.objects.bulk_create([Recipe(name='Dish %s' % i, description='chicken', upload_by_user=other_user)
+                                    for i in range(1200)])
+        best = Recipe.objects.create(name='Chicken', description='chicken', upload_by_user=other_user)
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        search = get_recipe_search()
+        search.index_recipes(recipe_ids)
+        # the rows are rolled back without signals
+        self.addCleanup(lambda: [search.remove_recipe(recipe_id) for recipe_id in recipe_ids])
+
+        sql, params = search.search(Recipe.objects.all(), 'chicken').query.sql_with_params()
+        self.assertLessEqual(len(params), 999)
+
+        response = self.client.get(reverse('recipe-list-view'), {'q': 'chicken'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['id'], best.id)
+        self.assertEqual(len(response.data['results']), 10)
+
     def test_view_nonexist_user_recipe_list_404(self):
         """
         Ensure guest user can view recipe list
@@ -72,6 +205,64 @@ class AnonymousUserRecipeTests(base_tests.BaseGuestUser):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertContains(response, 'Recipe1')
 
+    def test_view_recipe_details_query_budget(self):
+        """
+        Ensure recipe details are loaded with a fixed number of queries regardless
+        of how many ingredients and instructions the recipe has
+        """
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=other_user)
+        for i in range(3):
+            ingredient = Ingredient.objects.create(name="ingredient%s" % i, description="ingredient")
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=ingredient, serving_size="1 cup")
+            RecipeInstruction.objects.create(recipe=recipe, step_num=i + 1, instruction="step%s" % i,
+                                             time_required=timedelta(minutes=5))
+
+        # recipe version for the ETag, recipe, ingredients joined with ingredient, instructions
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('recipe-view', args=[recipe.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['data']['ingredients']), 3)
+        self.assertEqual(len(response.data['data']['instructions']), 3)
+        self.assertEqual(response.data['data']['time_required'], str(timedelta(minutes=15)))
+
+    def test_view_recipe_details_not_modified(self):
+        """
+        Ensure unchanged recipe details are answered with 304 from a single query
+        """
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=other_user)
+        url = reverse('recipe-view', args=[recipe.id])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_view_recipe_details_from_payload_cache(self):
+        """
+        Ensure repeated views of a recipe skip loading and serializing its details
+        """
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=other_user)
+        RecipeInstruction.objects.create(recipe=recipe, step_num=1, instruction='Boil')
+        url = reverse('recipe-view', args=[recipe.id])
+
+        first = self.client.get(url)
+        # only the recipe version for the ETag
+        with self.assertNumQueries(1):
+            second = self.client.get(url)
+        self.assertEqual(first.data, second.data)
+
+        RecipeInstruction.objects.create(recipe=recipe, step_num=2, instruction='Serve')
+        response = self.client.get(url)
+        self.assertEqual([i['instruction'] for i in response.data['data']['instructions']], ['Boil', 'Serve'])
+
     def test_view_nonexist_recipe_details_404(self):
         """
         Ensure can view details of a recipe
@@ -148,6 +339,27 @@ class RecipeTests(base_tests.BaseApiTest):
         self.assertEqual(newrecipe.description, 'new desc')
         self.assertEqual(newrecipe.difficulty_level, 3)
 
+    def test_edit_recipe_keeps_counters_moved_meanwhile(self):
+        recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+
+        def get_recipe_then_favourite(pk):
+            loaded = Recipe.objects.get(pk=pk)
+            # a favourite and a comment made by other requests while this one runs
+            Recipe.objects.filter(pk=pk).update(favourited_count=F('favourited_count') + 1,
+                                                comment_count=F('comment_count') + 1)
+            return loaded
+
+        with mock.patch.object(RecipeUtils, 'get_recipe_or_404', side_effect=get_recipe_then_favourite):
+            response = self.client.put(reverse('recipe-edit-view', args=[recipe.id]),
+                                       json.dumps({'name': 'Recipe2'}), 'application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        recipe = Recipe.objects.get(pk=recipe.id)
+        self.assertEqual((recipe.name, recipe.favourited_count, recipe.comment_count), ('Recipe2', 1, 1))
+
+        Recipe.objects.filter(pk=recipe.id).update(comment_count=F('comment_count') + 1)
+        RecipeUtils.delete_recipe_image(recipe)
+        self.assertEqual(Recipe.objects.get(pk=recipe.id).comment_count, 2)
+
     def test_login_user_can_create_new_recipe(self):
         """
         Ensure login user can create recipe
@@ -169,6 +381,146 @@ class RecipeTests(base_tests.BaseApiTest):
         response = self.client.post(reverse('recipe-upload'), json.dumps(recipe_dict), 'application/json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_recipe_with_instructions_ingredients_and_tags(self):
+        """
+        Ensure a whole recipe can be created in one request
+        """
+        rice = Ingredient.objects.create(name='Rice', description='Rice')
+        chicken = Ingredient.objects.create(name='Chicken', description='Chicken')
+        recipe_dict = {'name': 'Chicken Rice', 'description': 'Chicken and rice', 'difficulty': 2,
+                       'instructions': [{'instruction': 'Boil rice', 'duration_minute': 20},
+                                        {'instruction': 'Roast chicken', 'duration_hour': 1}],
+                       'ingredients': [{'ingredient_id': rice.id, 'serving_size': '1 cup'},
+                                       {'ingredient_name': 'chicken', 'serving_size': '200g'}],
+                       'tag_texts': ['Dinner']}
+
+        response = self.client.post(reverse('recipe-create'), json.dumps(recipe_dict), 'application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        recipe = Recipe.objects.get(pk=response.data['recipe_id'])
+        self.assertEqual(recipe.upload_by_user, self.user)
+        self.assertEqual(recipe.total_time_required, timedelta(hours=1, minutes=20))
+        self.assertEqual(list(recipe.instructions.values_list('step_num', 'instruction')),
+                         [(1, 'Boil rice'), (2, 'Roast chicken')])
+        self.assertEqual(sorted(recipe.ingredients.values_list('ingredient_id', flat=True)), sorted([rice.id, chicken.id]))
+        self.assertEqual(list(RecipeTagTable.objects.filter(recipe=recipe).values_list('tag__text', flat=True)), ['Dinner'])
+
+        response = self.client.get(reverse('recipe-list-view'), {'q': 'dinner chicken'})
+        self.assertEqual([r['id'] for r in response.data['results']], [recipe.id])
+
+    def test_create_recipe_reports_every_invalid_item(self):
+        """
+        Ensure an invalid recipe reports an error per item and creates nothing
+        """
+        rice = Ingredient.objects.create(name='Rice', description='Rice')
+        recipe_dict = {'name': 'Rice', 'description': '',
+                       'instructions': [{'instruction': 'Boil rice'}, {'instruction': ''}],
+                       'ingredients': [{'ingredient_id': rice.id, 'serving_size': ''},
+                                       {'ingredient_name': 'durian', 'serving_size': '1'}]}
+
+        response = self.client.post(reverse('recipe-create'), json.dumps(recipe_dict), 'application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        errors = response.data['errors']
+        self.assertIn('description', errors)
+        self.assertNotIn('name', errors)
+        self.assertEqual(errors['instructions'][0], {})
+        self.assertIn('instruction', errors['instructions'][1])
+        self.assertEqual(list(errors['ingredients'][0]), ['serving_size'])
+        self.assertEqual(list(errors['ingredients'][1]), ['ingredient'])
+        self.assertEqual(Recipe.objects.count(), 0)
+
+    def test_create_recipe_reports_invalid_tags_and_ids(self):
+        """
+        Ensure unknown tag ids and badly typed tags and ids are reported instead of dropped or failing
+        """
+        dinner = RecipeTag.objects.create(text='Dinner')
+        recipe_dict = {'name': 'Rice', 'description': 'Rice',
+                       'ingredients': [{'ingredient_id': [1], 'serving_size': '1'},
+                                       {'ingredient_id': {'id': 1}, 'serving_size': '1'}],
+                       'tag_ids': [dinner.id, dinner.id + 1, [dinner.id], True],
+                       'tag_texts': ['Lunch', '', 3]}
+
+        response = self.client.post(reverse('recipe-create'), json.dumps(recipe_dict), 'application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        errors = response.data['errors']
+        self.assertEqual([list(error) for error in errors['ingredients']], [['ingredient'], ['ingredient']])
+        self.assertEqual(errors['tag_ids'][0], '')
+        self.assertTrue(all(errors['tag_ids'][1:]))
+        self.assertEqual(errors['tag_texts'][0], '')
+        self.assertTrue(all(errors['tag_texts'][1:]))
+        self.assertEqual(Recipe.objects.count(), 0)
+
+        recipe_dict = {'name': 'Rice', 'description': 'Rice', 'tag_ids': dinner.id, 'tag_texts': 'Lunch'}
+        response = self.client.post(reverse('recipe-create'), json.dumps(recipe_dict), 'application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(sorted(response.data['errors']), ['tag_ids', 'tag_texts'])
+
+    def test_create_recipe_query_count_does_not_grow(self):
+        """
+        Ensure a long recipe is written with as many queries as a short one
+        """
+        ingredients = [Ingredient.objects.create(name='Ingredient%s' % i, description='') for i in range(10)]
+
+        def count_queries(size, tag_prefix):
+            recipe_dict = {'name': 'Recipe', 'description': 'Recipe',
+                           'instructions': [{'instruction': 'Step %s' % i} for i in range(size)],
+                           'ingredients': [{'ingredient_id': ingredients[i].id, 'serving_size': '1'} for i in range(size)] +
+                                          [{'ingredient_name': 'ingredient%s' % i, 'serving_size': '1'} for i in range(size)],
+                           'tag_texts': ['%s%s' % (tag_prefix, i) for i in range(size)]}
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse('recipe-create'), json.dumps(recipe_dict), 'application/json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            return len(queries)
+
+        # the first request also loads the ingredient name index
+        count_queries(1, 'Warm')
+        self.assertEqual(count_queries(1, 'Short'), count_queries(10, 'Long'))
+
+    def test_view_recipe_details_etag_follows_changes(self):
+        """
+        Ensure any change shown in the recipe details gives a new ETag
+        """
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=other_user)
+        ingredient = Ingredient.objects.create(name='Rice', description='Rice')
+        url = reverse('recipe-view', args=[recipe.id])
+
+        def assert_changes_etag(change):
+            # start from an older version so that a change within the same second still shows
+            Recipe.objects.filter(pk=recipe.pk).update(updated_at=timezone.now() - timedelta(days=1))
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+            change()
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+        def rename_ingredient():
+            ingredient.name = 'Brown Rice'
+            ingredient.save()
+
+        assert_changes_etag(lambda: RecipeIngredient.objects.create(recipe=recipe, ingredient=ingredient, serving_size='1'))
+        assert_changes_etag(lambda: RecipeInstruction.objects.create(recipe=recipe, step_num=1, instruction='Boil'))
+        assert_changes_etag(lambda: self.client.post(reverse('recipe-favourite', args=[recipe.id])))
+        assert_changes_etag(lambda: self.client.post(reverse('recipe-comment', args=[recipe.id]),
+                                                     json.dumps({'comment': 'Nice'}), 'application/json'))
+        assert_changes_etag(rename_ingredient)
+        # is_favourited differs between users
+        assert_changes_etag(self.client.logout)
+
+    def test_view_recipe_details_cache_keeps_is_favourited_per_user(self):
+        """
+        Ensure the cached recipe details still show whether the viewing user favourited the recipe
+        """
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=other_user)
+        url = reverse('recipe-view', args=[recipe.id])
+        UserRecipeFavourites.objects.create(userprofile=self.user.userprofile, recipe=recipe)
+
+        self.assertTrue(self.client.get(url).data['data']['is_favourited'])
+        self.client.login(username='other', password='testpassword')
+        self.assertFalse(self.client.get(url).data['data']['is_favourited'])
+
     def test_add_tag_to_recipe(self):
         """
         Ensure able to add tag to recipe
@@ -180,6 +532,83 @@ class RecipeTests(base_tests.BaseApiTest):
         response = self.client.post(reverse('recipe-add-tag', args=[recipe.id]), json.dumps(recipe_tag_list), 'application/json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_add_tags_to_recipe_by_text_and_id(self):
+        """
+        Ensure tags can be added by text, missing tags are created and a tag is attached only once
+        """
+        recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+        meat = RecipeTag.objects.create(text="Meat")
+        RecipeTagTable.objects.create(recipe=recipe, tag=meat)
+        recipe_tag_list = {'tag_ids': [meat.id, 9999], 'tag_texts': ['Spicy', 'Meat']}
+
+        response = self.client.post(reverse('recipe-add-tag', args=[recipe.id]), json.dumps(recipe_tag_list), 'application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        spicy = RecipeTag.objects.get(text='Spicy')
+        self.assertEqual(response.data['data']['tag_ids_added'], [spicy.id])
+        self.assertEqual(response.data['data']['tag_ids_not_added'], [meat.id, 9999])
+        self.assertEqual(sorted(RecipeTagTable.objects.filter(recipe=recipe).values_list('tag_id', flat=True)),
+                         sorted([meat.id, spicy.id]))
+
+        response = self.client.get(reverse('recipe-list-view'), {'q': 'spicy'})
+        self.assertEqual([r['id'] for r in response.data['results']], [recipe.id])
+
+    def test_create_recipe_reuses_tag_created_by_concurrent_request(self):
+        """
+        Ensure a tag text created by another request meanwhile is reused instead of failing
+        """
+        filter_tags = RecipeTag.objects.filter
+        lookups = []
+
+        def miss_tag_committed_after_lookup(*args, **kwargs):
+            # the other request commits 'Dinner' right after this one looked for it
+            lookups.append(kwargs)
+            return RecipeTag.objects.none() if len(lookups) == 1 else filter_tags(*args, **kwargs)
+
+        RecipeTag.objects.create(text='Dinner')
+        data = {'name': 'Recipe1', 'description': 'Recipe1', 'tag_texts': ['Dinner', 'Quick']}
+        with mock.patch.object(RecipeTag.objects, 'filter', side_effect=miss_tag_committed_after_lookup):
+            response = self.client.post(reverse('recipe-create'), json.dumps(data), 'application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        recipe = Recipe.objects.get(pk=response.data['recipe_id'])
+        self.addCleanup(get_recipe_search().remove_recipe, recipe.id)
+        self.assertEqual(sorted(RecipeTagTable.objects.filter(recipe=recipe).values_list('tag__text', flat=True)),
+                         ['Dinner', 'Quick'])
+        self.assertEqual(RecipeTag.objects.filter(text='Dinner').count(), 1)
+
+    def test_add_tags_to_recipe_reports_ids_that_are_not_ids(self):
+        """
+        Ensure tag ids that are not integers are reported as not added instead of failing
+        """
+        recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+        meat = RecipeTag.objects.create(text="Meat")
+        recipe_tag_list = {'tag_ids': [meat.id, [meat.id], {'id': meat.id}, True, '1']}
+
+        response = self.client.post(reverse('recipe-add-tag', args=[recipe.id]), json.dumps(recipe_tag_list), 'application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['data']['tag_ids_added'], [meat.id])
+        self.assertEqual(response.data['data']['tag_ids_not_added'], [[meat.id], {'id': meat.id}, True, '1'])
+
+        response = self.client.post(reverse('recipe-add-tag', args=[recipe.id]), json.dumps({'tag_ids': meat.id}), 'application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('tag_ids', response.data['errors'])
+
+    def test_add_tags_to_recipe_query_count_does_not_grow(self):
+        """
+        Ensure adding many tags costs the same number of queries as adding one
+        """
+        recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+        tags = [RecipeTag.objects.create(text="Tag%s" % i) for i in range(10)]
+
+        def count_queries(tag_ids, tag_texts):
+            with CaptureQueriesContext(connection) as queries:
+                RecipeUtils.add_recipe_tags(recipe, tag_ids, tag_texts)
+            return len(queries)
+
+        one = count_queries([tags[0].id], ['New0'])
+        many = count_queries([tag.id for tag in tags[1:]], ['New%s' % i for i in range(1, 10)])
+        self.assertEqual(one, many)
+
     def test_user_cannot_add_tag_to_recipe_of_other_user(self):
         """
         Ensure other user cannot add tag to a recipe
@@ -215,6 +644,83 @@ class RecipeTests(base_tests.BaseApiTest):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(UserRecipeFavourites.objects.filter(userprofile=self.user.userprofile).count(), 0)
 
+    def test_favourite_and_comment_update_recipe_counters(self):
+        """
+        Ensure favourite and comment counts follow favourites and comments
+        """
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=other_user)
+
+        self.client.post(reverse('recipe-favourite', args=[recipe.id]))
+        self.client.post(reverse('recipe-comment', args=[recipe.id]), json.dumps({'comment': 'nice'}), 'application/json')
+        response = self.client.get(reverse('recipe-list-view'))
+        self.assertEqual(response.data['results'][0]['favourited_count'], 1)
+        self.assertEqual(response.data['results'][0]['comment_count'], 1)
+
+        self.client.delete(reverse('recipe-favourite', args=[recipe.id]))
+        self.assertEqual(Recipe.objects.get(pk=recipe.id).favourited_count, 0)
+
+    def test_reconcile_counters_repairs_drift(self):
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=other_user)
+        UserRecipeFavourites.objects.create(userprofile=self.user.userprofile, recipe=recipe)
+        self.user.userprofile.follows.add(other_user.userprofile)
+        Recipe.objects.filter(pk=recipe.id).update(comment_count=5)
+
+        call_command('reconcile_counters', stdout=StringIO())
+        recipe = Recipe.objects.get(pk=recipe.id)
+        self.assertEqual((recipe.favourited_count, recipe.comment_count), (1, 0))
+        self.assertEqual(User.objects.get(pk=self.user.id).userprofile.following_count, 1)
+        self.assertEqual(User.objects.get(pk=other_user.id).userprofile.followers_count, 1)
+
+    def test_recipe_list_is_favourited_reflects_user_favourites(self):
+        """
+        Ensure is_favourited is only true for recipes favourited by the login user
+        """
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=other_user)
+        recipe2 = Recipe.objects.create(name='Recipe2', description='Recipe2', upload_by_user=other_user)
+        UserRecipeFavourites.objects.create(userprofile=self.user.userprofile, recipe=recipe)
+        UserRecipeFavourites.objects.create(userprofile=other_user.userprofile, recipe=recipe2)
+
+        response = self.client.get(reverse('recipe-list-view'))
+        is_favourited = {r['id']: r['is_favourited'] for r in response.data['results']}
+        self.assertEqual(is_favourited, {recipe.id: True, recipe2.id: False})
+
+    def test_recipe_list_query_count_independent_of_page_size(self):
+        """
+        Ensure is_favourited does not issue a query per recipe
+        """
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=other_user)
+        UserRecipeFavourites.objects.create(userprofile=self.user.userprofile, recipe=recipe)
+
+        with CaptureQueriesContext(connection) as one_recipe_queries:
+            self.client.get(reverse('recipe-list-view'))
+
+        for i in range(9):
+            recipe = Recipe.objects.create(name='Recipe%s' % i, description='Recipe', upload_by_user=other_user)
+            UserRecipeFavourites.objects.create(userprofile=self.user.userprofile, recipe=recipe)
+
+        with CaptureQueriesContext(connection) as ten_recipe_queries:
+            response = self.client.get(reverse('recipe-list-view'))
+        self.assertTrue(all(r['is_favourited'] for r in response.data['results']))
+        self.assertEqual(len(ten_recipe_queries), len(one_recipe_queries))
+
+    def test_recipe_details_is_favourited(self):
+        """
+        Ensure recipe details show whether the login user favourited the recipe
+        """
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=other_user)
+
+        response = self.client.get(reverse('recipe-view', args=[recipe.id]))
+        self.assertFalse(response.data['data']['is_favourited'])
+
+        UserRecipeFavourites.objects.create(userprofile=self.user.userprofile, recipe=recipe)
+        response = self.client.get(reverse('recipe-view', args=[recipe.id]))
+        self.assertTrue(response.data['data']['is_favourited'])
+
     def test_add_ingredient_to_recipe(self):
         recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
         ingredient = Ingredient.objects.create(name="onion", description="onion1")
@@ -293,6 +799,48 @@ class RecipeInstructionTest(base_tests.BaseApiTest):
         self.assertFalse(RecipeInstruction.objects.filter(pk=repInstr.id).exists())
 
 
+    def test_recipe_time_required_follows_instruction_changes(self):
+        recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+
+        data = {'recipe_id': recipe.id, 'step_num': 1, 'instruction': "instru1", 'duration_minute': 10, 'duration_hour': 1}
+        response = self.client.post(reverse('recipe-instruction-view'), json.dumps(data), 'application/json')
+        instruction_id = response.data['instruction_id']
+        data = {'recipe_id': recipe.id, 'step_num': 2, 'instruction': "instru2", 'duration_minute': 5, 'duration_hour': 0}
+        self.client.post(reverse('recipe-instruction-view'), json.dumps(data), 'application/json')
+        self.assertEqual(Recipe.objects.get(pk=recipe.id).total_time_required, timedelta(hours=1, minutes=15))
+
+        data = {'recipe_id': recipe.id, 'instruction_id': instruction_id}
+        self.client.delete(reverse('recipe-instruction-view'), json.dumps(data), 'application/json')
+        self.assertEqual(Recipe.objects.get(pk=recipe.id).total_time_required, timedelta(minutes=5))
+
+    def test_instruction_without_time_required_does_not_break_recipe(self):
+        recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+        RecipeInstruction.objects.create(recipe=recipe, step_num=1, instruction="test")
+        RecipeInstruction.objects.create(recipe=recipe, step_num=2, instruction="test", time_required=timedelta(minutes=5))
+
+        response = self.client.get(reverse('recipe-view', args=[recipe.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data']['time_required'], str(timedelta(minutes=5)))
+
+    def test_backfill_recipe_time_required_command(self):
+        recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+        RecipeInstruction.objects.create(recipe=recipe, step_num=1, instruction="test", time_required=timedelta(minutes=10))
+        Recipe.objects.filter(pk=recipe.id).update(total_time_required=timedelta(0))
+
+        call_command('backfill_recipe_time_required', stdout=StringIO())
+        self.assertEqual(Recipe.objects.get(pk=recipe.id).total_time_required, timedelta(minutes=10))
+
+    def test_filter_recipe_list_by_max_duration(self):
+        quick_recipe = Recipe.objects.create(name='Quick', description='Quick', upload_by_user=self.user)
+        slow_recipe = Recipe.objects.create(name='Slow', description='Slow', upload_by_user=self.user)
+        RecipeInstruction.objects.create(recipe=quick_recipe, step_num=1, instruction="test", time_required=timedelta(minutes=10))
+        RecipeInstruction.objects.create(recipe=slow_recipe, step_num=1, instruction="test", time_required=timedelta(hours=2))
+
+        response = self.client.get(reverse('recipe-list-view'), {'max_duration_minute': 30})
+        self.assertEqual([r['id'] for r in response.data['results']], [quick_recipe.id])
+
+
+@override_settings(IMAGE_INGEST_WORKERS=0, IMAGE_RESIZE_WORKERS=0)
 class RecipeImageTest(base_tests.BaseApiTest):
 
     def setUp(self):
@@ -303,6 +851,10 @@ class RecipeImageTest(base_tests.BaseApiTest):
         super(RecipeImageTest, self).tearDown()
         rmtree(self.media_folder)
 
+    def upload_recipe_image(self, recipe, path='test_image/fish-cakes-recipe.jpg'):
+        image = SimpleUploadedFile(name='test_image.jpg', content=open(path, 'rb').read(), content_type='image/jpeg')
+        return self.client.post(reverse('recipe-image-upload', args=[recipe.id]), {'image': image}, format='multipart')
+
     def test_cannot_upload_image_to_otheruser_recipe(self):
         with override_settings(MEDIA_ROOT=self.media_folder):
             other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
@@ -322,7 +874,168 @@ class RecipeImageTest(base_tests.BaseApiTest):
             image = SimpleUploadedFile(name='test_image.jpg', content=open('test_image/food.png', 'rb').read(), content_type='image/png')
             form_data = {'image': image}
             response = self.client.post(reverse('recipe-image-upload', args=[recipe.id]), form_data, format='multipart')
-            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+    def test_upload_makes_renditions_served_by_width(self):
+        with override_settings(MEDIA_ROOT=self.media_folder):
+            recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+            self.assertEqual(self.upload_recipe_image(recipe).status_code, status.HTTP_202_ACCEPTED)
+
+            recipe = Recipe.objects.get(pk=recipe.id)
+            self.assertTrue(default_storage.exists(recipe.image.name))
+            renditions = parse_renditions(recipe.image, recipe.image_renditions)
+            # the 900 pixels wide original is not enlarged to 1280
+            self.assertEqual(sorted(renditions['jpeg']), [160, 320, 640, 900])
+            self.assertEqual(sorted(renditions['webp']), [160, 320, 640, 900])
+            for keys in renditions.values():
+                for width, key in keys.items():
+                    self.assertEqual(Image.open(default_storage.open(key)).size[0], width)
+
+            response = self.client.get(reverse('recipe-list-view'))
+            listed = response.data['results'][0]
+            self.assertTrue(listed['image_url'].endswith('.w640.jpeg'))
+            self.assertTrue(listed['image_webp_url'].endswith('.w640.webp'))
+
+            response = self.client.get(reverse('recipe-view', args=[recipe.id]))
+            self.assertTrue(response.data['data']['image_url'].endswith('.w900.jpeg'))
+
+    def test_renditions_of_rotated_photo_are_upright(self):
+        with override_settings(MEDIA_ROOT=self.media_folder):
+            recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+            # stored 400x200 with its blue quarter on the left, EXIF Orientation 6
+            self.upload_recipe_image(recipe, 'test_image/rotated-orientation-6.jpg')
+
+            recipe = Recipe.objects.get(pk=recipe.id)
+            renditions = parse_renditions(recipe.image, recipe.image_renditions)
+            self.assertEqual(sorted(renditions['jpeg']), [160, 200])
+            for keys in renditions.values():
+                rendition = Image.open(default_storage.open(keys[160])).convert('RGB')
+                self.assertEqual(rendition.size, (160, 320))
+                # turned clockwise, the blue quarter is on top
+                top, bottom = rendition.getpixel((80, 20)), rendition.getpixel((80, 300))
+                self.assertGreater(top[2], top[0])
+                self.assertGreater(bottom[0], bottom[2])
+
+    def test_first_upload_adds_timeline_event_with_image(self):
+        with override_settings(MEDIA_ROOT=self.media_folder):
+            recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+            self.upload_recipe_image(recipe)
+            uploaded = Recipe.objects.get(pk=recipe.id)
+            self.upload_recipe_image(recipe)
+
+            activity = ActivityTimeline.objects.get(user=self.user, event_type=ActivityTimeline.UPLOAD)
+            self.assertEqual(activity.target_object_image.name, uploaded.image.name)
+            self.assertEqual(activity.target_object_image_renditions, uploaded.image_renditions)
+
+    def test_replaced_image_and_renditions_are_deleted(self):
+        with override_settings(MEDIA_ROOT=self.media_folder):
+            recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+            self.upload_recipe_image(recipe)
+            first = Recipe.objects.get(pk=recipe.id)
+            self.upload_recipe_image(recipe, 'test_image/food.png')
+            second = Recipe.objects.get(pk=recipe.id)
+            self.upload_recipe_image(recipe)
+            # deletions wait for the purge
+            self.assertTrue(default_storage.exists(second.image.name))
+            call_command('purge_image_deletions', stdout=StringIO())
+
+            # the timeline event of the first upload still shows the first image
+            self.assertTrue(default_storage.exists(first.image.name))
+            self.assertEqual(Recipe.objects.get(pk=recipe.id).image.name, first.image.name)
+            self.assertFalse(default_storage.exists(second.image.name))
+            for keys in parse_renditions(second.image, second.image_renditions).values():
+                for key in keys.values():
+                    self.assertFalse(default_storage.exists(key))
+
+    def test_same_image_uploaded_twice_is_stored_once(self):
+        with override_settings(MEDIA_ROOT=self.media_folder):
+            recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+            other_recipe = Recipe.objects.create(name='Recipe2', description='Recipe2', upload_by_user=self.user)
+            self.upload_recipe_image(recipe)
+            with mock.patch.object(default_storage, 'save') as save:
+                self.assertEqual(self.upload_recipe_image(other_recipe).status_code, status.HTTP_202_ACCEPTED)
+            self.assertFalse(save.called)
+
+            recipe = Recipe.objects.get(pk=recipe.id)
+            other_recipe = Recipe.objects.get(pk=other_recipe.id)
+            self.assertEqual(other_recipe.image.name, recipe.image.name)
+            self.assertEqual(other_recipe.image_renditions, recipe.image_renditions)
+            self.assertEqual(ImageBlob.objects.get().key, recipe.image.name)
+
+            ActivityTimeline.objects.all().delete()
+            RecipeUtils.delete_recipe_image(recipe)
+            call_command('purge_image_deletions', stdout=StringIO())
+            self.assertTrue(default_storage.exists(other_recipe.image.name))
+            RecipeUtils.delete_recipe_image(other_recipe)
+            call_command('purge_image_deletions', stdout=StringIO())
+            self.assertFalse(default_storage.exists(other_recipe.image.name))
+            self.assertFalse(ImageBlob.objects.exists())
+
+    def test_avatar_saved_on_model_is_stored_under_its_content_hash(self):
+        with override_settings(MEDIA_ROOT=self.media_folder):
+            recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+            self.upload_recipe_image(recipe)
+            recipe = Recipe.objects.get(pk=recipe.id)
+
+            # as the admin saves an uploaded avatar
+            profile = UserProfile.objects.get(user=self.user)
+            profile.avatar = SimpleUploadedFile(name='avatar.jpg',
+                                                content=open('test_image/fish-cakes-recipe.jpg', 'rb').read())
+            with mock.patch.object(default_storage, 'save') as save:
+                profile.save()
+            self.assertFalse(save.called)
+
+            profile = UserProfile.objects.get(user=self.user)
+            self.assertEqual(profile.avatar.name, recipe.image.name)
+            self.assertEqual(profile.avatar_renditions, recipe.image_renditions)
+            self.assertEqual(ImageBlob.objects.count(), 1)
+
+            profile.avatar = SimpleUploadedFile(name='avatar.png', content=open('test_image/food.png', 'rb').read())
+            profile.save()
+            profile = UserProfile.objects.get(user=self.user)
+            self.assertEqual(profile.avatar.name, ImageBlob.objects.exclude(key=recipe.image.name).get().key)
+            self.assertTrue(parse_renditions(profile.avatar, profile.avatar_renditions))
+            self.assertFalse(os.path.exists(os.path.join(self.media_folder, 'user')))
+
+    def test_uploaded_original_is_stored_unchanged(self):
+        with override_settings(MEDIA_ROOT=self.media_folder):
+            recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+            self.upload_recipe_image(recipe)
+
+            with default_storage.open(Recipe.objects.get(pk=recipe.id).image.name) as stored:
+                self.assertEqual(stored.read(), open('test_image/fish-cakes-recipe.jpg', 'rb').read())
+
+    def test_upload_that_is_not_an_image_is_rejected(self):
+        with override_settings(MEDIA_ROOT=self.media_folder):
+            recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+            upload = SimpleUploadedFile(name='test_image.jpg', content=b'<?php echo "hello"; ?>' * 100,
+                                        content_type='image/jpeg')
+            response = self.client.post(reverse('recipe-image-upload', args=[recipe.id]), {'image': upload},
+                                        format='multipart')
+
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('not a JPEG, PNG, GIF or WebP image', response.data['detail'])
+            self.assertFalse(Recipe.objects.get(pk=recipe.id).image)
+
+    def test_image_with_too_many_pixels_is_rejected(self):
+        with override_settings(MEDIA_ROOT=self.media_folder, IMAGE_UPLOAD_MAX_PIXELS=100 * 100):
+            recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+            response = self.upload_recipe_image(recipe)
+
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('megapixels', response.data['detail'])
+            self.assertFalse(Recipe.objects.get(pk=recipe.id).image)
+
+    def test_image_too_large_is_rejected(self):
+        with override_settings(MEDIA_ROOT=self.media_folder, IMAGE_UPLOAD_MAX_BYTES=2 ** 20):
+            recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+            content = open('test_image/fish-cakes-recipe.jpg', 'rb').read() + b'\0' * 2 ** 20
+            upload = SimpleUploadedFile(name='test_image.jpg', content=content, content_type='image/jpeg')
+            response = self.client.post(reverse('recipe-image-upload', args=[recipe.id]), {'image': upload},
+                                        format='multipart')
+
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('at most 1 MB', response.data['detail'])
 
     def test_delete_image(self):
         with override_settings(MEDIA_ROOT=self.media_folder):
@@ -331,17 +1044,132 @@ class RecipeImageTest(base_tests.BaseApiTest):
             image = SimpleUploadedFile(name='test_image.jpg', content=open('test_image/food.png', 'rb').read(), content_type='image/png')
             form_data = {'image': image}
             response = self.client.post(reverse('recipe-image-upload', args=[recipe.id]), form_data, format='multipart')
+            uploaded = Recipe.objects.get(pk=recipe.id)
+            ActivityTimeline.objects.all().delete()
 
             response = self.client.delete(reverse('recipe-image-upload', args=[recipe.id]))
             self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse(Recipe.objects.get(pk=recipe.id).image)
+            self.assertTrue(default_storage.exists(uploaded.image.name))
+
+            out = StringIO()
+            call_command('purge_image_deletions', stdout=out)
+            self.assertIn(', 0 could not be deleted', out.getvalue())
+            self.assertFalse(default_storage.exists(uploaded.image.name))
+            self.assertFalse(ImageDeletion.objects.exists())
+
+    def test_purge_skips_image_uploaded_again(self):
+        with override_settings(MEDIA_ROOT=self.media_folder):
+            recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+            self.upload_recipe_image(recipe)
+            uploaded = Recipe.objects.get(pk=recipe.id)
+            ActivityTimeline.objects.all().delete()
+            RecipeUtils.delete_recipe_image(uploaded)
+            self.upload_recipe_image(recipe)
+
+            call_command('purge_image_deletions', stdout=StringIO())
+            recipe = Recipe.objects.get(pk=recipe.id)
+            self.assertTrue(default_storage.exists(recipe.image.name))
+            for keys in parse_renditions(recipe.image, recipe.image_renditions).values():
+                for key in keys.values():
+                    self.assertTrue(default_storage.exists(key))
+            self.assertFalse(ImageDeletion.objects.exists())
+
+    def test_delete_image_shown_in_timeline_keeps_file(self):
+        with override_settings(MEDIA_ROOT=self.media_folder):
+            recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+            self.upload_recipe_image(recipe)
+            uploaded = Recipe.objects.get(pk=recipe.id)
+
+            response = self.client.delete(reverse('recipe-image-upload', args=[recipe.id]))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse(Recipe.objects.get(pk=recipe.id).image)
+            self.assertTrue(default_storage.exists(uploaded.image.name))
 
     def test_upload_recipe_instruction_image(self):
         with override_settings(MEDIA_ROOT=self.media_folder):
 
             recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
             recipe_instruction = RecipeInstruction.objects.create(recipe=recipe, step_num=1, instruction="test")
+            Recipe.objects.filter(pk=recipe.id).update(updated_at=timezone.now() - timedelta(days=1))
 
             image = SimpleUploadedFile(name='test_image.jpg', content=open('test_image/food.png', 'rb').read(), content_type='image/png')
             form_data = {'image': image}
             response = self.client.post(reverse('recipe-instruction-image-upload', args=[recipe_instruction.id]), form_data, format='multipart')
-            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+            recipe_instruction = RecipeInstruction.objects.get(pk=recipe_instruction.id)
+            self.assertTrue(parse_renditions(recipe_instruction.image, recipe_instruction.image_renditions))
+            self.assertGreater(Recipe.objects.get(pk=recipe.id).updated_at, timezone.now() - timedelta(hours=1))
+
+    def test_images_saved_on_the_model_get_renditions(self):
+        with override_settings(MEDIA_ROOT=self.media_folder):
+            name = default_storage.save('user/avatar.jpg', open('test_image/fish-cakes-recipe.jpg', 'rb'))
+            userprofile = self.user.userprofile
+            userprofile.avatar = name
+            userprofile.save()
+
+            response = self.client.get(reverse('user-profile-detail', args=[self.user.id]))
+            self.assertTrue(response.data['data']['avatar_url'].endswith('.w160.jpeg'))
+
+    def test_saving_again_keeps_the_renditions(self):
+        with override_settings(MEDIA_ROOT=self.media_folder):
+            name = default_storage.save('user/avatar.jpg', open('test_image/fish-cakes-recipe.jpg', 'rb'))
+            userprofile = self.user.userprofile
+            userprofile.avatar = name
+            userprofile.save()
+            renditions = UserProfile.objects.get(pk=userprofile.pk).avatar_renditions
+
+            with mock.patch('sevchefs_api.images.make_renditions') as make:
+                userprofile.description = 'Cooks'
+                userprofile.save()
+                self.assertFalse(make.called)
+            self.assertEqual(UserProfile.objects.get(pk=userprofile.pk).avatar_renditions, renditions)
+
+    def test_renditions_job_skips_image_that_has_them(self):
+        with override_settings(MEDIA_ROOT=self.media_folder):
+            name = default_storage.save('recipe/food.png', open('test_image/food.png', 'rb'))
+            recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user, image=name)
+            renditions = Recipe.objects.get(pk=recipe.id).image_renditions
+
+            with mock.patch('sevchefs_api.images.make_renditions') as make:
+                ImageIngestJob(name, [(Recipe._meta.label, recipe.id, 'image')]).run()
+                self.assertFalse(make.called)
+            self.assertEqual(Recipe.objects.get(pk=recipe.id).image_renditions, renditions)
+
+    def test_upload_for_deleted_recipe_is_journaled(self):
+        with override_settings(MEDIA_ROOT=self.media_folder):
+            recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+            upload = SimpleUploadedFile(name='food.png', content=open('test_image/food.png', 'rb').read())
+            staged_path, sha256 = stage_upload(upload)
+            job = ImageIngestJob('image/%s.png' % sha256, [(Recipe._meta.label, recipe.id, 'image')],
+                                 staged_path=staged_path, sha256=sha256)
+            recipe.delete()
+            job.run()
+
+            self.assertFalse(os.path.exists(staged_path))
+            self.assertFalse(ImageBlob.objects.exists())
+            call_command('purge_image_deletions', stdout=StringIO())
+            self.assertEqual(os.listdir(os.path.join(self.media_folder, 'image')), [])
+
+    def test_failed_job_removes_staged_upload(self):
+        with override_settings(MEDIA_ROOT=self.media_folder):
+            recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+            staged_path, sha256 = stage_upload(SimpleUploadedFile(name='food.png', content=b'not an image'))
+            job = ImageIngestJob('image/%s.png' % sha256, [(Recipe._meta.label, recipe.id, 'image')],
+                                 staged_path=staged_path, sha256=sha256)
+            with self.assertRaises(OSError):
+                job.run()
+            self.assertFalse(os.path.exists(staged_path))
+
+    def test_make_image_renditions_command(self):
+        with override_settings(MEDIA_ROOT=self.media_folder):
+            recipe = Recipe.objects.create(name='Recipe1', description='Recipe1', upload_by_user=self.user)
+            name = default_storage.save('recipe/food.png', open('test_image/food.png', 'rb'))
+            Recipe.objects.filter(pk=recipe.id).update(image=name)
+
+            out = StringIO()
+            call_command('make_image_renditions', stdout=out)
+            self.assertEqual(out.getvalue().strip(), 'Made the renditions of 1 image(s)')
+            recipe = Recipe.objects.get(pk=recipe.id)
+            self.assertEqual(sorted(parse_renditions(recipe.image, recipe.image_renditions)['jpeg']), [160, 200])
\ No newline at end of file
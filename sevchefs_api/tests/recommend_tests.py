@@ -0,0 +1,125 @@
+import numpy as np
+from scipy import sparse
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.utils.six import StringIO
+
+from rest_framework import status
+
+from sevchefs_api.models import Ingredient, Recipe, RecipeIngredient, RecipeRecommendation, RecipeTag, \
+    RecipeTagTable, UserRecipeFavourites
+from sevchefs_api.recommend import compute_recommendations, nearest_neighbours
+from sevchefs_api.tests import base_tests
+
+
+class RecommendationEngineTests(base_tests.BaseApiTest):
+
+    def setUp(self):
+        super(RecommendationEngineTests, self).setUp()
+        self.chef = User.objects.create_user('chef', 'chef@api.com', 'testpassword')
+        self.other = User.objects.create_user('other', 'other@api.com', 'testpassword')
+
+    def create_recipe(self, name, user=None):
+        return Recipe.objects.create(name=name, description=name, upload_by_user=user or self.chef)
+
+    def recommended_ids(self, user):
+        return [recipe_id for recipe_id, score in compute_recommendations().get(user.id, [])]
+
+    def test_recommend_recipes_favourited_together(self):
+        laksa = self.create_recipe('Laksa')
+        mee_siam = self.create_recipe('Mee Siam')
+        UserRecipeFavourites.objects.create(userprofile=self.user.userprofile, recipe=laksa)
+        UserRecipeFavourites.objects.create(userprofile=self.other.userprofile, recipe=laksa)
+        UserRecipeFavourites.objects.create(userprofile=self.other.userprofile, recipe=mee_siam)
+
+        self.assertEqual(self.recommended_ids(self.user), [mee_siam.id])
+
+    def test_recommend_recipes_sharing_tags_and_ingredients(self):
+        curry = self.create_recipe('Curry')
+        rendang = self.create_recipe('Rendang')
+        salad = self.create_recipe('Salad')
+        spicy = RecipeTag.objects.create(text='spicy')
+        RecipeTagTable.objects.create(recipe=curry, tag=spicy)
+        RecipeTagTable.objects.create(recipe=rendang, tag=spicy)
+        lettuce = Ingredient.objects.create(name='lettuce', description='lettuce')
+        RecipeIngredient.objects.create(recipe=salad, ingredient=lettuce, serving_size='1')
+        UserRecipeFavourites.objects.create(userprofile=self.user.userprofile, recipe=curry)
+
+        self.assertEqual(self.recommended_ids(self.user), [rendang.id])
+
+    def test_tag_on_most_recipes_is_ignored(self):
+        curry = self.create_recipe('Curry')
+        rendang = self.create_recipe('Rendang')
+        salad = self.create_recipe('Salad')
+        easy = RecipeTag.objects.create(text='easy')
+        for recipe in (curry, rendang, salad):
+            RecipeTagTable.objects.create(recipe=recipe, tag=easy)
+        UserRecipeFavourites.objects.create(userprofile=self.user.userprofile, recipe=curry)
+
+        self.assertEqual(self.recommended_ids(self.user), [])
+
+    def test_similarity_keeps_nearest_neighbours_in_blocks(self):
+        features = sparse.csr_matrix(np.array([[1, 1, 0], [1, 1, 0], [1, 0, 0], [0, 0, 1], [0, 1, 1]]))
+
+        whole = nearest_neighbours([(1.0, features)], 2, block_size=10)
+        self.assertEqual(whole.shape, (5, 5))
+        self.assertEqual(whole.diagonal().tolist(), [0] * 5)
+        self.assertTrue(all(count <= 2 for count in np.diff(whole.indptr)))
+        self.assertAlmostEqual(whole[0, 1], 1.0)
+        self.assertEqual(whole[0, 3], 0)
+
+        in_blocks = nearest_neighbours([(1.0, features)], 2, block_size=2)
+        self.assertEqual((whole != in_blocks).nnz, 0)
+
+    def test_recommend_recipes_of_followed_users_but_not_own_recipes(self):
+        own_recipe = self.create_recipe('Own', user=self.user)
+        chef_recipe = self.create_recipe('Chef special')
+        self.create_recipe('Other special', user=self.other)
+        self.user.userprofile.follows.add(self.chef.userprofile)
+
+        recommended = self.recommended_ids(self.user)
+        self.assertEqual(recommended, [chef_recipe.id])
+        self.assertNotIn(own_recipe.id, recommended)
+
+    def test_overall_recommendations_rank_most_favourited_first(self):
+        popular = self.create_recipe('Popular')
+        self.create_recipe('Unknown')
+        UserRecipeFavourites.objects.create(userprofile=self.other.userprofile, recipe=popular)
+
+        overall = compute_recommendations()[None]
+        self.assertEqual(overall[0][0], popular.id)
+        self.assertEqual(len(overall), 2)
+
+
+class RecommendRecipeViewTests(base_tests.BaseApiTest):
+
+    def test_recommend_from_precomputed_recommendations(self):
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        laksa = Recipe.objects.create(name='Laksa', description='Laksa', upload_by_user=other_user)
+        mee_siam = Recipe.objects.create(name='Mee Siam', description='Mee Siam', upload_by_user=other_user)
+        UserRecipeFavourites.objects.create(userprofile=self.user.userprofile, recipe=laksa)
+        UserRecipeFavourites.objects.create(userprofile=other_user.userprofile, recipe=laksa)
+        UserRecipeFavourites.objects.create(userprofile=other_user.userprofile, recipe=mee_siam)
+
+        call_command('refresh_recommendations', stdout=StringIO())
+        self.assertTrue(RecipeRecommendation.objects.filter(user=self.user, recipe=mee_siam).exists())
+
+        response = self.client.get(reverse('recipe-recommend-view'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data']['id'], mee_siam.id)
+
+    def test_recommend_before_refresh_excludes_own_recipes(self):
+        other_user = User.objects.create_user('other', 'other@api.com', 'testpassword')
+        Recipe.objects.create(name='Own', description='Own', upload_by_user=self.user)
+        other_recipe = Recipe.objects.create(name='Other', description='Other', upload_by_user=other_user)
+
+        for i in range(5):
+            response = self.client.get(reverse('recipe-recommend-view'))
+            self.assertEqual(response.data['data']['id'], other_recipe.id)
+
+    def test_recommend_without_recipes(self):
+        response = self.client.get(reverse('recipe-recommend-view'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data['data'])
@@ -1,17 +1,29 @@
+from concurrent.futures import TimeoutError
+from datetime import timedelta
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.db import DatabaseError
+from django.utils.six import StringIO
 import json
+from unittest import mock
 
-from rest_framework import status
+from rest_framework import status, throttling
 from rest_framework.authtoken.models import Token
 
+from sevchefs_api.authentication import get_token_cache
+from sevchefs_api.hashing import get_password_hash_pool
 from sevchefs_api.tests import base_tests
-from sevchefs_api.models import ActivityTimeline, Recipe
+from sevchefs_api.throttling import account_login_buckets, login_buckets
+from sevchefs_api.models import ActivityTimeline, Recipe, UserProfile
 
 from tempfile import mkdtemp
 from shutil import rmtree
-from django.test.utils import override_settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils import timezone
 
 
 class UserTests(base_tests.BaseGuestUser):
@@ -59,6 +71,18 @@ class UserTests(base_tests.BaseGuestUser):
 
         response = self.client.post(reverse('user-signup'), json.dumps(signup_details), 'application/json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        user = User.objects.get(username='user1')
+        self.assertTrue(user.password.startswith('argon2$argon2id$'))
+        self.assertTrue(user.check_password('password1'))
+
+    def test_sign_up_hashes_in_process_pool_by_default(self):
+        signup_details = {'username': 'user1', 'email': 'user1@example.com', 'password': 'password1'}
+        pool = get_password_hash_pool()
+        with mock.patch.object(pool, 'submit', wraps=pool.submit) as submit:
+            response = self.client.post(reverse('user-signup'), json.dumps(signup_details), 'application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(submit.called)
+        self.assertTrue(User.objects.get(username='user1').check_password('password1'))
 
     def test_guest_user_sign_up_400_when_username_taken(self):
         """
@@ -72,6 +96,45 @@ class UserTests(base_tests.BaseGuestUser):
         response = self.client.post(reverse('user-signup'), json.dumps(signup_details), 'application/json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_guest_user_sign_up_400_when_email_taken_in_any_case(self):
+        """
+        Ensure signup is rejected if another account has the email
+        """
+        User.objects.create_user('user1', 'User1@Example.com', 'password1')
+        signup_details = {'username': 'user2', 'email': 'USER1@example.com', 'password': 'password2'}
+        response = self.client.post(reverse('user-signup'), json.dumps(signup_details), 'application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['detail'], 'The email entered is already in use')
+        self.assertFalse(User.objects.filter(username='user2').exists())
+
+    def test_sign_up_creates_token_and_userprofile(self):
+        signup_details = {'username': 'user1', 'email': 'user1@example.com', 'password': 'password1'}
+        response = self.client.post(reverse('user-signup'), json.dumps(signup_details), 'application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        user = User.objects.get(username='user1')
+        self.assertTrue(Token.objects.filter(user=user).exists())
+        self.assertTrue(UserProfile.objects.filter(user=user).exists())
+
+    def test_failed_sign_up_leaves_no_user(self):
+        signup_details = {'username': 'user1', 'email': 'user1@example.com', 'password': 'password1'}
+        with mock.patch('sevchefs_api.signals.UserProfile.objects.create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.client.post(reverse('user-signup'), json.dumps(signup_details), 'application/json')
+        self.assertFalse(User.objects.filter(username='user1').exists())
+        self.assertFalse(Token.objects.filter(user__username='user1').exists())
+
+    def test_import_users_command(self):
+        User.objects.create_user('load1', 'load1@example.com', 'password1')
+        out = StringIO()
+        call_command('import_users', count=3, prefix='load', batch_size=2, stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Created 2 user(s), skipped 1 existing')
+
+        users = User.objects.filter(username__in=['load0', 'load2'])
+        self.assertEqual(users.count(), 2)
+        self.assertEqual(Token.objects.filter(user__in=users).count(), 2)
+        self.assertEqual(UserProfile.objects.filter(user__in=users).count(), 2)
+        self.assertTrue(users[0].check_password('loadtest-password'))
+
     def test_sign_up_w_missing_details_return_400(self):
         """
         Ensure signup is rejected if missing fields provided
@@ -105,6 +168,197 @@ class UserTests(base_tests.BaseGuestUser):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
+    def test_view_user_profile_not_modified(self):
+        """
+        Ensure an unchanged profile is answered with 304 and a follow or rename gives a new ETag
+        """
+        user = User.objects.create_user('test', 'test@api.com', 'testpassword')
+        follower = User.objects.create_user('follower', 'follower@api.com', 'testpassword')
+        url = reverse('user-profile-detail', args=[user.id])
+
+        def get_etag():
+            # start from an older version so that a change within the same second still shows
+            UserProfile.objects.filter(user=user).update(updated_at=timezone.now() - timedelta(days=1))
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            return etag
+
+        etag = get_etag()
+        self.client.login(username='follower', password='testpassword')
+        self.client.post(reverse('user-follow', args=[user.id]))
+        self.client.logout()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+        etag = get_etag()
+        user.username = 'renamed'
+        user.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+        # logging in does not change the profile
+        etag = get_etag()
+        self.client.login(username='renamed', password='testpassword')
+        self.client.logout()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_view_nonexist_user_profile_404(self):
+        response = self.client.get(reverse('user-profile-detail', args=[123]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class LoginTest(base_tests.BaseGuestUser):
+
+    def setUp(self):
+        super(LoginTest, self).setUp()
+        login_buckets.clear()
+        account_login_buckets.clear()
+        self.user = User.objects.create_user('test', 'Test@API.com', 'testpassword')
+        self.token = Token.objects.get(user=self.user)
+
+    def login(self, email, password='testpassword', **extra):
+        return self.client.post(reverse('auth-token-view'), json.dumps({'email': email, 'password': password}),
+                                'application/json', **extra)
+
+    def test_login_with_email_in_any_case_or_username(self):
+        for identifier in ('test@api.com', 'TEST@api.COM', 'test'):
+            response = self.login(identifier)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['token'], self.token.key)
+
+    def test_login_loads_user_and_token_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.login('test@api.com').status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 1)
+
+    def test_inactive_user_cannot_login(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.login('test@api.com').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_login_attempts_are_rate_limited_per_client(self):
+        for i in range(10):
+            self.assertEqual(self.login('user%s@api.com' % i).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.login('test@api.com')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+
+        # another client is not limited
+        self.assertEqual(self.login('test@api.com', REMOTE_ADDR='10.0.0.2').status_code, status.HTTP_200_OK)
+
+    def test_made_up_forwarded_for_does_not_escape_rate_limit(self):
+        for i in range(10):
+            self.login('user%s@api.com' % i, HTTP_X_FORWARDED_FOR='10.1.0.%s' % i)
+        response = self.login('test@api.com', HTTP_X_FORWARDED_FOR='10.1.1.1')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_rate_limit_behind_proxy_keys_on_address_it_saw(self):
+        with mock.patch.object(throttling.api_settings, 'NUM_PROXIES', 1):
+            for i in range(10):
+                # the proxy appends the address it saw to whatever the client sent
+                self.login('user%s@api.com' % i, HTTP_X_FORWARDED_FOR='10.1.0.%s, 203.0.113.7' % i)
+            response = self.login('test@api.com', HTTP_X_FORWARDED_FOR='10.1.1.1, 203.0.113.7')
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            response = self.login('test@api.com', HTTP_X_FORWARDED_FOR='10.1.1.1, 203.0.113.8')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_login_attempts_are_rate_limited_per_client_and_account(self):
+        for i in range(5):
+            self.login('test@api.com', 'wrong')
+        response = self.login('TEST@api.com')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        # the same client can still try another account
+        self.assertEqual(self.login('other@api.com').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_other_clients_cannot_lock_an_account_out(self):
+        for i in range(20):
+            self.login('test@api.com', 'wrong', REMOTE_ADDR='10.0.0.%s' % i)
+        self.assertEqual(self.login('test@api.com', REMOTE_ADDR='10.0.1.1').status_code, status.HTTP_200_OK)
+
+    def test_login_rehashes_password_of_another_hasher(self):
+        User.objects.filter(id=self.user.id).update(password=make_password('testpassword', hasher='pbkdf2_sha256'))
+        self.assertEqual(self.login('test@api.com').status_code, status.HTTP_200_OK)
+        password = User.objects.get(id=self.user.id).password
+        self.assertTrue(password.startswith('argon2$argon2id$'))
+
+        # logging in again keeps the new hash
+        self.assertEqual(self.login('test@api.com').status_code, status.HTTP_200_OK)
+        self.assertEqual(User.objects.get(id=self.user.id).password, password)
+
+    def test_login_rehashes_password_when_cost_changes(self):
+        password = User.objects.get(id=self.user.id).password
+        # hashed inline, as the settings of a test do not reach pool workers started before it
+        with self.settings(ARGON2_TIME_COST=3, PASSWORD_HASH_WORKERS=0):
+            self.assertEqual(self.login('test@api.com').status_code, status.HTTP_200_OK)
+        rehashed = User.objects.get(id=self.user.id).password
+        self.assertNotEqual(rehashed, password)
+        self.assertIn(',t=3,', rehashed)
+
+    def test_wrong_password_is_not_rehashed(self):
+        User.objects.filter(id=self.user.id).update(password=make_password('testpassword', hasher='pbkdf2_sha256'))
+        self.assertEqual(self.login('test@api.com', 'wrong').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(User.objects.get(id=self.user.id).password.startswith('pbkdf2_sha256$'))
+
+    def test_login_hashes_in_process_pool(self):
+        try:
+            with self.settings(PASSWORD_HASH_WORKERS=1):
+                self.assertEqual(self.login('test@api.com').status_code, status.HTTP_200_OK)
+                self.assertEqual(self.login('test@api.com', 'wrong').status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIsNotNone(get_password_hash_pool().executor)
+        finally:
+            get_password_hash_pool().shutdown()
+
+    def test_login_answers_503_when_hashing_is_too_slow(self):
+        with mock.patch.object(get_password_hash_pool(), 'run', side_effect=TimeoutError):
+            response = self.login('test@api.com')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+class TokenAuthenticationTest(base_tests.BaseGuestUser):
+
+    def setUp(self):
+        super(TokenAuthenticationTest, self).setUp()
+        get_token_cache().clear()
+        self.user = User.objects.create_user('test', 'test@api.com', 'testpassword')
+        self.auth = 'Token %s' % Token.objects.get(user=self.user).key
+
+    def get_favourites(self):
+        return self.client.get(reverse('favourited-recipe-list'), HTTP_AUTHORIZATION=self.auth)
+
+    def test_token_lookup_is_cached(self):
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(self.get_favourites().status_code, status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as second:
+            self.assertEqual(self.get_favourites().status_code, status.HTTP_200_OK)
+        self.assertEqual(len(second), len(first) - 1)
+
+        stats = get_token_cache().stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 1, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_logout_invalidates_cached_token(self):
+        self.get_favourites()
+        response = self.client.post(reverse('logout-view'), HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_favourites().status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = self.client.post(reverse('auth-token-view'),
+                                    json.dumps({'email': 'test@api.com', 'password': 'testpassword'}), 'application/json')
+        self.assertNotEqual('Token %s' % response.data['token'], self.auth)
+
+    def test_deactivation_invalidates_cached_token(self):
+        self.get_favourites()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_favourites().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_invalidates_cached_user(self):
+        self.get_favourites()
+        self.user.set_password('newpassword')
+        self.user.save()
+        self.assertEqual(get_token_cache().stats()['size'], 0)
+
+
 class FollowUnfollowApiTest(base_tests.BaseApiTest):
     def test_follow_user_success(self):
         """
@@ -138,6 +392,41 @@ class FollowUnfollowApiTest(base_tests.BaseApiTest):
         self.assertFalse(self.user.userprofile.follows.filter(pk=userOne.userprofile.user_id).exists())
         self.assertFalse(self.user.userprofile.follows.filter(pk=userTwo.userprofile.user_id).exists())
 
+    def test_follow_unfollow_updates_counters(self):
+        """
+        Ensure following and unfollowing keep following and follower counts
+        """
+        userOne = User.objects.create_user('user1', 'user1@api.com', 'testpassword')
+
+        self.client.post(reverse('user-follow', args=[userOne.id]))
+        self.assertEqual(UserProfile.objects.get(user=self.user).following_count, 1)
+        self.assertEqual(UserProfile.objects.get(user=userOne).followers_count, 1)
+
+        response = self.client.get(reverse('user-profile-detail', args=[userOne.id]))
+        self.assertEqual(response.data['data']['followers_count'], 1)
+
+        self.client.delete(reverse('user-follow', args=[userOne.id]))
+        self.assertEqual(UserProfile.objects.get(user=self.user).following_count, 0)
+        self.assertEqual(UserProfile.objects.get(user=userOne).followers_count, 0)
+
+    def test_repeated_follow_and_unfollow_move_counters_once(self):
+        """
+        Ensure a repeated follow or unfollow is answered with 400 and leaves the counts alone
+        """
+        userOne = User.objects.create_user('user1', 'user1@api.com', 'testpassword')
+
+        self.client.post(reverse('user-follow', args=[userOne.id]))
+        response = self.client.post(reverse('user-follow', args=[userOne.id]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(UserProfile.objects.get(user=self.user).following_count, 1)
+        self.assertEqual(UserProfile.objects.get(user=userOne).followers_count, 1)
+
+        self.client.delete(reverse('user-follow', args=[userOne.id]))
+        response = self.client.delete(reverse('user-follow', args=[userOne.id]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(UserProfile.objects.get(user=self.user).following_count, 0)
+        self.assertEqual(UserProfile.objects.get(user=userOne).followers_count, 0)
+
     def test_follow_nonexist_user(self):
         """
         Ensure correct HTTP Response generated when following non-existing user
@@ -172,6 +461,7 @@ class FollowUnfollowApiTest(base_tests.BaseApiTest):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
+@override_settings(IMAGE_INGEST_WORKERS=0, IMAGE_RESIZE_WORKERS=0)
 class ActivityTimelineApiTest(base_tests.BaseApiTest):
 
     def setUp(self):
@@ -189,7 +479,7 @@ class ActivityTimelineApiTest(base_tests.BaseApiTest):
             image = SimpleUploadedFile(name='test_image.jpg', content=open('test_image/food.png', 'rb').read(), content_type='image/png')
             form_data = {'image': image}
             response = self.client.post(reverse('recipe-image-upload', args=[recipe.id]), form_data, format='multipart')
-            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
             self.assertEqual(ActivityTimeline.objects.count(), 1)
             timeline = ActivityTimeline.objects.first()
             self.assertEqual(timeline.get_formatted_summary_text(self.user), "you uploaded a new recipe")
@@ -232,3 +522,76 @@ class ActivityTimelineApiTest(base_tests.BaseApiTest):
             testResponse = self.client.get(reverse('user-activity-timeline'))
             self.assertEqual(testResponse.status_code, status.HTTP_200_OK)
             self.assertEqual(ActivityTimeline.objects.count(), 3)
+            self.assertEqual(len(testResponse.data['results']), 3)
+
+    def test_activity_timeline_fan_out_to_followers(self):
+        """
+        Ensure followers see the activity of users they follow while
+        uninvolved users do not
+        """
+        userOne = User.objects.create_user('user1', 'user1@api.com', 'testpassword')
+        userTwo = User.objects.create_user('user2', 'user2@api.com', 'testpassword')
+        bystander = User.objects.create_user('user3', 'user3@api.com', 'testpassword')
+        self.user.userprofile.follows.add(userOne.userprofile)
+
+        ActivityTimeline.objects.create(user=userOne, target_user=userTwo,
+                                        event_type=ActivityTimeline.FOLLOW)
+
+        response = self.client.get(reverse('user-activity-timeline'))
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['user'], userOne.id)
+        self.assertEqual(userTwo.timeline_inbox.count(), 1)
+        self.assertEqual(bystander.timeline_inbox.count(), 0)
+
+    def test_activity_timeline_summary_from_each_point_of_view(self):
+        """
+        Ensure the summary names the actor and target relative to the viewer
+        """
+        userOne = User.objects.create_user('user1', 'user1@api.com', 'testpassword')
+        userTwo = User.objects.create_user('user2', 'user2@api.com', 'testpassword')
+
+        follow = ActivityTimeline.objects.create(user=userOne, target_user=self.user, event_type=ActivityTimeline.FOLLOW)
+        self.assertEqual(follow.get_formatted_summary_text(self.user), "user1 followed you on CookTasty")
+        self.assertEqual(follow.get_formatted_summary_text(userOne), "you followed test on CookTasty")
+        self.assertEqual(follow.get_formatted_summary_text(userTwo), "user1 followed test on CookTasty")
+
+        comment = ActivityTimeline.objects.create(user=self.user, target_user=self.user, event_type=ActivityTimeline.COMMENT)
+        self.assertEqual(comment.get_formatted_summary_text(self.user), "you commented on your recipe")
+        self.assertEqual(comment.get_formatted_summary_text(userOne), "test commented on test's recipe")
+
+        upload = ActivityTimeline.objects.create(user=userOne, event_type=ActivityTimeline.UPLOAD)
+        self.assertEqual(upload.get_formatted_summary_text(self.user), "user1 uploaded a new recipe")
+
+    def test_activity_timeline_query_count_independent_of_entries(self):
+        """
+        Ensure rendering the timeline does not look up users per entry
+        """
+        userOne = User.objects.create_user('user1', 'user1@api.com', 'testpassword')
+        ActivityTimeline.objects.create(user=userOne, target_user=self.user, event_type=ActivityTimeline.FOLLOW)
+        with CaptureQueriesContext(connection) as one_entry_queries:
+            self.client.get(reverse('user-activity-timeline'))
+
+        for i in range(9):
+            other_user = User.objects.create_user('other%s' % i, 'other%s@api.com' % i, 'testpassword')
+            ActivityTimeline.objects.create(user=other_user, target_user=self.user, event_type=ActivityTimeline.FOLLOW)
+        with CaptureQueriesContext(connection) as ten_entry_queries:
+            response = self.client.get(reverse('user-activity-timeline'))
+
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual(len(ten_entry_queries), len(one_entry_queries))
+
+    def test_activity_timeline_cursor_paging(self):
+        """
+        Ensure the timeline is paged newest first without repeating entries
+        """
+        for i in range(15):
+            ActivityTimeline.objects.create(user=self.user, event_type=ActivityTimeline.UPLOAD)
+
+        first_page = self.client.get(reverse('user-activity-timeline')).data
+        second_page = self.client.get(first_page['next']).data
+        self.assertEqual(len(first_page['results']), 10)
+        self.assertEqual(len(second_page['results']), 5)
+        self.assertIsNone(second_page['next'])
+
+        datetimes = [entry['datetime'] for entry in first_page['results'] + second_page['results']]
+        self.assertEqual(datetimes, sorted(datetimes, reverse=True))
@@ -1,8 +1,28 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import TimeoutError
+from io import BytesIO
+from tempfile import mkdtemp
+
+from sevchefs_api.images import get_image_url, get_storage_url
+from sevchefs_api.management.commands.purge_image_deletions import delete_keys
 from sevchefs_api.tests import base_tests
 from sevchefs_api.utils import *
-from sevchefs_api.models import RecipeTag, Ingredient
+from sevchefs_api.models import Recipe, RecipeTag, Ingredient
+from sevchefs_api.pools import BoundedProcessPool
+from sevchefs_api.uploads import ImageUploadHandler, ImageUploadRejected
 
 from rest_framework.exceptions import NotFound
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from storages.backends.s3boto import S3BotoStorage
+
+from django.test.utils import override_settings
+from PIL import Image
+from unittest import mock
 
 
 class UtilsTests(base_tests.BaseApiTest):
@@ -21,3 +41,159 @@ class UtilsTests(base_tests.BaseApiTest):
         non_exist_recipe_instruction_id = 1
         self.assertRaises(NotFound, RecipeUtils.get_recipe_instruction_or_404,
                           non_exist_recipe_instruction_id)
+
+    def test_get_request_body_param_parses_body_once(self):
+        body = json.dumps({'recipe_id': 1, 'step_num': 2, 'instruction': 'stir'})
+        request = Request(APIRequestFactory().post('/', body, content_type='application/json'),
+                          parsers=[JSONParser()])
+
+        with mock.patch('rest_framework.parsers.json.loads', wraps=json.loads) as json_loads:
+            self.assertEqual(get_request_body_param(request, 'recipe_id', None), 1)
+            self.assertEqual(get_request_body_param(request, 'step_num', 0), 2)
+            self.assertEqual(get_request_body_param(request, 'instruction', None), 'stir')
+            self.assertEqual(get_request_body_param(request, 'missing', 'default'), 'default')
+        self.assertEqual(json_loads.call_count, 1)
+
+    def test_get_request_body_param_invalid_body_return_on_error(self):
+        request = Request(APIRequestFactory().post('/', '{not json', content_type='application/json'),
+                          parsers=[JSONParser()])
+        self.assertEqual(get_request_body_param(request, 'comment', ''), '')
+
+        request = Request(APIRequestFactory().post('/', '[1, 2]', content_type='application/json'),
+                          parsers=[JSONParser()])
+        self.assertEqual(get_request_body_param(request, 'comment', ''), '')
+
+
+class ImageUrlTests(base_tests.BaseApiTest):
+
+    def setUp(self):
+        super(ImageUrlTests, self).setUp()
+        self.renditions = json.dumps({'source': 'recipe/1/a.png',
+                                      'jpeg': {'320': 'recipe/1/a.w320.jpeg', '640': 'recipe/1/a.w640.jpeg'}})
+
+    def test_image_url_matches_storage_url(self):
+        recipe = Recipe(image='recipe/1/a b.png')
+        self.assertEqual(get_image_url(recipe.image, '', 640), recipe.image.url)
+
+    def test_image_url_picks_narrowest_rendition_wide_enough(self):
+        recipe = Recipe(image='recipe/1/a.png')
+        self.assertEqual(get_image_url(recipe.image, self.renditions, 300), '/media/recipe/1/a.w320.jpeg')
+        self.assertEqual(get_image_url(recipe.image, self.renditions, 1280), '/media/recipe/1/a.w640.jpeg')
+        self.assertIsNone(get_image_url(recipe.image, self.renditions, 640, 'webp'))
+
+    def test_image_url_of_replaced_image_ignores_old_renditions(self):
+        recipe = Recipe(image='recipe/1/b.png')
+        self.assertEqual(get_image_url(recipe.image, self.renditions, 640), '/media/recipe/1/b.png')
+
+    def test_image_url_prefix_setting(self):
+        recipe = Recipe(image='recipe/1/a.png')
+        with self.settings(IMAGE_URL_PREFIX='https://cdn.example.com'):
+            self.assertEqual(get_image_url(recipe.image, self.renditions, 640), 'https://cdn.example.com/recipe/1/a.w640.jpeg')
+
+    def test_signed_storage_urls_are_not_memoized(self):
+        storage = mock.Mock()
+        storage.url.side_effect = lambda key: '/signed/%s?signature=1' % key
+        self.assertEqual(get_storage_url(storage, 'a.png'), '/signed/a.png?signature=1')
+        self.assertEqual(get_storage_url(storage, 'b.png'), '/signed/b.png?signature=1')
+
+
+class ImageUploadHandlerTests(base_tests.BaseApiTest):
+
+    def stream(self, content, chunk_size=1024):
+        handler = ImageUploadHandler()
+        handler.new_file('image', 'food.png', 'image/png', len(content))
+        for start in range(0, len(content), chunk_size):
+            handler.receive_data_chunk(content[start:start + chunk_size], start)
+        return handler.file_complete(len(content))
+
+    def test_streamed_image_is_checked_and_hashed(self):
+        content = open('test_image/food.png', 'rb').read()
+        upload = self.stream(content)
+        self.assertEqual(upload.image_format, 'PNG')
+        self.assertEqual(upload.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual(upload.read(), content)
+        upload.close()
+
+    def test_large_webp_is_sized_from_its_header(self):
+        noise = Image.frombytes('RGB', (600, 400), os.urandom(600 * 400 * 3))
+        for options in ({'lossless': True}, {'quality': 100}):
+            webp = BytesIO()
+            noise.save(webp, 'WEBP', **options)
+            content = webp.getvalue()
+            self.assertGreater(len(content), 256 * 1024)
+
+            with mock.patch('sevchefs_api.uploads.Image.open') as open_image:
+                upload = self.stream(content, chunk_size=64 * 1024)
+            self.assertFalse(open_image.called)
+            self.assertEqual((upload.image_format, upload.image_size), ('WEBP', (600, 400)))
+            upload.close()
+
+        transparent = BytesIO()
+        Image.new('RGBA', (300, 200)).save(transparent, 'WEBP')
+        upload = self.stream(transparent.getvalue())
+        self.assertEqual(upload.image_size, Image.open(BytesIO(transparent.getvalue())).size)
+        upload.close()
+
+    def test_truncated_image_is_rejected(self):
+        with self.assertRaises(ImageUploadRejected):
+            self.stream(open('test_image/food.png', 'rb').read()[:16])
+
+
+class DeleteKeysTests(base_tests.BaseApiTest):
+
+    def test_s3_keys_are_deleted_1000_per_request(self):
+        storage = S3BotoStorage(access_key='test', secret_key='test', bucket='test-bucket')
+        storage._bucket = mock.Mock()
+        error = mock.Mock(key='image/1/1.jpg', code='AccessDenied', message='Access Denied')
+        storage._bucket.delete_keys.side_effect = [mock.Mock(errors=[error]), mock.Mock(errors=[]),
+                                                   mock.Mock(errors=[])]
+
+        keys = ['image/%d/%d.jpg' % (i % 10, i) for i in range(2500)]
+        self.assertEqual(delete_keys(storage, keys), {'image/1/1.jpg'})
+        batches = [call[0][0] for call in storage._bucket.delete_keys.call_args_list]
+        self.assertEqual([len(batch) for batch in batches], [1000, 1000, 500])
+        self.assertEqual(sorted(key for batch in batches for key in batch), sorted(keys))
+
+
+def exit_first_time(flag_path):
+    # the first call kills its worker process, as the OOM killer would
+    if not os.path.exists(flag_path):
+        open(flag_path, 'w').close()
+        os._exit(1)
+    return 'done'
+
+
+@override_settings(TEST_POOL_WORKERS=1)
+class BoundedProcessPoolTests(base_tests.BaseApiTest):
+
+    def setUp(self):
+        super(BoundedProcessPoolTests, self).setUp()
+        self.pool = BoundedProcessPool('TEST_POOL_WORKERS', timeout=5)
+
+    def tearDown(self):
+        self.pool.shutdown()
+        super(BoundedProcessPoolTests, self).tearDown()
+
+    def test_pool_with_dead_worker_is_replaced(self):
+        flag_path = os.path.join(mkdtemp(), 'exited')
+        self.assertEqual(self.pool.run(exit_first_time, flag_path), 'done')
+        self.assertEqual(self.pool.run(abs, -1), 1)
+
+    def test_slow_work_times_out(self):
+        self.pool.timeout = 0.1
+        with self.assertRaises(TimeoutError):
+            self.pool.run(time.sleep, 1)
+
+    def test_slot_is_held_until_timed_out_work_finishes(self):
+        self.pool.timeout = 0.2
+        for i in range(2):
+            with self.assertRaises(TimeoutError):
+                self.pool.run(time.sleep, 2)
+
+        # both slots of the one worker are still taken, so this waits for one
+        started = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            self.pool.run(abs, -1)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(self.pool.free_slots, 0)
+        self.assertEqual(len(self.pool.waiters), 0)
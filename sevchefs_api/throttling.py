@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+from rest_framework.throttling import BaseThrottle
+
+from sevchefs_api.utils import get_request_body_param
+
+
+class TokenBucketStore:
+    """
+    Process local token buckets, least recently used evicted first
+
+    Each key starts with `burst` tokens and regains `rate` tokens per second.
+    """
+
+    def __init__(self, burst, rate, max_keys=100000):
+        self.burst = burst
+        self.rate = rate
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+
+    def refill(self, key, now):
+        tokens, updated = self.buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def consume(self, keys):
+        """
+        Take one token from the bucket of every key, or none if any is empty
+
+        @return: 0 if allowed, otherwise the seconds until every bucket has a token
+        """
+        now = time.monotonic()
+        with self.lock:
+            levels = {key: self.refill(key, now) for key in keys}
+            wait = max([(1 - tokens) / self.rate for tokens in levels.values() if tokens < 1] or [0])
+            for key, tokens in levels.items():
+                self.buckets[key] = (tokens - 1 if not wait else tokens, now)
+                self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+            return wait
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+# a burst of 10 attempts, then one every 6 seconds, per client
+login_buckets = TokenBucketStore(burst=10, rate=1 / 6.0)
+
+# a burst of 5 attempts, then one a minute, per client and email or username; not
+# per account alone, or anyone could lock its owner out with wrong passwords
+account_login_buckets = TokenBucketStore(burst=5, rate=1 / 60.0)
+
+
+class LoginRateThrottle(BaseThrottle):
+    """
+    Limit login attempts per client address, and per client address and email
+    or username, before any password is hashed
+    """
+
+    def allow_request(self, request, view):
+        ident = self.get_ident(request)
+        self.wait_seconds = 0
+        identifier = get_request_body_param(request, 'email', '')
+        if isinstance(identifier, str) and identifier:
+            self.wait_seconds = account_login_buckets.consume(['%s:%s' % (ident, identifier.strip().lower())])
+        if not self.wait_seconds:
+            self.wait_seconds = login_buckets.consume(['ip:%s' % ident])
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
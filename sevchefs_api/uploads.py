@@ -0,0 +1,169 @@
+import hashlib
+import struct
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+from PIL import Image
+
+from sevchefs_api.images import get_ingest_dir
+
+
+# first bytes of the image formats accepted, WebP is checked separately as
+# its magic is split around the file size
+IMAGE_MAGIC = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a')
+
+# give up on reading the size of an image from more than this many leading bytes
+MAX_HEADER_BYTES = 256 * 1024
+
+# allowance for the multipart boundaries and other fields around the image
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class ImageUploadRejected(MultiPartParserError):
+    """
+    Raised while an upload streams in, DRF answers it with 400 Bad Request
+    """
+
+
+# bytes of a WebP file up to the end of the dimensions of its first chunk
+WEBP_HEADER_BYTES = 30
+
+
+def is_webp(header):
+    return header[:4] == b'RIFF' and header[8:12] == b'WEBP'
+
+
+def has_image_magic(header):
+    return header.startswith(IMAGE_MAGIC) or is_webp(header)
+
+
+def webp_size(header):
+    """
+    Read the dimensions of a WebP image from its first WEBP_HEADER_BYTES,
+    as Pillow decodes the whole image to open a WebP file
+
+    @return: (width, height), or None if the first chunk is not a VP8, VP8L
+             or VP8X chunk holding them
+    """
+    chunk = header[12:16]
+    if chunk == b'VP8 ' and header[23:26] == b'\x9d\x01\x2a':
+        # lossy: a key frame, the top two bits of each dimension are its scale
+        width, height = struct.unpack('<HH', header[26:30])
+        return width & 0x3fff, height & 0x3fff
+    if chunk == b'VP8L' and header[20:21] == b'\x2f':
+        # lossless: 14 bits each of width - 1 and height - 1
+        bits = struct.unpack('<I', header[21:25])[0]
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    if chunk == b'VP8X':
+        # extended: 24 bits each of canvas width - 1 and height - 1
+        return int.from_bytes(header[24:27], 'little') + 1, int.from_bytes(header[27:30], 'little') + 1
+    return None
+
+
+class StreamedImageFile(TemporaryUploadedFile):
+    """
+    An uploaded image checked by ImageUploadHandler, written to the ingest
+    directory so it can be staged with a rename
+
+    image_format and image_size are read from its header, sha256 is the
+    digest of its content.
+    """
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        file = tempfile.NamedTemporaryFile(suffix='.upload', dir=get_ingest_dir())
+        super(TemporaryUploadedFile, self).__init__(file, name, content_type, size, charset, content_type_extra)
+        self.image_format = None
+        self.image_size = None
+        self.sha256 = None
+
+
+class ImageUploadHandler(FileUploadHandler):
+    """
+    Stream uploaded images to disk, checking them as they arrive
+
+    The format and dimensions are read from the first chunk, so a file that
+    is not an image, or is larger than IMAGE_UPLOAD_MAX_BYTES or
+    IMAGE_UPLOAD_MAX_PIXELS, is rejected before the rest of it is read. The
+    content is hashed while it streams, and memory use stays at one chunk per
+    upload however large the image is.
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > settings.IMAGE_UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES:
+            raise ImageUploadRejected(self.too_large_message())
+
+    def new_file(self, *args, **kwargs):
+        super(ImageUploadHandler, self).new_file(*args, **kwargs)
+        self.file = StreamedImageFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+        self.header = b''
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.IMAGE_UPLOAD_MAX_BYTES:
+            self.reject(self.too_large_message())
+        if self.file.image_size is None:
+            self.header += raw_data
+            self.read_header()
+        self.hasher.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        if self.file.image_size is None:
+            self.reject('%s is not a valid image' % self.file_name)
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.sha256 = self.hasher.hexdigest()
+        return self.file
+
+    def read_header(self):
+        if len(self.header) >= 12 and not has_image_magic(self.header):
+            self.reject('%s is not a JPEG, PNG, GIF or WebP image' % self.file_name)
+        if is_webp(self.header):
+            if len(self.header) < WEBP_HEADER_BYTES:
+                return
+            image_format, image_size = 'WEBP', webp_size(self.header)
+            if image_size is None:
+                self.reject('could not read the size of %s' % self.file_name)
+        else:
+            try:
+                # only parses the header, the pixels are never decoded here
+                image = Image.open(BytesIO(self.header))
+            except Exception:
+                if len(self.header) >= MAX_HEADER_BYTES:
+                    self.reject('could not read the size of %s' % self.file_name)
+                return
+            image_format, image_size = image.format, image.size
+
+        width, height = image_size
+        if image_format not in settings.IMAGE_UPLOAD_FORMATS:
+            self.reject('%s is not a JPEG, PNG, GIF or WebP image' % self.file_name)
+        if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+            self.reject('%s is %dx%d, images can have at most %d megapixels' % (
+                self.file_name, width, height, settings.IMAGE_UPLOAD_MAX_PIXELS // 10 ** 6))
+        self.file.image_format = image_format
+        self.file.image_size = image_size
+        self.header = None
+
+    def too_large_message(self):
+        return 'images can be at most %d MB' % (settings.IMAGE_UPLOAD_MAX_BYTES // 2 ** 20)
+
+    def reject(self, message):
+        self.file.close()
+        raise ImageUploadRejected(message)
+
+
+class StreamedImageUploadMixin:
+    """
+    Make a view read uploads with ImageUploadHandler
+
+    The handlers are set before DRF wraps the request, as nothing may read
+    the body with the default handlers first.
+    """
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [ImageUploadHandler(request)]
+        return super(StreamedImageUploadMixin, self).initialize_request(request, *args, **kwargs)
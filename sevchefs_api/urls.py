@@ -4,8 +4,10 @@ from sevchefs_api import views
 urlpatterns = [
 
     url(r'^api/v1.0/login2', views.ObtainAuthToken.as_view(), name="auth-token-view"),
+    url(r'^api/v1.0/logout/$', views.LogoutView.as_view(), name="logout-view"),
 
     url(r'api/v1.0/ingredient/list/$', views.IngredientListView.as_view(), name="ingredient-list-view"),
+    url(r'api/v1.0/ingredient/suggest/$', views.IngredientSuggestView.as_view(), name="ingredient-suggest-view"),
 
     url(r'api/v1.0/recipe/(?P<pk>[0-9]+)/$', views.RecipeView.as_view(), name="recipe-view"),
     url(r'api/v1.0/recipe/(?P<pk>[0-9]+)/update/$', views.RecipeEditView.as_view(), name="recipe-edit-view"),
@@ -14,6 +16,7 @@ urlpatterns = [
 
     url(r'api/v1.0/recipe/list/$', views.RecipeListView.as_view(), name="recipe-list-view"),
     url(r'api/v1.0/recipe/upload/$', views.RecipeUploadView.as_view(), name="recipe-upload"),
+    url(r'api/v1.0/recipe/create/$', views.RecipeCreateView.as_view(), name="recipe-create"),
     url(r'api/v1.0/recipe/comment/(?P<pk>[0-9]+)/$', views.CommentRecipeView.as_view(), name="recipe-comment"),
     url(r'api/v1.0/recipe/favourites/$', views.FavouritedRecipeListView.as_view(), name="favourited-recipe-list"),
     url(r'api/v1.0/recipe/favourite/(?P<pk>[0-9]+)/$', views.FavouriteRecipeView.as_view(), name="recipe-favourite"),
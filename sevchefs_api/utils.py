@@ -1,10 +1,19 @@
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
-from rest_framework.exceptions import NotFound
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Prefetch
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.exceptions import NotFound, ParseError, UnsupportedMediaType
 from sevchefs_api.exceptions import NotAuthorized
+from sevchefs_api.images import release_image
 from sevchefs_api.models import *
+from sevchefs_api.search import get_recipe_search
 
-import json
+from calendar import timegm
+from datetime import timedelta
+import hashlib
 
 
 class RecipeUtils:
@@ -16,6 +25,26 @@ class RecipeUtils:
             raise NotFound("Unable to find recipe with id %s" % id)
         return recipe
 
+    def touch_recipes(recipe_ids):
+        """
+        Mark recipes as changed when a row shown in their details changes
+        """
+        Recipe.objects.filter(pk__in=recipe_ids).update(updated_at=timezone.now())
+
+    def get_recipe_detail_or_404(id):
+        """
+        Load a recipe with its ingredients and instructions prefetched for RecipeSerializer
+        """
+        recipes = Recipe.objects.prefetch_related(
+            Prefetch('ingredients', queryset=RecipeIngredient.objects.select_related('ingredient')),
+            'instructions',
+        )
+        try:
+            recipe = recipes.get(pk=id)
+        except ObjectDoesNotExist:
+            raise NotFound("Unable to find recipe with id %s" % id)
+        return recipe
+
     def get_recipe_instruction_or_404(id):
         try:
             recipeInstruction = RecipeInstruction.objects.get(pk=id)
@@ -31,7 +60,44 @@ class RecipeUtils:
         return ingredient
 
     def add_recipe_comments(recipe, user, comment):
-        RecipeComment.objects.create(recipe=recipe, user=user, text=comment)
+        with transaction.atomic():
+            RecipeComment.objects.create(recipe=recipe, user=user, text=comment)
+            Recipe.objects.filter(pk=recipe.pk).update(comment_count=F('comment_count') + 1,
+                                                       updated_at=timezone.now())
+
+    def add_recipe_tags(recipe, tag_ids, tag_texts):
+        """
+        Attach existing tags by id and tags by text, creating the missing
+        ones, with a fixed number of queries however many tags are given
+
+        @return: ids of the tags this call attached, leaving out tags the recipe already had
+        """
+        tag_ids = [tag_id for tag_id in tag_ids if is_id(tag_id)]
+        tag_texts = set(text.strip() for text in tag_texts if isinstance(text, str) and text.strip())
+
+        with transaction.atomic():
+            tags = RecipeTag.objects.in_bulk(tag_ids) if tag_ids else {}
+
+            if tag_texts:
+                existing_texts = set(RecipeTag.objects.filter(text__in=tag_texts).values_list('text', flat=True))
+                missing_texts = tag_texts - existing_texts
+                try:
+                    with transaction.atomic():
+                        RecipeTag.objects.bulk_create([RecipeTag(text=text) for text in missing_texts])
+                except IntegrityError:
+                    # another request created some of these tags meanwhile, reuse them
+                    for text in missing_texts:
+                        RecipeTag.objects.get_or_create(text=text)
+                tags.update((tag.id, tag) for tag in RecipeTag.objects.filter(text__in=tag_texts))
+
+            attached_ids = set(RecipeTagTable.objects.filter(recipe=recipe, tag_id__in=list(tags))
+                                                     .values_list('tag_id', flat=True))
+            added_ids = [tag_id for tag_id in tags if tag_id not in attached_ids]
+            RecipeTagTable.objects.bulk_create([RecipeTagTable(recipe=recipe, tag_id=tag_id) for tag_id in added_ids])
+
+        # bulk_create skips post_save, so refresh the search index here
+        get_recipe_search().index_recipes([recipe.id])
+        return added_ids
 
     def get_recipe_tag_or_none(id):
         try:
@@ -40,12 +106,54 @@ class RecipeUtils:
             tag = None
         return tag
 
+    def add_recipe_time_required(recipe_id, time_required):
+        """
+        Shift the stored total_time_required of a recipe by time_required
+        """
+        if not time_required:
+            return
+        if connection.features.has_native_duration_field:
+            Recipe.objects.filter(pk=recipe_id).update(total_time_required=F('total_time_required') + time_required,
+                                                       updated_at=timezone.now())
+        else:
+            # backends without a native interval type cannot add durations in place
+            RecipeUtils.recount_recipe_time_required(Recipe.objects.filter(pk=recipe_id))
+
+    def recount_recipe_time_required(recipes):
+        """
+        Recompute total_time_required of recipes from their instructions
+        """
+        totals = {}
+        instructions = RecipeInstruction.objects.filter(recipe__in=recipes, time_required__isnull=False)
+        for recipe_id, time_required in instructions.values_list('recipe_id', 'time_required'):
+            totals[recipe_id] = totals.get(recipe_id, timedelta(0)) + time_required
+
+        recipe_count = 0
+        for recipe_id in recipes.values_list('id', flat=True):
+            Recipe.objects.filter(pk=recipe_id).update(total_time_required=totals.get(recipe_id, timedelta(0)),
+                                                       updated_at=timezone.now())
+            recipe_count += 1
+        return recipe_count
+
     def delete_recipe_image(recipe):
-        recipe.image.delete()
+        """
+        Remove the image of recipe, deleting its files once no other recipe,
+        instruction, avatar or timeline event shows the same image
+        """
+        image, renditions = recipe.image, recipe.image_renditions
+        recipe.image = None
+        recipe.image_renditions = ''
+        # leaves the counters, which may have moved since recipe was loaded, alone
+        recipe.save(update_fields=['image', 'image_renditions', 'updated_at'])
+        release_image(image.name, renditions)
         return True
 
     def delete_recipe_instruction_image(recipe_instruction):
-        recipe_instruction.image.delete()
+        image, renditions = recipe_instruction.image, recipe_instruction.image_renditions
+        recipe_instruction.image = None
+        recipe_instruction.image_renditions = ''
+        recipe_instruction.save(update_fields=['image', 'image_renditions'])
+        release_image(image.name, renditions)
         return True
 
     def raise_401_if_recipe_not_belong_user(recipe, request):
@@ -63,17 +171,53 @@ class UserUtils:
         return user
 
 
+def get_request_body(request):
+    """
+    Return the parsed request body through DRF's parsers, which parse the body
+    once and cache it on the request for every later call
+    """
+    try:
+        return request.data
+    except (ParseError, UnsupportedMediaType):
+        return {}
+
+
 def get_request_body_param(request, param, return_on_error):
 
-    body_unicode = request.body.decode('utf-8')
-    try:
-        body = json.loads(body_unicode)
-    except json.decoder.JSONDecodeError:
-        return return_on_error
+    body = get_request_body(request)
 
     try:
         body_param_text = body[param]
-    except KeyError:
+    except (KeyError, TypeError):
         return return_on_error
 
     return body_param_text
+
+
+def is_id(value):
+    # bool is an int too, but true is no one's id
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def make_etag(*parts):
+    """
+    Build an ETag from the values that identify a version of a response
+    """
+    return hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def get_not_modified_response(request, etag, last_modified):
+    """
+    Return a 304 response if the client already holds this version, so that
+    views can answer before loading and serializing anything else
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=timegm(last_modified.utctimetuple()))
+    if response is not None:
+        set_conditional_headers(response, etag, last_modified)
+    return response
+
+
+def set_conditional_headers(response, etag, last_modified):
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = http_date(timegm(last_modified.utctimetuple()))
+    return response
@@ -1,8 +1,13 @@
+from django.db.models import Count, Max
+
 from rest_framework import generics, status
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from sevchefs_api.ingredient_index import MAX_SUGGESTIONS, get_ingredient_index
 from sevchefs_api.models import Ingredient
 from sevchefs_api.serializers import IngredientSerializer
+from sevchefs_api.utils import get_not_modified_response, make_etag, set_conditional_headers
 
 
 class IngredientListView(generics.ListAPIView):
@@ -13,5 +18,42 @@ class IngredientListView(generics.ListAPIView):
         ingredient_list = Ingredient.objects.all()
         return ingredient_list
 
+    def list(self, request, *args, **kwargs):
+        """
+        List every ingredient, or answer 304 Not Modified when If-None-Match or
+        If-Modified-Since show the client already has the current list
+        """
+        version = Ingredient.objects.aggregate(updated_at=Max('updated_at'), count=Count('id'))
+        if version['updated_at'] is None:
+            return super(IngredientListView, self).list(request, *args, **kwargs)
+
+        # the count changes when an ingredient is deleted
+        etag = make_etag('ingredients', version['updated_at'].isoformat(), version['count'])
+        response = get_not_modified_response(request, etag, version['updated_at'])
+        if response is not None:
+            return response
+
+        response = super(IngredientListView, self).list(request, *args, **kwargs)
+        return set_conditional_headers(response, etag, version['updated_at'])
+
     def get_serializer_context(self):
         return {'request': self.request}
+
+
+class IngredientSuggestView(APIView):
+    permission_classes = (AllowAny,)
+
+    def get(self, request):
+        """
+        Suggest ingredients whose name starts with a prefix, most used by recipes first
+
+        @query str prefix: start of the ingredient name
+        @query int limit: number of suggestions, at most 20
+        """
+        prefix = request.query_params.get('prefix', '').strip()
+        limit = request.query_params.get('limit', '')
+        limit = int(limit) if limit.isdigit() else MAX_SUGGESTIONS
+
+        suggestions = get_ingredient_index().suggest(prefix, limit) if prefix else []
+        data = [{'id': ingredient_id, 'name': name} for ingredient_id, name in suggestions]
+        return Response({'data': data}, status=status.HTTP_200_OK)
@@ -6,23 +6,34 @@ from django.db import transaction
 from django.db.models import F
 
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import ensure_csrf_cookie
 
 from rest_framework import generics
 from rest_framework import status
 from rest_framework.decorators import permission_classes
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny, IsAuthenticated
 
-from sevchefs_api.models import Recipe, RecipeTagTable, UserRecipeFavourites, \
-    RecipeIngredient, RecipeInstruction, ActivityTimeline, Ingredient
-from sevchefs_api.serializers import RecipeSerializer, RecipeListSerializer, \
+from sevchefs_api.images import ingest_image
+from sevchefs_api.ingredient_index import get_ingredient_index
+from sevchefs_api.pagination import RecipeCursorPagination
+from sevchefs_api.payload_cache import get_recipe_data
+from sevchefs_api.search import get_recipe_search
+from sevchefs_api.models import Recipe, UserRecipeFavourites, \
+    RecipeIngredient, RecipeInstruction, ActivityTimeline, Ingredient, RecipeTag, \
+    normalize_ingredient_name
+from sevchefs_api.serializers import RecipeListSerializer, \
     RecipeImageSerializer, RecipeIngredientSerializer, RecipeInstructionImageSerializer
+from sevchefs_api.uploads import StreamedImageUploadMixin
 
 from sevchefs_api.utils import RecipeUtils, UserUtils
-from sevchefs_api.utils import get_request_body_param
+from sevchefs_api.utils import get_not_modified_response, get_request_body_param, is_id, make_etag, \
+    set_conditional_headers
 
 
 class FavouritedRecipeListView(generics.ListAPIView):
@@ -50,13 +61,18 @@ class FavouriteRecipeView(APIView):
 
         recipe = RecipeUtils.get_recipe_or_404(pk)
         userprofile = request.user.userprofile
-        UserRecipeFavourites.objects.create(userprofile=userprofile, recipe=recipe)
+        with transaction.atomic():
+            UserRecipeFavourites.objects.create(userprofile=userprofile, recipe=recipe)
+            Recipe.objects.filter(pk=recipe.pk).update(favourited_count=F('favourited_count') + 1,
+                                                       updated_at=timezone.now())
 
         ActivityTimeline.objects.create(user=request.user,
                                         target_user=recipe.upload_by_user,
                                         main_object_image=userprofile.avatar,
+                                        main_object_image_renditions=userprofile.avatar_renditions,
                                         target_object_image=recipe.image,
-                                        summary_text="{0} favourited {1} recipe")
+                                        target_object_image_renditions=recipe.image_renditions,
+                                        event_type=ActivityTimeline.FAVOURITE)
 
         return Response({"success": True}, status=status.HTTP_201_CREATED)
 
@@ -67,7 +83,11 @@ class FavouriteRecipeView(APIView):
         recipe = RecipeUtils.get_recipe_or_404(pk)
         userprofile = request.user.userprofile
         recipe_favouited = UserRecipeFavourites.objects.filter(userprofile=userprofile, recipe=recipe)
-        recipe_favouited.delete()
+        with transaction.atomic():
+            unfavourited_count, _ = recipe_favouited.delete()
+            if unfavourited_count:
+                Recipe.objects.filter(pk=recipe.pk).update(favourited_count=F('favourited_count') - unfavourited_count,
+                                                           updated_at=timezone.now())
 
         return Response({"success": True}, status=status.HTTP_200_OK)
 
@@ -97,8 +117,10 @@ class CommentRecipeView(APIView):
         ActivityTimeline.objects.create(user=comment_user,
                                         target_user=recipe.upload_by_user,
                                         main_object_image=comment_user.userprofile.avatar,
+                                        main_object_image_renditions=comment_user.userprofile.avatar_renditions,
                                         target_object_image=recipe.image,
-                                        summary_text="{0} commented on {1} recipe")
+                                        target_object_image_renditions=recipe.image_renditions,
+                                        event_type=ActivityTimeline.COMMENT)
 
         return Response({"success": True}, status=status.HTTP_201_CREATED)
 
@@ -110,10 +132,24 @@ class RecipeView(APIView):
     def get(self, request, pk):
         """
         View recipe details by id
+
+        Answers 304 Not Modified when If-None-Match or If-Modified-Since show
+        the client already has the current details
         """
-        recipe = RecipeUtils.get_recipe_or_404(pk)
-        serializer = RecipeSerializer(recipe, context={'request': self.request})
-        return Response({'data': serializer.data}, status=status.HTTP_200_OK)
+        updated_at = Recipe.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            raise NotFound("Unable to find recipe with id %s" % pk)
+
+        # is_favourited differs between users
+        etag = make_etag('recipe', pk, updated_at.isoformat(), request.user.id)
+        response = get_not_modified_response(request, etag, updated_at)
+        if response is not None:
+            return response
+
+        data = get_recipe_data(pk, updated_at, request.user)
+        response = Response({'data': data}, status=status.HTTP_200_OK)
+        patch_vary_headers(response, ('Authorization', 'Cookie'))
+        return set_conditional_headers(response, etag, updated_at)
 
 
 class RecipeEditView(APIView):
@@ -127,16 +163,21 @@ class RecipeEditView(APIView):
         r_desc = get_request_body_param(request, 'description', None)
         r_diff_level = get_request_body_param(request, 'difficulty_level', None)
 
+        edited_fields = ['updated_at']
         if r_name is not None:
             recipe.name = r_name
+            edited_fields.append('name')
 
         if r_desc is not None:
             recipe.description = r_desc
+            edited_fields.append('description')
 
         if r_diff_level is not None:
             recipe.difficulty_level = r_diff_level
+            edited_fields.append('difficulty_level')
 
-        recipe.save()
+        # the counters and total time loaded with the recipe may be stale by now
+        recipe.save(update_fields=edited_fields)
         return Response({'success': True}, status=status.HTTP_200_OK)
 
 
@@ -144,6 +185,7 @@ class UserRecipeListView(generics.ListAPIView):
     queryset = Recipe.objects.all()
     serializer_class = RecipeListSerializer
     permission_classes = (AllowAny,)
+    pagination_class = RecipeCursorPagination
 
     def get_queryset(self):
         user_pk = self.kwargs['pk']
@@ -158,6 +200,7 @@ class UserRecipeListView(generics.ListAPIView):
 class RecipeListView(generics.ListAPIView):
     serializer_class = RecipeListSerializer
     permission_classes = (AllowAny,)
+    pagination_class = RecipeCursorPagination
 
     def get_queryset(self):
 
@@ -165,10 +208,20 @@ class RecipeListView(generics.ListAPIView):
 
         search = self.request.query_params.get('q', None)
         if search is not None and search is not '':
-            recipes = recipes.filter(name__icontains=search)
+            recipes = get_recipe_search().search(recipes, search)
+
+        max_duration_minute = self.request.query_params.get('max_duration_minute', None)
+        if max_duration_minute is not None and max_duration_minute.isdigit():
+            recipes = recipes.filter(total_time_required__lte=timedelta(minutes=int(max_duration_minute)))
 
         return recipes
 
+    def get_pagination_ordering(self):
+        # search results are paged from the most relevant recipe down
+        if self.request.query_params.get('q', ''):
+            return ('-search_rank', '-id')
+        return None
+
     def get_serializer_context(self):
         return {'request': self.request}
 
@@ -203,6 +256,164 @@ class RecipeUploadView(APIView):
         return Response({"success": True, "recipe_id": recipe.id}, status=status.HTTP_201_CREATED)
 
 
+class RecipeCreateView(APIView):
+
+    def post(self, request):
+        """
+        Create a recipe together with its instructions, ingredients and tags in one transaction
+
+        @body str name: recipe name
+        @body str description: recipe description
+        @body int difficulty: difficulty level from 1 - 5
+        @body object[] instructions: {instruction, duration_minute, duration_hour} in step order
+        @body object[] ingredients: {ingredient_id or ingredient_name, serving_size}
+        @body int[] tag_ids: list of tag id
+        @body string[] tag_texts: list of tag text, tags that do not exist yet are created
+        @raise HTTP_400_BAD_REQUEST: errors of every invalid field and item, nothing is created
+        """
+        recipe_name = get_request_body_param(request, 'name', '')
+        recipe_desc = get_request_body_param(request, 'description', '')
+        recipe_diff = get_request_body_param(request, 'difficulty', 0)
+        instructions = get_request_body_param(request, 'instructions', [])
+        ingredients = get_request_body_param(request, 'ingredients', [])
+        tag_ids = get_request_body_param(request, 'tag_ids', [])
+        tag_texts = get_request_body_param(request, 'tag_texts', [])
+
+        errors = {}
+        recipe_name = recipe_name.strip() if isinstance(recipe_name, str) else ''
+        recipe_desc = recipe_desc.strip() if isinstance(recipe_desc, str) else ''
+        if not recipe_name:
+            errors['name'] = 'recipe name must not be empty'
+        if not recipe_desc:
+            errors['description'] = 'recipe desc must not be empty'
+        if not isinstance(instructions, list):
+            errors['instructions'] = 'instructions must be a list'
+            instructions = []
+        if not isinstance(ingredients, list):
+            errors['ingredients'] = 'ingredients must be a list'
+            ingredients = []
+        if not isinstance(tag_ids, list):
+            errors['tag_ids'] = 'tag ids must be a list'
+            tag_ids = []
+        if not isinstance(tag_texts, list):
+            errors['tag_texts'] = 'tag texts must be a list'
+            tag_texts = []
+
+        recipe_diff = recipe_diff if isinstance(recipe_diff, int) else 0
+
+        instruction_rows, instruction_errors = self.validate_instructions(instructions)
+        if any(instruction_errors):
+            errors['instructions'] = instruction_errors
+
+        ingredient_rows, ingredient_errors = self.validate_ingredients(ingredients)
+        if any(ingredient_errors):
+            errors['ingredients'] = ingredient_errors
+
+        tag_id_errors = self.validate_tag_ids(tag_ids)
+        if any(tag_id_errors):
+            errors['tag_ids'] = tag_id_errors
+
+        tag_text_errors = ['' if isinstance(text, str) and text.strip() else 'tag text must not be empty'
+                           for text in tag_texts]
+        if any(tag_text_errors):
+            errors['tag_texts'] = tag_text_errors
+
+        if errors:
+            return Response({'detail': 'recipe is not valid', 'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        total_time_required = sum((row.time_required for row in instruction_rows), timedelta(0))
+
+        with transaction.atomic():
+            recipe = Recipe.objects.create(name=recipe_name, description=recipe_desc,
+                                           difficulty_level=recipe_diff,
+                                           upload_by_user=request.user,
+                                           total_time_required=total_time_required)
+            for row in instruction_rows + ingredient_rows:
+                row.recipe = recipe
+            RecipeInstruction.objects.bulk_create(instruction_rows)
+            RecipeIngredient.objects.bulk_create(ingredient_rows)
+            get_ingredient_index().add_usage(row.ingredient_id for row in ingredient_rows)
+            # also reindexes the recipe for search now that its ingredients are in
+            RecipeUtils.add_recipe_tags(recipe, tag_ids, tag_texts)
+
+        return Response({"success": True, "recipe_id": recipe.id}, status=status.HTTP_201_CREATED)
+
+    def validate_instructions(self, instructions):
+        """
+        @return: unsaved RecipeInstruction rows and a list of errors, one per instruction
+        """
+        rows, errors = [], []
+        for step_num, item in enumerate(instructions, start=1):
+            if not isinstance(item, dict):
+                errors.append({'instruction': 'instruction must be an object'})
+                continue
+
+            text = item.get('instruction', '')
+            if not isinstance(text, str) or not text.strip():
+                errors.append({'instruction': 'Instruction for recipe must not be empty'})
+                continue
+
+            dur_min = item.get('duration_minute', 0)
+            dur_hour = item.get('duration_hour', 0)
+            dur_min = dur_min if isinstance(dur_min, int) else 0
+            dur_hour = dur_hour if isinstance(dur_hour, int) else 0
+
+            rows.append(RecipeInstruction(step_num=step_num, instruction=text.strip(),
+                                          time_required=timedelta(hours=dur_hour, minutes=dur_min)))
+            errors.append({})
+        return rows, errors
+
+    def validate_ingredients(self, ingredients):
+        """
+        Resolve every ingredient by id or by name with one query each
+
+        @return: unsaved RecipeIngredient rows and a list of errors, one per ingredient
+        """
+        items = [item if isinstance(item, dict) else {} for item in ingredients]
+        ids = [item['ingredient_id'] for item in items if is_id(item.get('ingredient_id'))]
+        names = [item['ingredient_name'].strip() for item in items
+                 if 'ingredient_id' not in item and isinstance(item.get('ingredient_name'), str)
+                 and item['ingredient_name'].strip()]
+
+        by_id = Ingredient.objects.in_bulk(ids) if ids else {}
+        by_name = get_ingredient_index().get_ingredients(names) if names else {}
+
+        rows, errors = [], []
+        for item in items:
+            serving_size = item.get('serving_size', '')
+            serving_size = serving_size.strip() if isinstance(serving_size, str) else ''
+
+            if 'ingredient_id' in item:
+                ingredient = by_id.get(item['ingredient_id']) if is_id(item['ingredient_id']) else None
+                missing = 'Unable to find ingredient with id %s' % item['ingredient_id']
+            else:
+                name = item.get('ingredient_name', '')
+                name = name.strip() if isinstance(name, str) else ''
+                ingredient = by_name.get(normalize_ingredient_name(name))
+                missing = 'ingredient with name %s could not be found' % name
+
+            error = {}
+            if not serving_size:
+                error['serving_size'] = 'serving size of ingredient must not be empty'
+            if ingredient is None:
+                error['ingredient'] = missing
+            if not error:
+                rows.append(RecipeIngredient(ingredient=ingredient, serving_size=serving_size))
+            errors.append(error)
+        return rows, errors
+
+    def validate_tag_ids(self, tag_ids):
+        """
+        Check every tag id exists with one query
+
+        @return: a list of errors, one per tag id
+        """
+        ids = [tag_id for tag_id in tag_ids if is_id(tag_id)]
+        found = set(RecipeTag.objects.filter(id__in=ids).values_list('id', flat=True)) if ids else set()
+        return ['' if is_id(tag_id) and tag_id in found else 'Unable to find tag with id %s' % tag_id
+                for tag_id in tag_ids]
+
+
 # TODO: TEST
 class RecipeAddTagView(APIView):
 
@@ -211,6 +422,7 @@ class RecipeAddTagView(APIView):
         Add tags to a recipe
 
         @body int[] tag_ids: list of tag id
+        @body string[] tag_texts: list of tag text, tags that do not exist yet are created
         @raise HTTP_401_UNAUTHORIZED: only creator of recipe can add tag to recipe
         """
 
@@ -218,21 +430,26 @@ class RecipeAddTagView(APIView):
         RecipeUtils.raise_401_if_recipe_not_belong_user(recipe, request)
 
         tag_ids = get_request_body_param(request, 'tag_ids', [])
+        tag_texts = get_request_body_param(request, 'tag_texts', [])
 
-        tag_ids_added = []
-        for tag_id in tag_ids:
-            tag = RecipeUtils.get_recipe_tag_or_none(tag_id)
-            if tag is not None:
-                RecipeTagTable.objects.create(recipe=recipe, tag=tag)
-                tag_ids_added.append(tag_id)
+        errors = {}
+        if not isinstance(tag_ids, list):
+            errors['tag_ids'] = 'tag ids must be a list'
+        if not isinstance(tag_texts, list):
+            errors['tag_texts'] = 'tag texts must be a list'
+        if errors:
+            return Response({'detail': 'tags are not valid', 'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        tag_ids_added = RecipeUtils.add_recipe_tags(recipe, tag_ids, tag_texts)
 
         response_data = {'tag_ids_added': tag_ids_added,
-                         'tag_ids_not_added': list(set(tag_ids) - set(tag_ids_added))}
+                         'tag_ids_not_added': [tag_id for tag_id in tag_ids
+                                               if not is_id(tag_id) or tag_id not in tag_ids_added]}
 
         return Response({'data': response_data}, status=status.HTTP_201_CREATED)
 
 
-class RecipeImageUploadView(APIView):
+class RecipeImageUploadView(StreamedImageUploadMixin, APIView):
 
     def post(self, request, pk):
 
@@ -242,19 +459,20 @@ class RecipeImageUploadView(APIView):
         serializer = RecipeImageSerializer(recipe, data=request.data)
         if serializer.is_valid():
 
-            recipe_just_uploaded = (not recipe.image)
-
-            RecipeUtils.delete_recipe_image(recipe)
-            serializer.save()
-
-            if recipe_just_uploaded:
-                ActivityTimeline.objects.create(user=request.user,
-                                                target_user=None,
-                                                main_object_image=request.user.userprofile.avatar,
-                                                target_object_image=recipe.image,
-                                                summary_text="{0} uploaded a new recipe")
-
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            # the upload is stored and resized in the background, which
+            # replaces the old image and fills in the image of the timeline
+            targets = []
+            if not recipe.image:
+                userprofile = request.user.userprofile
+                activity = ActivityTimeline.objects.create(user=request.user,
+                                                           target_user=None,
+                                                           main_object_image=userprofile.avatar,
+                                                           main_object_image_renditions=userprofile.avatar_renditions,
+                                                           event_type=ActivityTimeline.UPLOAD)
+                targets.append((ActivityTimeline._meta.label, activity.id, 'target_object_image'))
+
+            ingest_image(recipe, 'image', serializer.validated_data['image'], targets)
+            return Response({"success": True}, status=status.HTTP_202_ACCEPTED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, pk):
@@ -304,7 +522,7 @@ class RecipeInstructionView(APIView):
         return Response({"success": True}, status=status.HTTP_200_OK)
 
 
-class RecipeInstructionImageView(APIView):
+class RecipeInstructionImageView(StreamedImageUploadMixin, APIView):
     def post(self, request, pk):
 
         recipe_instruction = RecipeUtils.get_recipe_instruction_or_404(pk)
@@ -312,9 +530,9 @@ class RecipeInstructionImageView(APIView):
 
         serializer = RecipeInstructionImageSerializer(recipe_instruction, data=request.data)
         if serializer.is_valid():
-            RecipeUtils.delete_recipe_instruction_image(recipe_instruction)
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            ingest_image(recipe_instruction, 'image', serializer.validated_data['image'],
+                         touch_recipe_ids=[recipe_instruction.recipe_id])
+            return Response({"success": True}, status=status.HTTP_202_ACCEPTED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -364,7 +582,7 @@ class RecipeAddIngredientByNameView(APIView):
         recipe = RecipeUtils.get_recipe_or_404(pk)
         RecipeUtils.raise_401_if_recipe_not_belong_user(recipe, request)
 
-        ingredient = Ingredient.objects.filter(name__iexact=ingredient_name).first()
+        ingredient = get_ingredient_index().get_ingredient(ingredient_name)
         if not ingredient:
             return Response({'detail': 'ingredient with name %s could not be found' % ingredient_name}, status=status.HTTP_400_BAD_REQUEST)
 
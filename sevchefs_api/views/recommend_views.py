@@ -1,28 +1,52 @@
-from random import randint
+from random import choice
 
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework import status
 
-from sevchefs_api.models import Recipe
-from sevchefs_api.serializers import RecipeSerializer
+from sevchefs_api.models import Recipe, RecipeRecommendation
+from sevchefs_api.recommend import TOP_K, get_random_recipe
+from sevchefs_api.payload_cache import get_recipe_data
 
 
 class RecommendRecipeView(APIView):
 
     permission_classes = (AllowAny, )
 
+    def get_recommended_recipe_ids(self, user):
+        """
+        Return the precomputed top recipes of user, or the overall top recipes
+        when user has none yet
+        """
+        if not user.is_anonymous():
+            recipe_ids = list(RecipeRecommendation.objects.filter(user=user)
+                                                          .values_list('recipe_id', flat=True)[:TOP_K])
+            if recipe_ids:
+                return recipe_ids
+
+            recommendations = RecipeRecommendation.objects.filter(user=None).exclude(recipe__upload_by_user=user)
+        else:
+            recommendations = RecipeRecommendation.objects.filter(user=None)
+        return list(recommendations.values_list('recipe_id', flat=True)[:TOP_K])
+
     def get(self, request):
-        recipes = Recipe.objects.all()
-        if not request.user.is_anonymous():
-            recipes = recipes.exclude(upload_by_user=request.user)
-
-        if recipes.count() <= 0:
-            return Response({"data": None}, status=status.HTTP_200_OK)
-
-        min = 0
-        max = recipes.count() - 1
-        recommended = recipes[randint(min, max)]
-        serializer = RecipeSerializer(recommended)
-        return Response({'data': serializer.data}, status=status.HTTP_200_OK)
+        """
+        Recommend a recipe picked from the top recipes precomputed for the
+        login user by the refresh_recommendations command
+        """
+        recipe_ids = self.get_recommended_recipe_ids(request.user)
+        if recipe_ids:
+            recommended = Recipe.objects.only('id', 'updated_at').get(pk=choice(recipe_ids))
+        else:
+            # no recommendations computed yet
+            recipes = Recipe.objects.all()
+            if not request.user.is_anonymous():
+                recipes = recipes.exclude(upload_by_user=request.user)
+
+            recommended = get_random_recipe(recipes.only('id', 'updated_at'))
+            if recommended is None:
+                return Response({"data": None}, status=status.HTTP_200_OK)
+
+        data = get_recipe_data(recommended.id, recommended.updated_at, request.user)
+        return Response({'data': data}, status=status.HTTP_200_OK)
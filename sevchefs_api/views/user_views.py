@@ -1,7 +1,8 @@
 from django.contrib.auth import authenticate
-from django.contrib.auth.models import User
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import F
 from django.http import Http404
+from django.utils import timezone
 
 from rest_framework import generics
 from rest_framework import status
@@ -10,40 +11,57 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from sevchefs_api.models import UserProfile, ActivityTimeline
-from sevchefs_api.utils import get_request_body_param
+from sevchefs_api.exceptions import SignupConflict
+from sevchefs_api.models import UserProfile, ActivityTimeline, ActivityTimelineInbox
+from sevchefs_api.pagination import TimelineCursorPagination
+from sevchefs_api.throttling import LoginRateThrottle
+from sevchefs_api.utils import get_not_modified_response, get_request_body_param, make_etag, \
+    set_conditional_headers
+from sevchefs_api.signup import sign_up
 from sevchefs_api.serializers import UserProfileSerializer, ActivityTimelineSerializer
 
-import re
-
 
 class ObtainAuthToken(APIView):
 
     permission_classes = (AllowAny, )
+    throttle_classes = (LoginRateThrottle, )
 
     def post(self, request):
+        """
+        Log in with an email or a username and get the auth token
 
+        @body email: email or username of the user
+        @body password: password of the user
+        @raise HTTP_429_TOO_MANY_REQUESTS: too many attempts from this client, or from it for this account
+        """
         username = get_request_body_param(request, 'email', '')
         password = get_request_body_param(request, 'password', '')
 
         if not (username and password):
             return Response({"detail": "credentials not entered"}, status.HTTP_400_BAD_REQUEST)
 
-        email_regex_pattern = '^([\w\.]+)@((?:[\w]+\.)+)([a-zA-Z]{2,4})$'
-        if re.search(email_regex_pattern, username) is not None:
-            try:
-                username = User.objects.get(email=username).username
-            except User.DoesNotExist:
-                username = None
-
+        # EmailOrUsernameBackend loads the token along with the user
         user = authenticate(username=username, password=password)
         if user is None:
             return Response({"non_field_errors": ["Unable to log in with provided credentials."]}, status.HTTP_400_BAD_REQUEST)
 
-        token = Token.objects.get(user=user)
+        try:
+            token = user.auth_token
+        except Token.DoesNotExist:
+            token = Token.objects.create(user=user)
         return Response({"token": token.key}, status.HTTP_200_OK)
 
 
+class LogoutView(APIView):
+
+    def post(self, request):
+        """
+        Log out by deleting the token of the login user, a new one is created on the next login
+        """
+        Token.objects.filter(user=request.user).delete()
+        return Response({"success": True}, status=status.HTTP_200_OK)
+
+
 class UserSignUpView(APIView):
 
     permission_classes = (AllowAny,)
@@ -60,7 +78,7 @@ class UserSignUpView(APIView):
         @body password: user comment on the recipe
 
         @return: http status of query
-        @raise HTTP_400_BAD_REQUEST: signup details must not be empty
+        @raise HTTP_400_BAD_REQUEST: signup details must not be empty, or the username or email is taken
         """
 
         email = get_request_body_param(request, 'email', '')
@@ -75,9 +93,9 @@ class UserSignUpView(APIView):
             return Response({'detail': 'password must not be empty'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            User.objects.create_user(username, email, password)
-        except:
-            return self.response_with_400("The username entered already exists")
+            sign_up(username, email, password)
+        except SignupConflict as e:
+            return self.response_with_400(e.detail)
         return Response({"success": True}, status=status.HTTP_201_CREATED)
 
 
@@ -99,15 +117,24 @@ class FollowUserView(APIView):
         """
         current_userprofile = self.get_userprofile(request.user.id)
         to_follow_userprofile = self.get_userprofile(pk)
-        try:
-            current_userprofile.follows.add(pk)
+
+        with transaction.atomic():
+            # the follower's row stays locked until commit, so a second follow waits and then sees this one
+            UserProfile.objects.select_for_update().filter(pk=current_userprofile.pk).exists()
+            if current_userprofile.follows.filter(pk=to_follow_userprofile.pk).exists():
+                return self.response_with_400("Already followed user")
+            current_userprofile.follows.add(to_follow_userprofile)
+            UserProfile.objects.filter(pk=current_userprofile.pk).update(following_count=F('following_count') + 1,
+                                                                         updated_at=timezone.now())
+            UserProfile.objects.filter(pk=to_follow_userprofile.pk).update(followers_count=F('followers_count') + 1,
+                                                                           updated_at=timezone.now())
             ActivityTimeline.objects.create(user=request.user,
                                             target_user=to_follow_userprofile.user,
                                             main_object_image=current_userprofile.avatar,
+                                            main_object_image_renditions=current_userprofile.avatar_renditions,
                                             target_object_image=to_follow_userprofile.avatar,
-                                            summary_text="{0} followed {1} on CookTasty")
-        except:
-            return self.response_with_400("Already followed user")
+                                            target_object_image_renditions=to_follow_userprofile.avatar_renditions,
+                                            event_type=ActivityTimeline.FOLLOW)
         return Response({"success": True}, status=status.HTTP_201_CREATED)
 
     def delete(self, request, pk):
@@ -116,10 +143,18 @@ class FollowUserView(APIView):
         """
         current_userprofile = self.get_userprofile(request.user.id)
         to_unfollow_userprofile = self.get_userprofile(pk)
-        if current_userprofile.follows.filter(pk=pk).exists():
-            current_userprofile.follows.remove(pk)
-        else:
-            return self.response_with_400("Not already a follower of the target user")
+        follow = UserProfile.follows.through.objects.filter(from_userprofile=current_userprofile,
+                                                            to_userprofile=to_unfollow_userprofile)
+
+        with transaction.atomic():
+            # only the request that removed the follow moves the counters
+            unfollowed_count, _ = follow.delete()
+            if not unfollowed_count:
+                return self.response_with_400("Not already a follower of the target user")
+            UserProfile.objects.filter(pk=current_userprofile.pk).update(
+                following_count=F('following_count') - unfollowed_count, updated_at=timezone.now())
+            UserProfile.objects.filter(pk=to_unfollow_userprofile.pk).update(
+                followers_count=F('followers_count') - unfollowed_count, updated_at=timezone.now())
         return Response({"success": True}, status=status.HTTP_200_OK)
 
 
@@ -130,11 +165,23 @@ class UserProfileView(APIView):
     def get(self, request, pk):
         """
         View a user profile
+
+        Answers 304 Not Modified when If-None-Match or If-Modified-Since show
+        the client already has the current profile
         """
-        user = User.objects.get(pk=pk)
-        user_profile = UserProfile.objects.get(user=user)
+        updated_at = UserProfile.objects.filter(user_id=pk).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            raise Http404()
+
+        etag = make_etag('userprofile', pk, updated_at.isoformat())
+        response = get_not_modified_response(request, etag, updated_at)
+        if response is not None:
+            return response
+
+        user_profile = UserProfile.objects.select_related('user').get(user_id=pk)
         serializer = UserProfileSerializer(user_profile)
-        return Response({'data': serializer.data}, status=status.HTTP_200_OK)
+        response = Response({'data': serializer.data}, status=status.HTTP_200_OK)
+        return set_conditional_headers(response, etag, updated_at)
 
 
 # support search
@@ -153,11 +200,17 @@ class UserProfileListView(generics.ListAPIView):
 class UserActivityTimelineView(generics.ListAPIView):
     permission_classes = (IsAuthenticated,)
     serializer_class = ActivityTimelineSerializer
+    pagination_class = TimelineCursorPagination
 
     def get_queryset(self):
-        timelines = ActivityTimeline.objects.filter(Q(user=self.request.user) |
-                                                    Q(target_user=self.request.user)).order_by('-datetime')
-        return timelines
+        inbox = ActivityTimelineInbox.objects.filter(owner=self.request.user) \
+                                             .select_related('activity__user', 'activity__target_user')
+        return inbox
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer([entry.activity for entry in page], many=True)
+        return self.get_paginated_response(serializer.data)
 
     def get_serializer_context(self):
         return {'request': self.request}
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 """
 
 import os
+import tempfile
 import dj_database_url
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -87,11 +88,15 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'sevchefs_api.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
-    'PAGE_SIZE': 10
+    'PAGE_SIZE': 10,
+    # Proxies in front of the app that append the client address to X-Forwarded-For, so throttles
+    # key on the address the nearest one saw rather than one the client made up: the Heroku router,
+    # or none when self hosting, where REMOTE_ADDR is the client
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0 if os.environ.get('SELF_HOSTING') else 1)),
 }
 
 ROOT_URLCONF = 'the7chefs.urls'
@@ -132,6 +137,64 @@ DATABASES = {
 db_from_env = dj_database_url.config()
 DATABASES['default'].update(db_from_env)
 
+# Cache shared by the processes of a host when CACHE_LOCATION names a directory,
+# otherwise each process keeps its own
+if os.environ.get('CACHE_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Widths in pixels of the WebP and JPEG renditions made of every uploaded image
+IMAGE_RENDITION_WIDTHS = [160, 320, 640, 1280]
+
+# Background threads storing uploaded images and their renditions, 0 to do it in the request
+IMAGE_INGEST_WORKERS = int(os.environ.get('IMAGE_INGEST_WORKERS', 1))
+
+# Processes each server process resizes images in, 0 to resize in the ingest thread
+IMAGE_RESIZE_WORKERS = int(os.environ.get('IMAGE_RESIZE_WORKERS', 1))
+
+# Local directory uploads wait in until they are stored
+IMAGE_INGEST_DIR = os.environ.get('IMAGE_INGEST_DIR', os.path.join(tempfile.gettempdir(), 'sevchefs-ingest'))
+
+# CDN or media URL images are served from, e.g. https://cdn.example.com/, defaults to the storage's URLs
+IMAGE_URL_PREFIX = os.environ.get('IMAGE_URL_PREFIX')
+
+# Largest recipe and instruction image accepted, in bytes and in pixels, and the Pillow formats accepted
+IMAGE_UPLOAD_MAX_BYTES = int(os.environ.get('IMAGE_UPLOAD_MAX_BYTES', 10 * 1024 * 1024))
+IMAGE_UPLOAD_MAX_PIXELS = int(os.environ.get('IMAGE_UPLOAD_MAX_PIXELS', 40 * 1000 * 1000))
+IMAGE_UPLOAD_FORMATS = ['JPEG', 'PNG', 'GIF', 'WEBP']
+
+# Log in with either an email or a username
+AUTHENTICATION_BACKENDS = [
+    'sevchefs_api.backends.EmailOrUsernameBackend',
+]
+
+# Hash new passwords with argon2id; older hashes are upgraded on login
+PASSWORD_HASHERS = [
+    'sevchefs_api.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
+# Argon2 cost, memory in KiB; raising any of them rehashes passwords on login
+ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST', 2))
+ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST', 19456))
+ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM', 1))
+
+# Processes each server process hashes passwords in, so logins and signups do not hold
+# its threads on the GIL; 0 to hash inline
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 